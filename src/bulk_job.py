@@ -0,0 +1,318 @@
+"""
+Offline bulk embedding jobs. A JSONL or Parquet corpus on the volume is read,
+embedded and written as a pipeline (the next batches are read and embedded
+while earlier ones are written) into a memory-mapped embeddings.npy plus an
+ids.jsonl index whose line i holds the id of row i. checkpoint.json is
+updated after every written batch, so re-sending the same job after a
+preemption resumes where it stopped.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_FILE = "embeddings.npy"
+IDS_FILE = "ids.jsonl"
+CHECKPOINT_FILE = "checkpoint.json"
+INPUT_FORMATS = ("jsonl", "parquet")
+OUTPUT_DTYPES = ("float32", "float16")
+
+
+def resolve_volume_path(path: str, root: str) -> str:
+    """real path of path (relative paths are taken from root), which must lie below root"""
+    root = os.path.realpath(root)
+    real = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([real, root]) != root:
+        raise ValueError(f"{path} is outside {root}")
+    return real
+
+
+def detect_format(path: str, input_format: Optional[str] = None) -> str:
+    input_format = input_format or ("parquet" if path.endswith((".parquet", ".pq")) else "jsonl")
+    if input_format not in INPUT_FORMATS:
+        raise ValueError(f"Invalid input_format '{input_format}', expected one of {list(INPUT_FORMATS)}")
+    return input_format
+
+
+def _parquet():
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet input needs pyarrow, which is not installed; use JSONL") from None
+    return pq
+
+
+def _check_text(text: Any, row: int, record_id: Any, path: str, text_field: str):
+    if not isinstance(text, str):
+        raise ValueError(f"Row {row} (id {record_id!r}) of {path} has no string field '{text_field}'")
+
+
+def count_rows(path: str, input_format: str) -> int:
+    if input_format == "parquet":
+        return _parquet().ParquetFile(path).metadata.num_rows
+    with open(path, "rb") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def read_batches(
+    path: str,
+    input_format: str,
+    text_field: str,
+    id_field: str,
+    batch_size: int,
+    start_row: int = 0,
+    start_offset: int = 0,
+) -> Iterator[Tuple[List[str], List[Any], int]]:
+    """
+    (texts, ids, resume offset) per batch from start_row on. The offset is the
+    JSONL byte position after the batch, so resuming seeks instead of
+    re-parsing (Parquet skips start_row rows). Rows without an id get their
+    row number.
+    """
+    row = start_row
+    if input_format == "parquet":
+        parquet = _parquet().ParquetFile(path)
+        has_ids = id_field in parquet.schema_arrow.names
+        columns = [text_field] + ([id_field] if has_ids and id_field != text_field else [])
+        skip = start_row
+        for record_batch in parquet.iter_batches(batch_size=batch_size, columns=columns):
+            if skip >= record_batch.num_rows:
+                skip -= record_batch.num_rows
+                continue
+            record_batch, skip = record_batch.slice(skip), 0
+            texts = record_batch.column(text_field).to_pylist()
+            if has_ids:
+                ids = record_batch.column(id_field).to_pylist()
+            else:
+                ids = list(range(row, row + len(texts)))
+            for i, (text, record_id) in enumerate(zip(texts, ids)):
+                _check_text(text, row + i, record_id, path, text_field)
+            row += len(texts)
+            yield texts, ids, 0
+        return
+
+    with open(path, "rb") as f:
+        f.seek(start_offset)
+        texts, ids = [], []
+        for line in iter(f.readline, b""):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Row {row} of {path} is not valid JSON: {e}") from None
+            if not isinstance(record, dict):
+                raise ValueError(f"Row {row} of {path} is a JSON {type(record).__name__}, not an object")
+            record_id = record.get(id_field, row)
+            _check_text(record.get(text_field), row, record_id, path, text_field)
+            texts.append(record[text_field])
+            ids.append(record_id)
+            row += 1
+            if len(texts) == batch_size:
+                yield texts, ids, f.tell()
+                texts, ids = [], []
+        if texts:
+            yield texts, ids, f.tell()
+
+
+def load_checkpoint(output_dir: str) -> Optional[dict]:
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(output_dir: str, state: dict):
+    """written to a temp file and renamed, so a preemption never leaves half a checkpoint"""
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{path}.tmp", path)
+
+
+async def run_bulk_job(
+    service,
+    input_path: str,
+    output_dir: str,
+    model: str,
+    text_field: str = "text",
+    id_field: str = "id",
+    instruction: Optional[str] = None,
+    prompt_type: Optional[str] = None,
+    input_format: Optional[str] = None,
+    dtype: str = "float32",
+    batch_size: Optional[int] = None,
+    max_inflight: Optional[int] = None,
+) -> dict:
+    """
+    Embeds the corpus at input_path into output_dir (both below
+    BULK_JOB_ROOT) and returns a summary. Re-running a finished job returns
+    its summary; an output_dir that holds a different job is rejected.
+    """
+    config = service.config
+    input_path = resolve_volume_path(input_path, config.bulk_job_root)
+    output_dir = resolve_volume_path(output_dir, config.bulk_job_root)
+    input_format = detect_format(input_path, input_format)
+    if dtype not in OUTPUT_DTYPES:
+        raise ValueError(f"Invalid dtype '{dtype}', expected one of {list(OUTPUT_DTYPES)}")
+    # unknown models fail before any file is touched
+    service.get_router(model)
+    batch_size = batch_size or config.bulk_job_batch_size
+    max_inflight = max_inflight or config.bulk_job_inflight
+    os.makedirs(output_dir, exist_ok=True)
+
+    job = dict(
+        input_path=input_path,
+        model=model,
+        text_field=text_field,
+        id_field=id_field,
+        instruction=instruction,
+        prompt_type=prompt_type,
+        dtype=dtype,
+    )
+    state = load_checkpoint(output_dir)
+    if state is not None and state["job"] != job:
+        raise ValueError(f"{output_dir} holds the output of a different job, use a new output_dir")
+    if state is None:
+        total_rows = await asyncio.to_thread(count_rows, input_path, input_format)
+        state = dict(
+            job=job,
+            status="running",
+            total_rows=total_rows,
+            rows_done=0,
+            input_offset=0,
+            ids_offset=0,
+            dim=None,
+            prompt_tokens=0,
+        )
+        save_checkpoint(output_dir, state)
+    resumed_from = state["rows_done"]
+    if resumed_from:
+        logger.info(f"Resuming bulk job into {output_dir} at row {resumed_from}/{state['total_rows']}")
+
+    start = time.perf_counter()
+    if state["status"] != "complete":
+        await _embed_corpus(service, state, output_dir, input_format, batch_size, max_inflight)
+        state["status"] = "complete"
+        save_checkpoint(output_dir, state)
+    seconds = time.perf_counter() - start
+    embedded = state["rows_done"] - resumed_from
+    return {
+        "object": "bulk_embedding",
+        "status": state["status"],
+        "model": model,
+        "rows": state["total_rows"],
+        "dim": state["dim"],
+        "dtype": dtype,
+        "resumed_from_row": resumed_from,
+        "embedded_rows": embedded,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(embedded / seconds, 1) if seconds > 0 else None,
+        "usage": {"prompt_tokens": state["prompt_tokens"], "total_tokens": state["prompt_tokens"]},
+        "output": {
+            "embeddings": os.path.join(output_dir, EMBEDDINGS_FILE),
+            "ids": os.path.join(output_dir, IDS_FILE),
+            "checkpoint": os.path.join(output_dir, CHECKPOINT_FILE),
+        },
+    }
+
+
+async def _embed_corpus(
+    service, state: dict, output_dir: str, input_format: str, batch_size: int, max_inflight: int
+):
+    """reader -> engine -> writer; batches are written and checkpointed in corpus order"""
+    job = state["job"]
+    embeddings_path = os.path.join(output_dir, EMBEDDINGS_FILE)
+    ids_path = os.path.join(output_dir, IDS_FILE)
+    # drop ids appended after the last checkpoint
+    with open(ids_path, "ab") as f:
+        f.truncate(state["ids_offset"])
+    matrix = np.load(embeddings_path, mmap_mode="r+") if state["dim"] is not None else None
+
+    batches = read_batches(
+        job["input_path"],
+        input_format,
+        job["text_field"],
+        job["id_field"],
+        batch_size,
+        start_row=state["rows_done"],
+        start_offset=state["input_offset"],
+    )
+    # a slot per batch from reading until it is written, so at most max_inflight
+    # batches are read or embedded ahead of the writer
+    slots = asyncio.Semaphore(max_inflight)
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def produce():
+        try:
+            while True:
+                await slots.acquire()
+                batch = await asyncio.to_thread(next, batches, None)
+                if batch is None:
+                    break
+                texts, ids, offset = batch
+                embedding = asyncio.ensure_future(
+                    service.embed_array(texts, job["model"], job["instruction"], job["prompt_type"])
+                )
+                await queue.put((ids, offset, embedding))
+        except Exception as e:  # noqa: BLE001  (handed to the writer, which raises it)
+            await queue.put(e)
+            return
+        await queue.put(None)
+
+    def write(ids: List[Any], offset: int, vectors: np.ndarray, usage: int):
+        first = state["rows_done"]
+        if first + len(ids) > state["total_rows"]:
+            raise ValueError(f"{job['input_path']} has more rows than when the job started")
+        matrix[first : first + len(ids)] = vectors
+        matrix.flush()
+        with open(ids_path, "a") as f:
+            f.writelines(json.dumps(i) + "\n" for i in ids)
+            f.flush()
+            os.fsync(f.fileno())
+            ids_offset = f.tell()
+        state.update(
+            rows_done=first + len(ids),
+            input_offset=offset,
+            ids_offset=ids_offset,
+            prompt_tokens=state["prompt_tokens"] + int(usage),
+        )
+        save_checkpoint(output_dir, state)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            ids, offset, embedding = item
+            vectors, usage = await embedding
+            if matrix is None:
+                matrix = np.lib.format.open_memmap(
+                    embeddings_path,
+                    mode="w+",
+                    dtype=job["dtype"],
+                    shape=(state["total_rows"], vectors.shape[1]),
+                )
+                state["dim"] = int(vectors.shape[1])
+            await asyncio.to_thread(write, ids, offset, vectors, usage)
+            slots.release()
+            logger.info(f"Bulk job {output_dir}: {state['rows_done']}/{state['total_rows']} rows")
+    finally:
+        producer.cancel()
+        while not queue.empty():
+            item = queue.get_nowait()
+            if isinstance(item, tuple):
+                item[2].cancel()
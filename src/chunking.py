@@ -0,0 +1,107 @@
+"""
+Long-input handling: split token sequences into overlapping windows and pool
+the per-window embeddings back to one vector per input.
+"""
+
+from typing import List, Tuple
+
+import numpy as np
+
+POOLING_METHODS = ("mean", "weighted")
+
+
+def split_windows(token_ids: List[int], window: int, overlap: int) -> List[List[int]]:
+    """overlapping windows of at most `window` tokens covering token_ids"""
+    if overlap >= window:
+        raise ValueError(f"chunk overlap ({overlap}) must be smaller than the window ({window})")
+    if len(token_ids) <= window:
+        return [token_ids]
+    stride = window - overlap
+    windows = []
+    for start in range(0, len(token_ids), stride):
+        windows.append(token_ids[start : start + window])
+        if start + window >= len(token_ids):
+            break
+    return windows
+
+
+def chunk_token_ids(
+    token_ids: List[List[int]], window: int, overlap: int
+) -> Tuple[List[List[int]], List[int], List[int]]:
+    """
+    Flattens the windows of every input into one list.
+    Returns (windows, owner input index per window, window count per input).
+    """
+    windows, owners, counts = [], [], []
+    for index, ids in enumerate(token_ids):
+        input_windows = split_windows(ids, window, overlap)
+        windows.extend(input_windows)
+        owners.extend([index] * len(input_windows))
+        counts.append(len(input_windows))
+    return windows, owners, counts
+
+
+def chunk_texts(
+    tokenizer, token_ids: List[List[int]], window: int, overlap: int
+) -> Tuple[List[str], List[int], List[int], List[int]]:
+    """
+    Text version of chunk_token_ids for engines that tokenize themselves:
+    takes the inputs' token ids (without special tokens) and returns
+    (window texts, owners, window count per input, tokens per window).
+    """
+    windows, owners, counts = chunk_token_ids(token_ids, window, overlap)
+    window_texts = tokenizer.batch_decode(windows)
+    return window_texts, owners, counts, [len(w) for w in windows]
+
+
+def pool_windows(
+    vectors,
+    owners: List[int],
+    n_inputs: int,
+    method: str = "mean",
+    weights: List[int] | None = None,
+) -> np.ndarray:
+    """
+    Pools window vectors into one L2-normalized vector per input, in the
+    input dtype (float16 or float32). "weighted"
+    weights each window by its token count, so a short tail window does not
+    count as much as a full one.
+    """
+    if method not in POOLING_METHODS:
+        raise ValueError(f"Invalid chunk pooling '{method}', expected one of {list(POOLING_METHODS)}")
+    vectors = np.asarray(vectors)
+    # accumulate in float32, hand back half precision if that is what came in
+    out_dtype = np.float16 if vectors.dtype == np.float16 else np.float32
+    vectors = vectors.astype(np.float32, copy=False)
+    if method == "weighted" and weights is not None:
+        w = np.asarray(weights, dtype=np.float32)
+    else:
+        w = np.ones(len(owners), dtype=np.float32)
+    pooled = np.zeros((n_inputs, vectors.shape[-1]), dtype=np.float32)
+    np.add.at(pooled, owners, vectors * w[:, None])
+    totals = np.zeros(n_inputs, dtype=np.float32)
+    np.add.at(totals, owners, w)
+    pooled /= totals[:, None]
+    norms = np.linalg.norm(pooled, axis=-1, keepdims=True)
+    return (pooled / np.maximum(norms, 1e-12)).astype(out_dtype, copy=False)
+
+
+def char_spans_to_token_spans(
+    offsets: List[Tuple[int, int]], spans: List[Tuple[int, int]]
+) -> List[Tuple[int, int]]:
+    """
+    Maps [start, end) character spans to [start, end) token spans using a
+    tokenizer offset mapping. A token belongs to a span if their character
+    ranges overlap; special tokens (empty offsets) never do.
+    """
+    token_spans = []
+    for start, end in spans:
+        hits = [
+            i
+            for i, (token_start, token_end) in enumerate(offsets)
+            if token_end > token_start and token_start < end and token_end > start
+        ]
+        if not hits:
+            raise ValueError(f"Character span ({start}, {end}) covers no tokens")
+        token_spans.append((hits[0], hits[-1] + 1))
+    return token_spans
@@ -4,6 +4,18 @@ from functools import cached_property
 
 DEFAULT_BATCH_SIZE = 32
 DEFAULT_BACKEND = "torch"
+DEFAULT_WARMUP_LENGTHS = "16,128,512"
+DEFAULT_ONNX_CACHE_DIR = "/runpod-volume/onnx"
+DEFAULT_BULK_THRESHOLD = 64
+DEFAULT_BULK_MAX_WAIT_MS = 500.0
+DEFAULT_CHUNK_WINDOW_TOKENS = 8192
+DEFAULT_CHUNK_OVERLAP_TOKENS = 256
+DEFAULT_TOKEN_CACHE_SIZE = 65536
+DEFAULT_BULK_JOB_ROOT = "/runpod-volume"
+DEFAULT_BULK_JOB_BATCH_SIZE = 1024
+DEFAULT_BULK_JOB_INFLIGHT = 2
+DEFAULT_DRAIN_TIMEOUT = 300.0
+DEFAULT_MODEL_RELOAD_ROOT = "/runpod-volume"
 
 if not os.environ.get("INFINITY_QUEUE_SIZE"):
     # how many items can be in the queue
@@ -48,11 +60,127 @@ class EmbeddingServiceConfig:
         batch_sizes = [int(batch_size) for batch_size in batch_sizes]
         return batch_sizes
 
+    @cached_property
+    def max_batch_tokens(self) -> list[int]:
+        """
+        padded tokens (items x longest item) per engine batch, 0 batches by
+        BATCH_SIZES alone; BATCH_SIZES then caps the items of short inputs
+        """
+        max_tokens = self._get_no_required_multi("MAX_BATCH_TOKENS", 0)
+        return [int(tokens) for tokens in max_tokens]
+
+    @cached_property
+    def batch_calibration(self) -> bool:
+        """probe the largest batch that fits per WARMUP_LENGTHS bucket at startup"""
+        return os.environ.get("BATCH_CALIBRATION", "false").lower() == "true"
+
     @cached_property
     def dtypes(self) -> list[str]:
         dtypes = self._get_no_required_multi("DTYPES", "auto")
         return dtypes
 
+    @cached_property
+    def replicas(self) -> list[int]:
+        replicas = self._get_no_required_multi("REPLICAS", 1)
+        return [int(replica) for replica in replicas]
+
+    @cached_property
+    def devices(self) -> list[list[str]]:
+        """
+        device placement per model, comma separated and assigned round-robin
+        to its replicas, e.g. DEVICES="cuda:0,cuda:1;cuda:1"
+        """
+        devices = self._get_no_required_multi("DEVICES", "auto")
+        return [[d.strip() for d in device.split(",") if d.strip()] for device in devices]
+
     @cached_property
     def runpod_max_concurrency(self) -> int:
         return int(os.environ.get("RUNPOD_MAX_CONCURRENCY", 300))
+
+    @cached_property
+    def model_warmup(self) -> bool:
+        return os.environ.get("MODEL_WARMUP", "false").lower() == "true"
+
+    @cached_property
+    def warmup_lengths(self) -> list[int]:
+        """approximate token lengths of the warmup inputs, one shape per bucket"""
+        lengths = os.environ.get("WARMUP_LENGTHS", DEFAULT_WARMUP_LENGTHS).split(",")
+        return [int(length) for length in lengths if length.strip()]
+
+    @cached_property
+    def compile(self) -> bool:
+        """torch.compile the engines; pair with MODEL_WARMUP so shapes are captured before traffic"""
+        return os.environ.get("COMPILE", "false").lower() == "true"
+
+    @cached_property
+    def onnx_cache_dir(self) -> str:
+        return os.environ.get("ONNX_CACHE_DIR", DEFAULT_ONNX_CACHE_DIR)
+
+    @cached_property
+    def onnx_quantize(self) -> bool:
+        return os.environ.get("ONNX_QUANTIZE", "false").lower() == "true"
+
+    @cached_property
+    def onnx_parity_threshold(self) -> float:
+        """min cosine similarity (embeddings) / 1 - max score diff (rerankers) vs torch"""
+        return float(os.environ.get("ONNX_PARITY_THRESHOLD", 0.99))
+
+    @cached_property
+    def bulk_threshold(self) -> int:
+        """requests with more items than this are scheduled as bulk unless marked otherwise"""
+        return int(os.environ.get("PRIORITY_BULK_THRESHOLD", DEFAULT_BULK_THRESHOLD))
+
+    @cached_property
+    def bulk_slice_sizes(self) -> list[int]:
+        """items per bulk slice, defaults to the model batch size"""
+        slice_sizes = os.environ.get("PRIORITY_SLICE_SIZES")
+        if not slice_sizes:
+            return self.batch_sizes
+        return [int(size) for size in self._get_no_required_multi("PRIORITY_SLICE_SIZES")]
+
+    @cached_property
+    def bulk_max_wait(self) -> float:
+        """
+        seconds a bulk slice waits for interactive work to pause before it
+        goes anyway, so bulk work progresses under steady interactive load
+        """
+        return float(os.environ.get("PRIORITY_BULK_MAX_WAIT_MS", DEFAULT_BULK_MAX_WAIT_MS)) / 1000
+
+    @cached_property
+    def chunk_window_tokens(self) -> int:
+        """window size for long-input chunking, should not exceed the model context"""
+        return int(os.environ.get("CHUNK_WINDOW_TOKENS", DEFAULT_CHUNK_WINDOW_TOKENS))
+
+    @cached_property
+    def chunk_overlap_tokens(self) -> int:
+        return int(os.environ.get("CHUNK_OVERLAP_TOKENS", DEFAULT_CHUNK_OVERLAP_TOKENS))
+
+    @cached_property
+    def token_cache_size(self) -> int:
+        """tokenized texts kept per model, 0 disables the cache"""
+        return int(os.environ.get("TOKEN_CACHE_SIZE", DEFAULT_TOKEN_CACHE_SIZE))
+
+    @cached_property
+    def bulk_job_root(self) -> str:
+        """bulk embedding jobs only read and write below this directory"""
+        return os.environ.get("BULK_JOB_ROOT", DEFAULT_BULK_JOB_ROOT)
+
+    @cached_property
+    def bulk_job_batch_size(self) -> int:
+        """corpus rows per read/embed/write step (and per checkpoint)"""
+        return int(os.environ.get("BULK_JOB_BATCH_SIZE", DEFAULT_BULK_JOB_BATCH_SIZE))
+
+    @cached_property
+    def bulk_job_inflight(self) -> int:
+        """batches being embedded at once while earlier ones are written"""
+        return int(os.environ.get("BULK_JOB_INFLIGHT", DEFAULT_BULK_JOB_INFLIGHT))
+
+    @cached_property
+    def drain_timeout(self) -> float:
+        """seconds to wait for in-flight work before engines are stopped anyway"""
+        return float(os.environ.get("DRAIN_TIMEOUT", DEFAULT_DRAIN_TIMEOUT))
+
+    @cached_property
+    def model_reload_root(self) -> str:
+        """models can only be reloaded from paths below this directory"""
+        return os.environ.get("MODEL_RELOAD_ROOT", DEFAULT_MODEL_RELOAD_ROOT)
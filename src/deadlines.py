@@ -0,0 +1,38 @@
+"""
+Per-request deadlines, as absolute unix timestamps so they survive hops
+between the gateway, the model servers and RunPod jobs.
+"""
+
+import time
+from typing import Optional
+
+DEADLINE_HEADER = "X-Request-Deadline"
+
+
+class DeadlineExceeded(TimeoutError):
+    """raised instead of starting work whose caller has stopped waiting"""
+
+
+def resolve_deadline(
+    deadline: Optional[float] = None, timeout_ms: Optional[float] = None
+) -> Optional[float]:
+    """earliest of an absolute deadline and now + timeout_ms, None if neither is set"""
+    return earliest(
+        float(deadline) if deadline is not None else None,
+        time.time() + float(timeout_ms) / 1000 if timeout_ms is not None else None,
+    )
+
+
+def earliest(*deadlines: Optional[float]) -> Optional[float]:
+    """earliest of the deadlines that are set, None if none is"""
+    candidates = [deadline for deadline in deadlines if deadline is not None]
+    return min(candidates) if candidates else None
+
+
+def expired(deadline: Optional[float]) -> bool:
+    return deadline is not None and time.time() >= deadline
+
+
+def check_deadline(deadline: Optional[float]):
+    if expired(deadline):
+        raise DeadlineExceeded(f"Request deadline passed {time.time() - deadline:.3f}s ago")
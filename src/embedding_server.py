@@ -4,78 +4,372 @@ Serves Qwen3-Embedding-0.6B model via FastAPI
 """
 
 import os
-from fastapi import FastAPI, HTTPException
+import asyncio
+from fastapi import FastAPI, Header, HTTPException, Response
 from pydantic import BaseModel
-from typing import List
+from typing import List, Literal, Optional, Tuple
+import numpy as np
 import torch
 from transformers import AutoModel, AutoTokenizer
+from chunking import char_spans_to_token_spans, chunk_token_ids, pool_windows
+from inference_worker import InferenceWorker, QueueFullError, RequestTooLargeError
+from deadlines import DeadlineExceeded
+from shared_weights import DEFAULT_SHARED_WEIGHTS_DIR, load_shared
+from token_cache import TokenCache
+from json_response import NumpyJSONResponse
+from profiling import DEFAULT_PROFILE_DIR, Profiler, install as install_profiling
+from tracing import Tracer, install as install_tracing
+from packing import PACKING_MODES, PaddingStats, mean_pool, pack_groups, pack_inputs
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+app = FastAPI(default_response_class=NumpyJSONResponse)
 
 # Model configuration
 MODEL_PATH = "/models/Qwen3-Embedding-0.6B"
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+CHUNK_WINDOW_TOKENS = int(os.getenv("CHUNK_WINDOW_TOKENS", 8192))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", 256))
+# texts batched per forward pass across requests, and texts allowed to wait
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 32))
+MAX_QUEUE_ITEMS = int(os.getenv("MAX_QUEUE_ITEMS", 1024))
+# uvicorn worker processes; with SHARED_WEIGHTS (the default for several
+# workers) CPU weights are memory-mapped once and shared by all of them
+WORKERS = int(os.getenv("WORKERS", 1))
+SHARED_WEIGHTS = os.getenv("SHARED_WEIGHTS", str(WORKERS > 1)).lower() == "true"
+SHARED_WEIGHTS_DIR = os.getenv("SHARED_WEIGHTS_DIR", DEFAULT_SHARED_WEIGHTS_DIR)
+# "varlen" (flash-attention) or "mask" (block-diagonal mask) run each batch
+# as unpadded packed rows of at most PACK_MAX_TOKENS tokens; "off" pads
+PACKING = os.getenv("PACKING", "off")
+PACK_MAX_TOKENS = int(os.getenv("PACK_MAX_TOKENS", 8192))
+# finished request spans: kept for GET /debug/traces ("buffer"), logged as
+# OTLP JSON lines ("log"), "both" or "off"
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "buffer")
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", 2048))
+# opt-in profiles of requests slower than PROFILE_SLOW_MS or sent with
+# X-Profile: 1, the newest PROFILE_MAX_COUNT kept in PROFILE_DIR
+PROFILING = os.getenv("PROFILING", "false").lower() == "true"
+PROFILE_DIR = os.getenv("PROFILE_DIR", DEFAULT_PROFILE_DIR)
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", 1000))
+PROFILE_MAX_COUNT = int(os.getenv("PROFILE_MAX_COUNT", 20))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 20))
+# compute dtype; embeddings stay in it until they are encoded for the response
+TORCH_DTYPE = {"float16": torch.float16, "bfloat16": torch.bfloat16}.get(
+    os.getenv("TORCH_DTYPE", "float32"), torch.float32
+)
+# tokenized texts kept in the LRU token cache
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 65536))
 
 # Load model on startup
 model = None
 tokenizer = None
+worker = None
+padding_stats = PaddingStats()
+tracer = Tracer("embedding-server", TRACE_EXPORT, TRACE_BUFFER_SIZE)
+profiler = Profiler(
+    PROFILING, PROFILE_DIR, PROFILE_SLOW_MS, PROFILE_MAX_COUNT, interval=PROFILE_INTERVAL_MS / 1000
+)
+# installed first so it runs inside the trace span and profiles carry its request id
+install_profiling(app, profiler)
+install_tracing(app, tracer)
+token_cache = None
+
+def load_weights(**kwargs):
+    """
+    the model, with the shared mmap'd weights when SHARED_WEIGHTS is on (never
+    loading a private copy first), else privately loaded
+    """
+    if SHARED_WEIGHTS and device.type == "cpu":
+        return load_shared(AutoModel, MODEL_PATH, SHARED_WEIGHTS_DIR, **kwargs)
+    if SHARED_WEIGHTS:
+        # each process keeps its own device copy; host memory is released after .to()
+        logger.info(f"SHARED_WEIGHTS only applies to CPU serving, ignoring it on {device}")
+    return AutoModel.from_pretrained(MODEL_PATH, **kwargs)
 
 @app.on_event("startup")
 async def load_model():
-    global model, tokenizer
+    global model, tokenizer, worker, token_cache
     logger.info(f"Loading embedding model from {MODEL_PATH}")
     
+    if PACKING not in PACKING_MODES:
+        raise ValueError(f"Invalid PACKING '{PACKING}', expected one of {list(PACKING_MODES)}")
+    # varlen packing needs flash-attention kernels
+    model_kwargs = {"attn_implementation": "flash_attention_2"} if PACKING == "varlen" else {}
+
+    if WORKERS > 1 and device.type == "cpu":
+        # split the cores between the workers instead of oversubscribing them
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // WORKERS))
+
     try:
         tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
-        model = AutoModel.from_pretrained(MODEL_PATH).to(device)
+        model = load_weights(torch_dtype=TORCH_DTYPE, **model_kwargs)
+        model = model.to(device)
         model.eval()
         logger.info(f"Model loaded successfully on {device}")
     except Exception as e:
         logger.error(f"Failed to load model: {e}")
         raise
 
+    token_cache = TokenCache(
+        lambda texts: tokenizer(texts, truncation=True)["input_ids"],
+        max_entries=TOKEN_CACHE_SIZE,
+    )
+    worker = InferenceWorker(
+        embed_batch, max_batch_items=MAX_BATCH_SIZE, max_queue_items=MAX_QUEUE_ITEMS, tracer=tracer, name="embed"
+    )
+    await worker.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    if worker:
+        await worker.stop()
+
+def to_host(embeddings: torch.Tensor) -> np.ndarray:
+    """
+    One device-to-host copy for the whole batch, through pinned memory and
+    without leaving the compute dtype (bfloat16, which numpy lacks, widens
+    losslessly to float32).
+    """
+    if embeddings.dtype == torch.bfloat16:
+        embeddings = embeddings.float()
+    if embeddings.is_cuda:
+        host = torch.empty(embeddings.shape, dtype=embeddings.dtype, pin_memory=True)
+        host.copy_(embeddings, non_blocking=True)
+        torch.cuda.current_stream(embeddings.device).synchronize()
+        return host.numpy()
+    return embeddings.numpy()
+
+def embedding_response(
+    embeddings: np.ndarray, encoding_format: str, chunks=None, tokenization=None
+):
+    if encoding_format == "float16":
+        embeddings = np.asarray(embeddings, dtype="<f2")
+        headers = {
+            "X-Embedding-Shape": ",".join(str(dim) for dim in embeddings.shape),
+            "X-Embedding-Dtype": "float16",
+        }
+        if chunks is not None:
+            headers["X-Embedding-Chunks"] = ",".join(str(n) for n in chunks)
+        if tokenization is not None:
+            headers["X-Tokenize-Saved-Ms"] = str(tokenization["tokenize_saved_ms"])
+        return Response(
+            content=embeddings.tobytes(), media_type="application/octet-stream", headers=headers
+        )
+    # the array is written straight to JSON, never as a list of Python floats
+    return NumpyJSONResponse(
+        {"embeddings": embeddings, "chunks": chunks, "tokenization": tokenization}
+    )
+
+async def run_inference(coro):
+    """
+    awaits work queued on the inference thread, mapping backpressure to 429,
+    requests larger than the queue to 413 and work dropped at its deadline to 504
+    """
+    try:
+        return await coro
+    except RequestTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
 class EmbeddingRequest(BaseModel):
     texts: List[str]
+    # "mean" or "weighted": embed long texts as overlapping windows and pool them
+    chunk_pooling: Optional[str] = None
+    chunk_window: int = CHUNK_WINDOW_TOKENS
+    chunk_overlap: int = CHUNK_OVERLAP_TOKENS
+    # "float16" returns the raw little-endian float16 matrix as application/octet-stream
+    encoding_format: Literal["float", "float16"] = "float"
+
+# /embed responds with {"embeddings": [[float]], "chunks": [int] | null,
+# "tokenization": {...} | null} (token cache hits/misses and tokenization
+# time spent and saved), serialized from the array by NumpyJSONResponse
+
+class SpanEmbeddingRequest(BaseModel):
+    texts: List[str]
+    # per text, [start, end) spans in characters or tokens (without special tokens)
+    spans: List[List[Tuple[int, int]]]
+    span_unit: Literal["char", "token"] = "char"
 
-class EmbeddingResponse(BaseModel):
-    embeddings: List[List[float]]
+# /embed_spans responds with {"embeddings": [[[float]]]}: per text, one vector per span
 
 @app.get("/health")
 async def health():
-    return {"status": "healthy", "model": "Qwen3-Embedding-0.6B", "device": str(device)}
+    return {
+        "status": "healthy",
+        "model": "Qwen3-Embedding-0.6B",
+        "device": str(device),
+        "queue": worker.stats() if worker else None,
+        "padding": padding_stats.stats(),
+        "token_cache": token_cache.stats() if token_cache else None,
+    }
 
 @app.post("/embed")
-async def embed(request: EmbeddingRequest):
+async def embed(
+    request: EmbeddingRequest, x_request_deadline: Optional[float] = Header(None)
+):
     if not model:
         raise HTTPException(status_code=503, detail="Model not loaded")
     
     try:
-        with torch.no_grad():
-            # Tokenize inputs
-            inputs = tokenizer(
-                request.texts,
-                padding=True,
-                truncation=True,
-                return_tensors="pt"
-            ).to(device)
-            
-            # Generate embeddings
-            outputs = model(**inputs)
-            embeddings = outputs.last_hidden_state.mean(dim=1)  # Mean pooling
-            
-            # Convert to list
-            embeddings_list = embeddings.cpu().numpy().tolist()
-            
-        return EmbeddingResponse(embeddings=embeddings_list)
+        if request.chunk_pooling:
+            return await run_inference(worker.call(
+                embed_chunked, request, weight=len(request.texts), deadline=x_request_deadline
+            ))
+
+        # tokenize through the cache off the loop and alongside the running batch,
+        # then hand the ids to the inference thread
+        with tracer.span("tokenize", texts=len(request.texts)):
+            token_ids, tokenization = await asyncio.to_thread(token_cache.encode, request.texts)
+        embeddings = await run_inference(worker.submit(token_ids, deadline=x_request_deadline))
+        return embedding_response(embeddings, request.encoding_format, tokenization=tokenization)
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Embedding error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def embed_batch(token_ids: List[List[int]]) -> np.ndarray:
+    """
+    Runs on the inference thread with the (cached) token ids of one or more
+    requests; returns one row per text in the compute dtype
+    """
+    lengths = [len(ids) for ids in token_ids]
+    with torch.no_grad():
+        if PACKING != "off":
+            padding_stats.record(lengths, packed=True)
+            pooled = []
+            for group in pack_groups(lengths, PACK_MAX_TOKENS):
+                inputs = pack_inputs([token_ids[i] for i in group], PACKING, device, model.dtype)
+                hidden = model(**inputs).last_hidden_state
+                pooled.append(mean_pool(hidden, [lengths[i] for i in group]))
+            return to_host(torch.cat(pooled).to(model.dtype))
+        padding_stats.record(lengths, packed=False)
+
+        # Pad the pre-tokenized inputs
+        inputs = tokenizer.pad(
+            {"input_ids": token_ids},
+            padding=True,
+            return_tensors="pt"
+        ).to(device)
+        
+        # Generate embeddings; masked mean pooling keeps each text independent
+        # of whichever other requests share its batch
+        outputs = model(**inputs)
+        # (accumulated in float32 so long fp16 sequences cannot overflow)
+        hidden = outputs.last_hidden_state
+        mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        embeddings = (hidden * mask).sum(dim=1, dtype=torch.float32) / mask.sum(dim=1, dtype=torch.float32)
+        
+        return to_host(embeddings.to(hidden.dtype))
+
+def embed_chunked(request: EmbeddingRequest):
+    """Embeds the windows of all texts in one forward pass and pools them per text"""
+    token_ids = tokenizer(request.texts, add_special_tokens=False)["input_ids"]
+    windows, owners, counts = chunk_token_ids(
+        token_ids, request.chunk_window, request.chunk_overlap
+    )
+    with torch.no_grad():
+        inputs = tokenizer.pad(
+            {"input_ids": windows}, padding=True, return_tensors="pt"
+        ).to(device)
+        outputs = model(**inputs)
+        # masked mean pooling per window so padding does not dilute short windows
+        hidden = outputs.last_hidden_state
+        mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        window_embeddings = (hidden * mask).sum(dim=1, dtype=torch.float32) / mask.sum(dim=1, dtype=torch.float32)
+        window_embeddings = to_host(window_embeddings.to(hidden.dtype))
+
+    pooled = pool_windows(
+        window_embeddings,
+        owners,
+        len(request.texts),
+        request.chunk_pooling,
+        [len(window) for window in windows],
+    )
+    return embedding_response(pooled, request.encoding_format, chunks=counts)
+
+@app.post("/embed_spans")
+async def embed_spans(
+    request: SpanEmbeddingRequest, x_request_deadline: Optional[float] = Header(None)
+):
+    """
+    Late chunking: runs every full text through the model once and mean-pools
+    the contextualized token states of each span, so N chunk vectors of a
+    document cost one forward pass and all of them see the whole document.
+    Texts longer than the model context are truncated; spans past it are rejected.
+    """
+    if not model:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    if len(request.spans) != len(request.texts):
+        raise HTTPException(status_code=422, detail="spans must have one list per text")
+    for i, spans in enumerate(request.spans):
+        if not spans:
+            raise HTTPException(status_code=422, detail=f"Text {i} has no spans")
+
+    try:
+        return await run_inference(worker.call(
+            embed_spans_sync, request, weight=len(request.texts), deadline=x_request_deadline
+        ))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Span embedding error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def embed_spans_sync(request: SpanEmbeddingRequest) -> NumpyJSONResponse:
+    """Runs on the inference thread; invalid spans raise a 422"""
+    try:
+        encoded = tokenizer(
+            request.texts,
+            truncation=True,
+            return_offsets_mapping=request.span_unit == "char",
+            return_special_tokens_mask=True,
+        )
+        token_spans = []
+        for i, spans in enumerate(request.spans):
+            if request.span_unit == "char":
+                text_spans = char_spans_to_token_spans(encoded["offset_mapping"][i], spans)
+            else:
+                # token spans count content tokens only; shift past leading special tokens
+                lead = 0
+                for is_special in encoded["special_tokens_mask"][i]:
+                    if not is_special:
+                        break
+                    lead += 1
+                text_spans = [(start + lead, end + lead) for start, end in spans]
+            n_tokens = len(encoded["input_ids"][i])
+            for start, end in text_spans:
+                if not 0 <= start < end <= n_tokens:
+                    raise ValueError(
+                        f"Span ({start}, {end}) of text {i} is outside its {n_tokens} processed tokens"
+                    )
+            token_spans.append(text_spans)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    lengths = [len(ids) for ids in encoded["input_ids"]]
+    with torch.no_grad():
+        inputs = tokenizer.pad(
+            {"input_ids": encoded["input_ids"]}, padding=True, return_tensors="pt"
+        ).to(device)
+        hidden = model(**inputs).last_hidden_state
+    padded = hidden.shape[1]
+    embeddings = []
+    for i, text_spans in enumerate(token_spans):
+        shift = padded - lengths[i] if tokenizer.padding_side == "left" else 0
+        vectors = torch.stack(
+            [hidden[i, start + shift : end + shift].mean(dim=0) for start, end in text_spans]
+        )
+        embeddings.append(vectors.float().cpu().numpy())
+    return NumpyJSONResponse({"embeddings": embeddings})
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    # passed as an import string so uvicorn can start WORKERS processes
+    uvicorn.run("embedding_server:app", host="0.0.0.0", port=8001, workers=WORKERS)
\ No newline at end of file
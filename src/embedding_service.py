@@ -1,58 +1,510 @@
 from config import EmbeddingServiceConfig
-from infinity_emb.engine import AsyncEngineArray, EngineArgs
+from infinity_emb.engine import AsyncEmbeddingEngine, EngineArgs
+from replica_router import ReplicaRouter
+from priority_scheduler import BULK, PriorityScheduler, classify_priority
+from chunking import chunk_texts, pool_windows
+from deadlines import DeadlineExceeded, check_deadline
+from token_cache import TokenCache, merge_stats
+from token_budget import budget_slices, padded_tokens
 from utils import (
-    OpenAIModelInfo,
-    ModelInfo,
+    dedupe,
     list_embeddings_to_response,
+    model_info,
+    model_list,
     to_rerank_response,
 )
 
 import asyncio
+import logging
+import sys
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _device_kwargs(device: str) -> dict:
+    """EngineArgs placement for "auto", "cpu", "cuda" or "cuda:<id>" """
+    if device == "auto":
+        return {}
+    device, _, device_id = device.partition(":")
+    if device_id:
+        return dict(device=device, device_id=device_id)
+    return dict(device=device)
+
+
+def _out_of_memory_errors() -> tuple:
+    """exception types of a batch that did not fit in host or device memory"""
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return (MemoryError,)
+    return (MemoryError, torch.cuda.OutOfMemoryError)
+
+
+def _release_device_memory():
+    """returns cached CUDA blocks after an out-of-memory error"""
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def instruction_prefix(instruction: str | None, prompt_type: str | None) -> str:
+    """Qwen3 instruction prefix for the input texts"""
+    if instruction:
+        # Custom instruction provided
+        return f"Instruct: {instruction}\nQuery: "
+    if prompt_type == "query":
+        # Use default query instruction for Qwen3
+        return "Instruct: Given a web search query, retrieve relevant passages that answer the query\nQuery: "
+    # Documents typically don't have instructions for Qwen3
+    return ""
 
 
 class EmbeddingService:
     def __init__(self):
         self.config = EmbeddingServiceConfig()
-        engine_args = []
-        for model_name, batch_size, dtype in zip(
-            self.config.model_names, self.config.batch_sizes, self.config.dtypes
-        ):
-            engine_args.append(
-                EngineArgs(
-                    model_name_or_path=model_name,
-                    batch_size=batch_size,
-                    engine=self.config.backend,
-                    dtype=dtype,
-                    model_warmup=False,
-                    lengths_via_tokenize=True,
-                )
+        engine_paths = self.config.model_names
+        if self.config.backend == "optimum":
+            # serve exported ONNX copies under the original model names
+            from onnx_export import ensure_onnx_models
+
+            engine_paths = ensure_onnx_models(
+                self.config.model_names,
+                cache_dir=self.config.onnx_cache_dir,
+                quantize=self.config.onnx_quantize,
+                parity_threshold=self.config.onnx_parity_threshold,
+            )
+        # one engine per replica; each runs its own batch queue and worker
+        # thread pool, and the router spreads requests over them
+        # the source of each model (what reloads start from and tokenizers load
+        # from) and what its engines load, e.g. the ONNX export of the source
+        self.model_paths = dict(zip(self.config.model_names, self.config.model_names))
+        self.engine_paths = dict(zip(self.config.model_names, engine_paths))
+        self.batch_sizes = dict(zip(self.config.model_names, self.config.batch_sizes))
+        self._tokenizers = {}
+        self._token_caches: dict[str, TokenCache] = {}
+        self.routers: dict[str, ReplicaRouter] = {
+            model_name: self._build_router(model_name, model_path)
+            for model_name, model_path in self.engine_paths.items()
+        }
+
+        # one bulk slice in flight per replica (reloads keep the replica count)
+        self.schedulers: dict[str, PriorityScheduler] = {
+            model_name: PriorityScheduler(
+                slice_size=slice_size,
+                max_bulk_slices=replicas,
+                max_bulk_wait=self.config.bulk_max_wait,
             )
+            for model_name, slice_size, replicas in zip(
+                self.config.model_names, self.config.bulk_slice_sizes, self.config.replicas
+            )
+        }
+        # work dropped because its deadline passed or its job was cancelled
+        self.dropped: dict[str, dict[str, int]] = {
+            model_name: dict(expired_requests=0, cancelled_requests=0, dropped_items=0)
+            for model_name in self.config.model_names
+        }
+
+        # largest batch that fit per length bucket, from BATCH_CALIBRATION
+        self.batch_limits: dict[str, dict[int, int]] = {}
 
-        self.engine_array = AsyncEngineArray.from_args(engine_args)
         self.is_running = False
         self.sepamore = asyncio.Semaphore(1)
+        # one model reload at a time
+        self._reload_lock = asyncio.Lock()
+        self.warmup_report: dict[str, list[dict]] = {}
+
+    def _build_router(self, model_name: str, model_path: str) -> ReplicaRouter:
+        """(unstarted) engines for every replica of model_name, loaded from model_path"""
+        index = self.config.model_names.index(model_name)
+        devices = self.config.devices[index]
+        engines, placements = [], []
+        for replica in range(self.config.replicas[index]):
+            device = devices[replica % len(devices)]
+            engine_args = EngineArgs(
+                model_name_or_path=model_path,
+                served_model_name=model_name,
+                batch_size=self.config.batch_sizes[index],
+                engine=self.config.backend,
+                dtype=self.config.dtypes[index],
+                model_warmup=False,
+                # infinity only sorts its queue by these lengths; tokenizing for
+                # them would be a second pass over every input on top of the
+                # model's own (budgeted batching takes lengths from the token cache)
+                lengths_via_tokenize=False,
+                compile=self.config.compile,
+                **_device_kwargs(device),
+            )
+            engines.append(AsyncEmbeddingEngine.from_args(engine_args))
+            placements.append(device)
+        return ReplicaRouter(engines, placements, max_tokens=self.config.max_batch_tokens[index])
 
     async def start(self):
-        """starts the engine background loop"""
+        """starts the engine background loop, warming it up first if configured"""
         async with self.sepamore:
             if not self.is_running:
-                await self.engine_array.astart()
+                await asyncio.gather(
+                    *(engine.astart() for router in self.routers.values() for engine in router)
+                )
+                if self.config.model_warmup:
+                    await self.warmup()
+                if self.config.batch_calibration:
+                    await self.calibrate_batches()
                 self.is_running = True
 
-    async def stop(self):
-        """stops the engine background loop"""
+    async def warmup(self) -> dict[str, list[dict]]:
+        """
+        Runs one batch per (length bucket, batch size) shape through every
+        engine so kernel selection, allocator growth and compilation happen
+        before real traffic. Works with any model, including tiny CPU ones.
+        """
+        for model_name in self.config.model_names:
+            self.warmup_report[model_name] = await self._warmup_router(
+                model_name, self.routers[model_name]
+            )
+        return self.warmup_report
+
+    async def _warmup_router(self, model_name: str, router: ReplicaRouter) -> list[dict]:
+        batch_size = self.batch_sizes[model_name]
+        shapes = []
+        for replica, (engine, device) in enumerate(zip(router.engines, router.devices)):
+            for length in self.config.warmup_lengths:
+                # "hello" is a single token for the tokenizers we serve
+                text = " ".join(["hello"] * length)
+                for n in sorted({1, batch_size}):
+                    start = time.perf_counter()
+                    if "rerank" in engine.capabilities:
+                        await engine.rerank(query=text, docs=[text] * n)
+                        kind = "rerank"
+                    else:
+                        await engine.embed([text] * n)
+                        kind = "embed"
+                    seconds = time.perf_counter() - start
+                    shapes.append(
+                        dict(
+                            kind=kind,
+                            replica=replica,
+                            device=device,
+                            length=length,
+                            batch_size=n,
+                            seconds=round(seconds, 4),
+                        )
+                    )
+                    logger.info(
+                        f"Warmup {model_name}[{replica}] {kind} length={length} batch={n}: {seconds * 1000:.1f} ms"
+                    )
+        return shapes
+
+    async def calibrate_batches(self) -> dict[str, dict[int, int]]:
+        """
+        Doubles the batch of each WARMUP_LENGTHS bucket, up to the model's
+        batch size and token budget, until a replica runs out of memory, and
+        keeps the largest batch that ran per bucket on every device the
+        model's replicas use.
+        """
+        for model_name in self.config.model_names:
+            self.batch_limits[model_name] = await self._calibrate_router(
+                model_name, self.routers[model_name]
+            )
+        return self.batch_limits
+
+    async def _calibrate_router(self, model_name: str, router: ReplicaRouter) -> dict[int, int]:
+        # one replica per device; replicas on one device have the same room
+        probes = {}
+        for engine, device in zip(router.engines, router.devices):
+            probes.setdefault(device, engine)
+        limits = {}
+        for device, engine in probes.items():
+            device_limits = await self._calibrate_engine(model_name, engine, router.max_tokens, device)
+            for length, fits in device_limits.items():
+                limits[length] = min(limits.get(length, fits), fits)
+        return limits
+
+    async def _calibrate_engine(self, model_name: str, engine, max_tokens: int, device: str) -> dict[int, int]:
+        limits = {}
+        cap = self.batch_sizes[model_name]
+        for length in sorted(self.config.warmup_lengths):
+            if max_tokens:
+                cap = min(cap, max_tokens // length)
+            cap = max(cap, 1)
+            sizes = [2**i for i in range(cap.bit_length()) if 2**i < cap] + [cap]
+            # "hello" is a single token for the tokenizers we serve
+            text = " ".join(["hello"] * length)
+            fits = 0
+            for n in sizes:
+                try:
+                    if "rerank" in engine.capabilities:
+                        await engine.rerank(query=text, docs=[text] * n)
+                    else:
+                        await engine.embed([text] * n)
+                except _out_of_memory_errors():
+                    _release_device_memory()
+                    break
+                fits = n
+            limits[length] = max(fits, 1)
+            # longer buckets fit at most as many items
+            cap = limits[length]
+            logger.info(f"Calibrated {model_name} on {device} length={length}: batches of up to {limits[length]}")
+        return limits
+
+    async def wait_idle(self, routers, timeout: float) -> bool:
+        """waits until the routers have no engine calls in flight; False on timeout"""
+        routers = list(routers)
+        give_up = time.monotonic() + timeout
+        while any(sum(router.inflight) for router in routers):
+            if time.monotonic() >= give_up:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    async def reload_model(
+        self,
+        model_name: str,
+        model_path: str | None = None,
+        stop_first: bool = False,
+        timeout: float | None = None,
+    ) -> dict:
+        """
+        Loads model_name again, from model_path if given, and switches new
+        requests to it in one step once it has started, warmed up and been
+        calibrated (as configured). The old engines are stopped after their
+        in-flight calls finish (or timeout passes). With stop_first they are
+        stopped before the new ones load, for devices without room for both
+        copies; the caller must hold off new requests meanwhile.
+        """
+        timeout = self.config.drain_timeout if timeout is None else timeout
+        async with self._reload_lock:
+            # read under the lock: an overlapping reload must retire the
+            # router the one before it switched to, not the one it replaced
+            old = self.get_router(model_name)
+            previous_path = self.model_paths[model_name]
+            model_path = model_path or previous_path
+            start = time.perf_counter()
+            engine_path = model_path
+            if self.config.backend == "optimum":
+                from onnx_export import ensure_onnx_models
+
+                (engine_path,) = await asyncio.to_thread(
+                    ensure_onnx_models,
+                    [model_path],
+                    cache_dir=self.config.onnx_cache_dir,
+                    quantize=self.config.onnx_quantize,
+                    parity_threshold=self.config.onnx_parity_threshold,
+                )
+            drained = None
+            if stop_first:
+                drained = await self.wait_idle([old], timeout)
+                await asyncio.gather(*(engine.astop() for engine in old))
+            new = await asyncio.to_thread(self._build_router, model_name, engine_path)
+            try:
+                await asyncio.gather(*(engine.astart() for engine in new))
+                warmup = await self._warmup_router(model_name, new) if self.config.model_warmup else None
+                limits = (
+                    await self._calibrate_router(model_name, new) if self.config.batch_calibration else None
+                )
+            except BaseException:
+                await asyncio.gather(*(engine.astop() for engine in new), return_exceptions=True)
+                if stop_first:
+                    # keep serving the previous weights
+                    await asyncio.gather(*(engine.astart() for engine in old))
+                raise
+
+            # every engine call looks its router up, so this switches all new work at once
+            self.routers[model_name] = new
+            self.model_paths[model_name] = model_path
+            self.engine_paths[model_name] = engine_path
+            self._tokenizers.pop(model_name, None)
+            self._token_caches.pop(model_name, None)
+            if warmup is not None:
+                self.warmup_report[model_name] = warmup
+            if limits is not None:
+                self.batch_limits[model_name] = limits
+            switched = time.perf_counter() - start
+            logger.info(f"Switched {model_name} to {model_path} after {switched:.1f}s")
+
+            if not stop_first:
+                drained = await self.wait_idle([old], timeout)
+                await asyncio.gather(*(engine.astop() for engine in old))
+            if not drained:
+                logger.warning(f"Stopped the previous {model_name} engines with calls still in flight")
+        return {
+            "object": "model_reload",
+            "model": model_name,
+            "model_path": model_path,
+            "previous_path": previous_path,
+            "stopped_first": stop_first,
+            "drained": drained,
+            "switch_seconds": round(switched, 3),
+        }
+
+    async def stop(self, timeout: float | None = None):
+        """stops the engine background loop once in-flight engine calls have finished"""
         async with self.sepamore:
             if self.is_running:
-                await self.engine_array.astop()
+                timeout = self.config.drain_timeout if timeout is None else timeout
+                if not await self.wait_idle(self.routers.values(), timeout):
+                    logger.warning(f"Stopping engines with calls still in flight after {timeout}s")
+                await asyncio.gather(
+                    *(engine.astop() for router in self.routers.values() for engine in router)
+                )
                 self.is_running = False
 
-    async def route_openai_models(self) -> OpenAIModelInfo:
-        return OpenAIModelInfo(
-            data=[ModelInfo(id=model_id, stats={}) for model_id in self.list_models()]
-        ).model_dump()
+    async def route_openai_models(self) -> dict:
+        return model_list(
+            [
+                model_info(
+                    model_id,
+                    stats=dict(
+                        warmup=self.warmup_report.get(model_id, []),
+                        replicas=self.routers[model_id].stats(),
+                        latency=self.schedulers[model_id].stats(),
+                        dropped=self.dropped[model_id],
+                        batching=dict(
+                            batch_size=self.batch_sizes[model_id],
+                            max_batch_tokens=self.routers[model_id].max_tokens,
+                            calibrated=self.batch_limits.get(model_id),
+                        ),
+                        token_cache=(
+                            self._token_caches[model_id].stats()
+                            if model_id in self._token_caches
+                            else None
+                        ),
+                    ),
+                )
+                for model_id in self.list_models()
+            ]
+        )
 
     def list_models(self) -> list[str]:
-        return list(self.engine_array.engines_dict.keys())
+        return list(self.routers.keys())
+
+    def get_router(self, model_name: str) -> ReplicaRouter:
+        if model_name not in self.routers:
+            raise IndexError(
+                f"Engine for model name `{model_name}` not found. "
+                f"Available model names are {self.list_models()}"
+            )
+        return self.routers[model_name]
+
+    async def _schedule(
+        self,
+        model_name: str,
+        items: list,
+        call,
+        priority: str,
+        deadline: float | None = None,
+        lengths: dict | None = None,
+    ):
+        """
+        Runs `call(engine, items)` under the model's priority scheduler.
+        Bulk work is sliced and the per-slice results and usage are merged.
+        With token lengths per item (see token_lengths), work is further cut
+        into token-budget slices. The deadline is checked before every engine
+        call, so expired or cancelled work never reaches the engine queue.
+        """
+        self.get_router(model_name)
+        scheduler = self.schedulers[model_name]
+        dropped = self.dropped[model_name]
+        submitted = 0
+
+        async def run(batch):
+            nonlocal submitted
+            check_deadline(deadline)
+            submitted += len(batch)
+            # looked up per call, so a model reload switches the remaining slices too
+            router = self.get_router(model_name)
+            if lengths is not None:
+                return await self._run_budgeted(
+                    model_name, batch, [lengths[item] for item in batch], call
+                )
+            async with router.acquire(len(batch)) as engine:
+                return await call(engine, batch)
+
+        try:
+            if priority != BULK:
+                async with scheduler.interactive():
+                    return await run(items)
+            results = await scheduler.run_bulk(items, run)
+        except DeadlineExceeded:
+            dropped["expired_requests"] += 1
+            dropped["dropped_items"] += len(items) - submitted
+            raise
+        except asyncio.CancelledError:
+            dropped["cancelled_requests"] += 1
+            dropped["dropped_items"] += len(items) - submitted
+            raise
+        outputs = [output for slice_outputs, _ in results for output in slice_outputs]
+        return outputs, sum(usage for _, usage in results)
+
+    async def _run_budgeted(self, model_name: str, batch: list, batch_lengths: list[int], call):
+        """runs the token-budget slices of batch and puts their outputs back in order"""
+        router = self.get_router(model_name)
+        slices = budget_slices(
+            batch_lengths,
+            router.max_tokens,
+            self.batch_sizes[model_name],
+            self.batch_limits.get(model_name),
+        )
+
+        async def run_slice(indices):
+            tokens = padded_tokens([batch_lengths[i] for i in indices])
+            async with router.acquire(len(indices), tokens=tokens) as engine:
+                return await call(engine, [batch[i] for i in indices])
+
+        results = await asyncio.gather(*(run_slice(indices) for indices in slices))
+        outputs = [None] * len(batch)
+        for indices, (slice_outputs, _) in zip(slices, results):
+            for index, output in zip(indices, slice_outputs):
+                outputs[index] = output
+        return outputs, sum(usage for _, usage in results)
+
+    def budgeted(self, model_name: str) -> bool:
+        """whether the model batches by token budget or calibrated limits"""
+        return bool(self.get_router(model_name).max_tokens or self.batch_limits.get(model_name))
+
+    async def token_lengths(self, model_name: str, items: list[str], extra: int = 0):
+        """
+        (token count (+ extra) per distinct item, tokenize stats) when the
+        model batches by token budget or calibrated limits, else (None, None)
+        """
+        if not self.budgeted(model_name):
+            return None, None
+        token_ids, stats = await asyncio.to_thread(self.tokenize, model_name, items)
+        # special tokens the engine adds around every input
+        extra += 2
+        return {item: len(ids) + extra for item, ids in zip(items, token_ids)}, stats
+
+    def get_tokenizer(self, model_name: str):
+        """tokenizer of a served model, loaded on first use (blocking)"""
+        if model_name not in self._tokenizers:
+            from transformers import AutoTokenizer
+
+            self._tokenizers[model_name] = AutoTokenizer.from_pretrained(
+                self.model_paths[model_name]
+            )
+        return self._tokenizers[model_name]
+
+    def tokenize(self, model_name: str, texts: list[str]):
+        """
+        token ids (without special tokens) through the model's LRU token
+        cache; returns (ids, stats) with the tokenization time saved
+        """
+        tokenizer = self.get_tokenizer(model_name)
+        if self.config.token_cache_size <= 0:
+            start = time.perf_counter()
+            ids = tokenizer(texts, add_special_tokens=False)["input_ids"]
+            return ids, dict(tokenize_ms=round((time.perf_counter() - start) * 1000, 3))
+        cache = self._token_caches.get(model_name)
+        if cache is None:
+            # setdefault keeps one cache if two worker threads race here
+            cache = self._token_caches.setdefault(
+                model_name,
+                TokenCache(
+                    lambda batch: tokenizer(batch, add_special_tokens=False)["input_ids"],
+                    max_entries=self.config.token_cache_size,
+                ),
+            )
+        return cache.encode(texts)
 
     async def route_openai_get_embeddings(
         self,
@@ -61,54 +513,149 @@ class EmbeddingService:
         return_as_list: bool = False,
         instruction: str | None = None,
         prompt_type: str | None = None,
+        priority: str | None = None,
+        chunk_pooling: str | None = None,
+        chunk_window: int | None = None,
+        chunk_overlap: int | None = None,
+        deadline: float | None = None,
+        encoding_format: str = "float",
     ):
-        """returns embeddings for the input text"""
+        """
+        returns embeddings for the input text, encoded per encoding_format
+        ("float", "base64" or "float16"). With chunk_pooling ("mean" or
+        "weighted") inputs longer than the window are split into overlapping
+        token windows, all windows are embedded together and pooled back to
+        one vector per input. deadline is an absolute unix timestamp after
+        which queued work is dropped.
+        """
+        check_deadline(deadline)
         if not self.is_running:
             await self.start()
         if not isinstance(embedding_input, list):
             embedding_input = [embedding_input]
 
-        # Apply instruction if provided
-        if instruction or prompt_type:
-            processed_input = []
-            for text in embedding_input:
-                # Build the instruction prefix
-                if instruction:
-                    # Custom instruction provided
-                    prefix = f"Instruct: {instruction}\nQuery: "
-                elif prompt_type == "query":
-                    # Use default query instruction for Qwen3
-                    prefix = "Instruct: Given a web search query, retrieve relevant passages that answer the query\nQuery: "
-                elif prompt_type == "document":
-                    # Documents typically don't have instructions for Qwen3
-                    prefix = ""
-                else:
-                    prefix = ""
-                
-                processed_input.append(prefix + text)
-            embedding_input = processed_input
-
-        embeddings, usage = await self.engine_array[model_name].embed(embedding_input)
-        if return_as_list:
-            return [
-                list_embeddings_to_response(embeddings, model=model_name, usage=usage)
-            ]
+        prefix = instruction_prefix(instruction, prompt_type)
+
+        chunk_counts = None
+        tokenize_stats = None
+        if chunk_pooling:
+            # window the raw text, then give every window the instruction prefix;
+            # windows leave room for the prefix so neither gets truncated. They
+            # go to the engine as text, which is all infinity accepts.
+            token_ids, tokenize_stats = await asyncio.to_thread(
+                self.tokenize, model_name, embedding_input + ([prefix] if prefix else [])
+            )
+            prefix_tokens = len(token_ids.pop()) if prefix else 0
+            windows, owners, chunk_counts, window_tokens = await asyncio.to_thread(
+                chunk_texts,
+                self.get_tokenizer(model_name),
+                token_ids,
+                max(1, (chunk_window or self.config.chunk_window_tokens) - prefix_tokens),
+                self.config.chunk_overlap_tokens if chunk_overlap is None else chunk_overlap,
+            )
+            texts = [prefix + window for window in windows]
         else:
-            return list_embeddings_to_response(
-                embeddings, model=model_name, usage=usage
+            texts = [prefix + text for text in embedding_input]
+
+        # embed each distinct (prefixed) text once and fan the vectors back out
+        unique_input, inverse = dedupe(texts)
+        lengths, length_stats = await self.token_lengths(model_name, unique_input)
+        unique_embeddings, usage = await self._schedule(
+            model_name,
+            unique_input,
+            lambda engine, texts: engine.embed(texts),
+            classify_priority(
+                priority, prompt_type, len(unique_input), self.config.bulk_threshold
+            ),
+            deadline=deadline,
+            lengths=lengths,
+        )
+        embeddings = [unique_embeddings[i] for i in inverse]
+        if chunk_pooling:
+            embeddings = pool_windows(
+                embeddings, owners, len(embedding_input), chunk_pooling, window_tokens
             )
+        response = list_embeddings_to_response(
+            embeddings,
+            model=model_name,
+            usage=usage,
+            total_inputs=len(texts),
+            unique_inputs=len(unique_input),
+            chunks=chunk_counts,
+            encoding_format=encoding_format,
+        )
+        # tokenization done here (the engine's own is not measured) and the time the cache saved
+        response["usage"].update(merge_stats(tokenize_stats, length_stats))
+        if return_as_list:
+            return [response]
+        else:
+            return response
+
+    async def embed_array(
+        self,
+        texts: list[str],
+        model_name: str,
+        instruction: str | None = None,
+        prompt_type: str | None = None,
+    ):
+        """
+        embeddings of texts as one (n, dim) array in the engine dtype, scheduled
+        as bulk work; used by offline jobs that never build a JSON response
+        """
+        if not self.is_running:
+            await self.start()
+        prefix = instruction_prefix(instruction, prompt_type)
+        unique_input, inverse = dedupe([prefix + text for text in texts])
+        lengths, _ = await self.token_lengths(model_name, unique_input)
+        unique_embeddings, usage = await self._schedule(
+            model_name,
+            unique_input,
+            lambda engine, batch: engine.embed(batch),
+            BULK,
+            lengths=lengths,
+        )
+        return np.stack(unique_embeddings)[inverse], usage
 
     async def infinity_rerank(
-        self, query: str, docs: str, return_docs: str, model_name: str
+        self,
+        query: str,
+        docs: str,
+        return_docs: str,
+        model_name: str,
+        priority: str | None = None,
+        deadline: float | None = None,
     ):
         """Rerank the documents based on the query"""
+        check_deadline(deadline)
         if not self.is_running:
             await self.start()
-        scores, usage = await self.engine_array[model_name].rerank(
-            query=query, docs=docs, raw_scores=False
+        unique_docs, inverse = dedupe(docs)
+        lengths, query_stats, length_stats = None, None, None
+        if self.budgeted(model_name):
+            # every pair carries the query
+            query_ids, query_stats = await asyncio.to_thread(self.tokenize, model_name, [query])
+            lengths, length_stats = await self.token_lengths(
+                model_name, unique_docs, extra=len(query_ids[0])
+            )
+        unique_scores, usage = await self._schedule(
+            model_name,
+            unique_docs,
+            lambda engine, batch: engine.rerank(query=query, docs=batch, raw_scores=False),
+            classify_priority(priority, None, len(unique_docs), self.config.bulk_threshold),
+            deadline=deadline,
+            lengths=lengths,
         )
+        scores = [unique_scores[i] for i in inverse]
+        total_docs = len(docs)
         if not return_docs:
             docs = None
-        return to_rerank_response(
-            scores=scores, documents=docs, model=model_name, usage=usage
+        response = to_rerank_response(
+            scores=scores,
+            documents=docs,
+            model=model_name,
+            usage=usage,
+            total_inputs=total_docs,
+            unique_inputs=len(unique_docs),
         )
+        response["usage"].update(merge_stats(query_stats, length_stats))
+        return response
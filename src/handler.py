@@ -1,7 +1,20 @@
 import runpod
 from utils import create_error_response
+from config import EmbeddingServiceConfig
+from startup_report import StartupReport, importtime_breakdown
+from model_persistence import prefetch_model_weights
+from deadlines import earliest, resolve_deadline
+from bulk_job import resolve_volume_path, run_bulk_job
+from validation import ValidationError, validate_job_input
+from tracing import Tracer
+from profiling import DEFAULT_PROFILE_DIR, Profiler
 from typing import Any
+import asyncio
+import functools
 import os
+import sys
+import threading
+import time
 import logging
 
 # Set up logging
@@ -11,13 +24,6 @@ logger = logging.getLogger(__name__)
 # Run startup configuration
 logger.info("Starting RunPod worker...")
 
-# Check transformers version
-try:
-    import transformers
-    logger.info(f"Transformers version: {transformers.__version__}")
-except ImportError:
-    logger.error("Transformers not installed!")
-
 # Configure model paths
 os.environ["MODEL_NAMES"] = "/models/Qwen3-Embedding-0.6B;/models/Qwen3-Reranker-0.6B"
 logger.info("Using Qwen3 embedding and reranker models from container for optimal performance")
@@ -27,27 +33,144 @@ if os.path.exists("/runpod-volume"):
     os.environ['HF_HOME'] = "/runpod-volume"
     logger.info("Set HF_HOME to /runpod-volume for model cache")
 
-# Import embedding service after configuration
-from embedding_service import EmbeddingService
+# The engine stack (embedding_service -> infinity_emb -> torch) is imported and
+# constructed exactly once, on first use, so RunPod can register the worker
+# while weights are still loading.
+_embedding_service = None
+_embedding_service_lock = threading.Lock()
+startup_report = StartupReport()
+# finished job spans: kept for the /debug/traces route ("buffer"), logged as
+# OTLP JSON lines ("log"), "both" or "off"
+tracer = Tracer(
+    "runpod-worker",
+    os.environ.get("TRACE_EXPORT", "buffer"),
+    int(os.environ.get("TRACE_BUFFER_SIZE", 2048)),
+)
+# opt-in profiles of jobs slower than PROFILE_SLOW_MS or sent with "profile": true,
+# the newest PROFILE_MAX_COUNT kept in PROFILE_DIR on the volume
+profiler = Profiler(
+    os.environ.get("PROFILING", "false").lower() == "true",
+    os.environ.get("PROFILE_DIR", DEFAULT_PROFILE_DIR),
+    float(os.environ.get("PROFILE_SLOW_MS", 1000)),
+    int(os.environ.get("PROFILE_MAX_COUNT", 20)),
+    interval=float(os.environ.get("PROFILE_INTERVAL_MS", 20)) / 1000,
+)
+
+
+def get_embedding_service():
+    """Import and construct the EmbeddingService once; blocks until it exists."""
+    global _embedding_service
+    if _embedding_service is not None:
+        return _embedding_service
+    with _embedding_service_lock:
+        if _embedding_service is None:
+            with startup_report.stage("import embedding_service"):
+                from embedding_service import EmbeddingService
+            logger.info("Initializing embedding service...")
+            with startup_report.stage("construct EmbeddingService"):
+                service = EmbeddingService()
+            _embedding_service = service
+            logger.info("Embedding service initialized successfully")
+            if "transformers" in sys.modules:
+                logger.info(f"Transformers version: {sys.modules['transformers'].__version__}")
+    return _embedding_service
+
+
+def _build_embedding_service():
+    # Gracefully catch configuration errors (e.g. missing env vars) so the user sees
+    # a clean message instead of a full Python traceback when the container starts.
+    try:
+        get_embedding_service()
+    except Exception as e:  # noqa: BLE001  (intercept everything on startup)
+        import traceback
+
+        sys.stderr.write(f"\nstartup failed: {e}\n")
+        sys.stderr.write(f"Traceback:\n{traceback.format_exc()}\n")
+        sys.stderr.flush()
+        os._exit(1)
+    startup_report.log()
+    if os.environ.get("STARTUP_IMPORTTIME_REPORT", "false").lower() == "true":
+        importtime_breakdown()
+
 
-# Gracefully catch configuration errors (e.g. missing env vars) so the user sees
-# a clean message instead of a full Python traceback when the container starts.
-try:
-    logger.info("Initializing embedding service...")
-    embedding_service = EmbeddingService()
-    logger.info("Embedding service initialized successfully")
-except Exception as e:  # noqa: BLE001  (intercept everything on startup)
-    import sys
-    import traceback
+_engine_start_task = None
 
-    sys.stderr.write(f"\nstartup failed: {e}\n")
-    sys.stderr.write(f"Traceback:\n{traceback.format_exc()}\n")
-    sys.exit(1)
+# drain mode: concurrency_modifier advertises no capacity, so RunPod sends no
+# new jobs while the in-flight ones (admin jobs aside) finish
+_draining = False
+_inflight_jobs = 0
+
+
+def concurrency_modifier(current_concurrency: int) -> int:
+    # advertise no capacity until the engines exist, are started and warmed up
+    global _engine_start_task
+    if _embedding_service is None or _draining:
+        return 0
+    if not _embedding_service.is_running:
+        # engines must start on the RunPod event loop, which is running here
+        if _engine_start_task is not None and _engine_start_task.done():
+            if _engine_start_task.exception() is not None:
+                logger.error(f"Engine start failed, retrying: {_engine_start_task.exception()}")
+            _engine_start_task = None
+        if _engine_start_task is None:
+            _engine_start_task = asyncio.get_running_loop().create_task(
+                _embedding_service.start()
+            )
+        return 0
+    return _embedding_service.config.runpod_max_concurrency
 
 
 async def async_generator_handler(job: dict[str, Any]):
     """Handle the requests and embedding/rerank them asynchronously."""
-    job_input = job["input"]
+    global _inflight_jobs
+    # callers can continue their own trace with "traceparent" / "request_id"
+    trace_source = job.get("input") if isinstance(job.get("input"), dict) else {}
+    traceparent, request_id = trace_source.get("traceparent"), trace_source.get("request_id")
+    with tracer.span(
+        "runpod job",
+        traceparent if isinstance(traceparent, str) else None,
+        request_id if isinstance(request_id, str) else job.get("id"),
+        **{"job.id": str(job.get("id"))},
+    ) as span:
+        with profiler.profile(
+            "runpod job",
+            force=trace_source.get("profile") is True,
+            request_id=span.request_id if span is not None else job.get("id"),
+        ):
+            # admin jobs wait for the others, so they are not counted
+            counted = 0 if trace_source.get("admin") else 1
+            _inflight_jobs += counted
+            try:
+                return await handle_job(job)
+            finally:
+                _inflight_jobs -= counted
+
+
+def job_deadline(job_input: dict):
+    """
+    optional deadline: absolute unix time and/or a timeout relative to receipt,
+    on the job and/or its openai_input; the earliest of them applies
+    """
+    openai_input = job_input.get("openai_input") or {}
+    return earliest(
+        resolve_deadline(job_input.get("deadline"), job_input.get("timeout_ms")),
+        resolve_deadline(openai_input.get("deadline"), openai_input.get("timeout_ms")),
+    )
+
+
+async def handle_job(job: dict[str, Any]):
+    job_input = job.get("input")
+    # reject malformed payloads before they wait for or reach an engine
+    try:
+        with tracer.span("validate"):
+            validate_job_input(job_input)
+    except ValidationError as e:
+        return create_error_response(str(e))
+    embedding_service = _embedding_service
+    if embedding_service is None:
+        with tracer.span("wait for engines"):
+            embedding_service = await asyncio.to_thread(get_embedding_service)
+    deadline = job_deadline(job_input)
     if job_input.get("openai_route"):
         openai_route, openai_input = job_input.get("openai_route"), job_input.get(
             "openai_input"
@@ -55,38 +178,54 @@ async def async_generator_handler(job: dict[str, Any]):
 
         if openai_route and openai_route == "/v1/models":
             call_fn, kwargs = embedding_service.route_openai_models, {}
+        elif openai_route and openai_route == "/debug/traces":
+            # recent spans of this worker, optionally of one trace or request
+            call_fn, kwargs = debug_traces, dict(openai_input or {})
+        elif openai_route and openai_route == "/debug/profiles":
+            # stored profiles, or one of them with {"profile_id": ...}
+            call_fn, kwargs = debug_profiles, dict(openai_input or {})
         elif openai_route and openai_route == "/v1/embeddings":
             model_name = openai_input.get("model")
-            if not openai_input:
-                return create_error_response("Missing input").model_dump()
-            if not model_name:
-                return create_error_response(
-                    "Did not specify model in openai_input"
-                ).model_dump()
             # Extract instruction parameters from extra_body if present
-            extra_body = openai_input.get("extra_body", {})
+            extra_body = openai_input.get("extra_body") or {}
             instruction = extra_body.get("instruction")
             prompt_type = extra_body.get("prompt_type")
-            
+
             call_fn, kwargs = embedding_service.route_openai_get_embeddings, {
                 "embedding_input": openai_input.get("input"),
                 "model_name": model_name,
                 "instruction": instruction,
                 "prompt_type": prompt_type,
+                "priority": openai_input.get("priority", extra_body.get("priority")),
+                "chunk_pooling": extra_body.get("chunk_pooling"),
+                "chunk_window": extra_body.get("chunk_window"),
+                "chunk_overlap": extra_body.get("chunk_overlap"),
+                "deadline": deadline,
+                "encoding_format": openai_input.get("encoding_format") or "float",
                 "return_as_list": True,
             }
         else:
-            return create_error_response(
-                f"Invalid OpenAI Route: {openai_route}"
-            ).model_dump()
+            return create_error_response(f"Invalid OpenAI Route: {openai_route}")
     else:
         # handle the request for reranking
-        if job_input.get("query"):
+        if job_input.get("admin"):
+            # drain the worker or reload a model
+            call_fn, kwargs = functools.partial(admin_job, embedding_service), dict(
+                job_input["admin"]
+            )
+        elif job_input.get("bulk_embed"):
+            # offline corpus embedding from and to the volume
+            call_fn, kwargs = functools.partial(run_bulk_job, embedding_service), dict(
+                job_input["bulk_embed"]
+            )
+        elif job_input.get("query"):
             call_fn, kwargs = embedding_service.infinity_rerank, {
                 "query": job_input.get("query"),
                 "docs": job_input.get("docs"),
                 "return_docs": job_input.get("return_docs"),
                 "model_name": job_input.get("model"),
+                "priority": job_input.get("priority"),
+                "deadline": deadline,
             }
         elif job_input.get("input"):
             call_fn, kwargs = embedding_service.route_openai_get_embeddings, {
@@ -94,24 +233,113 @@ async def async_generator_handler(job: dict[str, Any]):
                 "model_name": job_input.get("model"),
                 "instruction": job_input.get("instruction"),
                 "prompt_type": job_input.get("prompt_type"),
+                "priority": job_input.get("priority"),
+                "chunk_pooling": job_input.get("chunk_pooling"),
+                "chunk_window": job_input.get("chunk_window"),
+                "chunk_overlap": job_input.get("chunk_overlap"),
+                "deadline": deadline,
+                "encoding_format": job_input.get("encoding_format") or "float",
             }
         else:
-            return create_error_response(f"Invalid input: {job}").model_dump()
+            return create_error_response(f"Invalid input: {job}")
     try:
-        out = await call_fn(**kwargs)
+        with tracer.span(getattr(call_fn, "func", call_fn).__name__):
+            out = await call_fn(**kwargs)
         return out
     except Exception as e:
-        return create_error_response(str(e)).model_dump()
+        return create_error_response(str(e))
 
 
-if __name__ == "__main__":
+async def wait_for_jobs(timeout: float) -> bool:
+    """waits until no (non-admin) job is in flight; False on timeout"""
+    give_up = time.monotonic() + timeout
+    while _inflight_jobs:
+        if time.monotonic() >= give_up:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+
+async def admin_job(embedding_service, action, model=None, model_path=None, drain=False, timeout=None):
+    """
+    "status": drain state, in-flight jobs and model paths.
+    "drain": stop taking jobs and wait for the in-flight ones, then stop the
+    engines and have RunPod replace the worker (refresh_worker), since a
+    drained worker receives no further jobs. If jobs are still in flight
+    after `timeout`, the worker takes jobs again instead.
+    "reload": load `model` again, from `model_path` on the volume if given,
+    and switch to it once it has warmed up. Without `drain` the new engines
+    load next to the old ones and jobs keep flowing; with it, new jobs are
+    held off and in-flight ones finish before the old engines make room.
+    """
+    global _draining
+    config = embedding_service.config
+    timeout = config.drain_timeout if timeout is None else float(timeout)
+    if action == "status":
+        return {
+            "object": "worker_status",
+            "draining": _draining,
+            "inflight_jobs": _inflight_jobs,
+            "models": dict(embedding_service.model_paths),
+            "engine_paths": dict(embedding_service.engine_paths),
+        }
+    if action == "drain":
+        _draining = True
+        idle = await wait_for_jobs(timeout)
+        if not idle:
+            _draining = False
+            return {"object": "drain", "draining": False, "idle": False, "inflight_jobs": _inflight_jobs}
+        await embedding_service.stop(timeout)
+        # popped by the RunPod SDK: the worker is stopped once this result is sent
+        return {"object": "drain", "draining": True, "idle": True, "inflight_jobs": 0, "refresh_worker": True}
+
+    if model_path is not None:
+        model_path = resolve_volume_path(model_path, config.model_reload_root)
+    was_draining = _draining
+    try:
+        if drain:
+            _draining = True
+            if not await wait_for_jobs(timeout):
+                logger.warning(f"Reloading {model} with {_inflight_jobs} jobs still in flight")
+        return await embedding_service.reload_model(model, model_path, stop_first=drain, timeout=timeout)
+    finally:
+        _draining = was_draining
+
+
+async def debug_traces(trace_id=None, request_id=None, limit=200):
+    return {"service": tracer.service, "spans": tracer.spans(trace_id, request_id, int(limit))}
+
+
+async def debug_profiles(profile_id=None):
+    if profile_id is None:
+        return {**profiler.stats(), "profiles": await asyncio.to_thread(profiler.list)}
+    profile = await asyncio.to_thread(profiler.load, profile_id)
+    if profile is None:
+        return create_error_response(f"No profile {profile_id}")
+    # torch traces can be large; they stay on the volume
+    return {**profile, "torch_trace": profiler.torch_trace_path(profile_id)}
+
+
+def main():
     logger.info("Starting RunPod serverless handler...")
-    
+
+    # Warm the page cache with the weights while the engine stack imports
+    try:
+        model_names = EmbeddingServiceConfig().model_names
+    except ValueError:
+        model_names = []
+    threading.Thread(
+        target=prefetch_model_weights, args=(model_names,), daemon=True, name="weight-prefetch"
+    ).start()
+    threading.Thread(
+        target=_build_embedding_service, daemon=True, name="engine-init"
+    ).start()
+
     try:
         runpod.serverless.start(
             {
                 "handler": async_generator_handler,
-                "concurrency_modifier": lambda x: embedding_service.config.runpod_max_concurrency,
+                "concurrency_modifier": concurrency_modifier,
             }
         )
     except Exception as e:
@@ -119,3 +347,7 @@ if __name__ == "__main__":
         import traceback
         traceback.print_exc()
         raise
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Dedicated inference thread for the FastAPI model servers.
+Requests are queued on the event loop, batched across callers and run on a
+single worker thread, so forward passes never block /health or other routes.
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+from deadlines import DeadlineExceeded, expired
+from tracing import Tracer, current_span
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """raised when accepting a request would exceed the queue depth"""
+
+
+class RequestTooLargeError(Exception):
+    """raised for a request larger than the whole queue, which no retry can admit"""
+
+
+class _Job:
+    __slots__ = ("items", "fn", "future", "size", "deadline", "span", "queued_ns")
+
+    def __init__(
+        self,
+        items: Optional[List[Any]],
+        fn: Optional[Callable],
+        future,
+        size: int,
+        deadline: Optional[float] = None,
+    ):
+        self.items = items
+        self.fn = fn
+        self.future = future
+        self.size = size
+        self.deadline = deadline
+        # the submitting request's span; queue and inference time are recorded under it
+        self.span = current_span()
+        self.queued_ns = time.time_ns()
+
+
+class InferenceWorker:
+    """
+    `batch_fn(items) -> results` is called on the worker thread with the items
+    of as many queued requests as fit into max_batch_items; results are split
+    back per request. `call(fn)` runs a one-off function on the same thread,
+    serialized with the batches. With a tracer, each request gets a "queue"
+    and an "inference" span (the whole batch it ran in).
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], List[Any]],
+        max_batch_items: int = 32,
+        max_queue_items: int = 1024,
+        name: str = "inference",
+        tracer: Optional[Tracer] = None,
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch_items = max_batch_items
+        self.max_queue_items = max_queue_items
+        self.name = name
+        self.tracer = tracer
+        self.pending_items = 0
+        self.dropped_requests = 0
+        self.dropped_items = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+
+    async def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        return dict(
+            pending_items=self.pending_items,
+            max_queue_items=self.max_queue_items,
+            queued_requests=self._queue.qsize() if self._queue else 0,
+            dropped_requests=self.dropped_requests,
+            dropped_items=self.dropped_items,
+        )
+
+    def _enqueue(self, job: _Job):
+        if job.size > self.max_queue_items:
+            raise RequestTooLargeError(
+                f"Request of {job.size} items exceeds the {self.name} queue size of {self.max_queue_items} items"
+            )
+        if self.pending_items + job.size > self.max_queue_items:
+            raise QueueFullError(
+                f"{self.name} queue full ({self.pending_items}/{self.max_queue_items} items pending)"
+            )
+        self.pending_items += job.size
+        self._queue.put_nowait(job)
+
+    async def submit(self, items: List[Any], deadline: Optional[float] = None) -> List[Any]:
+        """
+        queues items for batched execution and waits for their results;
+        raises DeadlineExceeded if the deadline passes before they run
+        """
+        items = list(items)
+        job = _Job(items, None, asyncio.get_running_loop().create_future(), len(items), deadline)
+        self._enqueue(job)
+        return await job.future
+
+    async def call(
+        self, fn: Callable, *args, weight: int = 1, deadline: Optional[float] = None
+    ) -> Any:
+        """
+        queues a single non-batchable call on the inference thread; weight is
+        the number of items it counts as against the queue depth
+        """
+        job = _Job(
+            None, lambda: fn(*args), asyncio.get_running_loop().create_future(), weight, deadline
+        )
+        self._enqueue(job)
+        return await job.future
+
+    def _trace(self, live: List[_Job], start_ns: int, items: int):
+        if self.tracer is None:
+            return
+        end_ns = time.time_ns()
+        for j in live:
+            self.tracer.record("queue", j.span, j.queued_ns, start_ns)
+            self.tracer.record(
+                "inference", j.span, start_ns, end_ns, **{"batch.items": items, "batch.requests": len(live)}
+            )
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        carry: Optional[_Job] = None
+        while True:
+            job = carry or await self._queue.get()
+            carry = None
+            batch = [job]
+            if job.fn is None:
+                n_items = job.size
+                while n_items < self.max_batch_items and not self._queue.empty():
+                    nxt = self._queue.get_nowait()
+                    if nxt.fn is not None or n_items + nxt.size > self.max_batch_items:
+                        carry = nxt
+                        break
+                    batch.append(nxt)
+                    n_items += nxt.size
+            # drop requests whose callers went away (e.g. client disconnect)
+            # or whose deadline passed while they were queued
+            live = []
+            for j in batch:
+                if not j.future.done() and expired(j.deadline):
+                    j.future.set_exception(DeadlineExceeded("Request deadline passed while queued"))
+                if j.future.done():
+                    self.dropped_requests += 1
+                    self.dropped_items += j.size
+                else:
+                    live.append(j)
+            try:
+                if not live:
+                    continue
+                start_ns = time.time_ns()
+                if job.fn is not None:
+                    result = await loop.run_in_executor(self._executor, job.fn)
+                    self._trace(live, start_ns, job.size)
+                    if not job.future.done():
+                        job.future.set_result(result)
+                    continue
+                items = [item for j in live for item in j.items]
+                results = await loop.run_in_executor(self._executor, self.batch_fn, items)
+                self._trace(live, start_ns, len(items))
+                offset = 0
+                for j in live:
+                    if not j.future.done():
+                        j.future.set_result(results[offset : offset + len(j.items)])
+                    offset += len(j.items)
+            except Exception as e:  # noqa: BLE001  (surface to every waiting caller)
+                logger.error(f"{self.name} batch failed: {e}")
+                for j in live:
+                    if not j.future.done():
+                        j.future.set_exception(e)
+            finally:
+                self.pending_items -= sum(j.size for j in batch)
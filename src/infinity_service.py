@@ -4,28 +4,101 @@ Orchestrates embedding and reranking requests between model servers
 """
 
 import os
+import time
+import base64
 import httpx
 import asyncio
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Response
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional
+from deadlines import DEADLINE_HEADER
+from response_cache import CACHE_STATUS_HEADER, ResponseCache, request_key
+from json_response import NumpyJSONResponse
+from serialization import dumps, loads
+from profiling import DEFAULT_PROFILE_DIR, Profiler, install as install_profiling
+from tracing import Tracer, current_span, install as install_tracing, propagation_headers
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+app = FastAPI(default_response_class=NumpyJSONResponse)
 
 # Service URLs
 EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL", "http://embedding:8001")
 RERANKER_SERVICE_URL = os.getenv("RERANKER_SERVICE_URL", "http://reranker:8002")
 
+# Seconds a forwarded request may take; model servers drop queued work past it
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", 30.0))
+
+# Response cache for repeated requests: entries per route (0 turns caching off,
+# identical in-flight requests are still coalesced), seconds an entry stays
+# valid, and the largest embedding batch worth caching
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 4096))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 300.0))
+RESPONSE_CACHE_MAX_TEXTS = int(os.getenv("RESPONSE_CACHE_MAX_TEXTS", 64))
+
+# finished request spans: kept for GET /debug/traces ("buffer"), logged as
+# OTLP JSON lines ("log"), "both" or "off"
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "buffer")
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", 2048))
+# opt-in profiles of requests slower than PROFILE_SLOW_MS or sent with
+# X-Profile: 1, the newest PROFILE_MAX_COUNT kept in PROFILE_DIR
+PROFILING = os.getenv("PROFILING", "false").lower() == "true"
+PROFILE_DIR = os.getenv("PROFILE_DIR", DEFAULT_PROFILE_DIR)
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", 1000))
+PROFILE_MAX_COUNT = int(os.getenv("PROFILE_MAX_COUNT", 20))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 20))
+
 # HTTP client
-client = httpx.AsyncClient(timeout=30.0)
+client = httpx.AsyncClient(timeout=REQUEST_TIMEOUT)
+
+def deadline_exceeded(error: BaseException) -> bool:
+    """a timeout of the request that made the model server call, not of its coalesced followers"""
+    return isinstance(error, HTTPException) and error.status_code == 504
+
+embedding_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, retry_on=deadline_exceeded)
+rerank_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, retry_on=deadline_exceeded)
+
+# spans continue on the model servers through the forwarded traceparent
+tracer = Tracer("gateway", TRACE_EXPORT, TRACE_BUFFER_SIZE)
+profiler = Profiler(
+    PROFILING, PROFILE_DIR, PROFILE_SLOW_MS, PROFILE_MAX_COUNT, interval=PROFILE_INTERVAL_MS / 1000
+)
+# installed first so it runs inside the trace span and profiles carry its request id
+install_profiling(app, profiler)
+install_tracing(app, tracer)
+
+
+def deadline_headers(incoming_deadline: Optional[float]) -> dict:
+    """the caller's deadline, capped at our own timeout, for the model server hop"""
+    deadline = time.time() + REQUEST_TIMEOUT
+    if incoming_deadline is not None:
+        deadline = min(deadline, incoming_deadline)
+    return {DEADLINE_HEADER: f"{deadline:.3f}"}
+
+
+def json_bytes_response(body: bytes, cache_status: str) -> Response:
+    """responses are serialized once, so cache hits are returned as stored bytes"""
+    span = current_span()
+    if span is not None:
+        span.set(cache=cache_status)
+    return Response(
+        content=body, media_type="application/json", headers={CACHE_STATUS_HEADER: cache_status}
+    )
+
+
+def cache_allowed(cache_control: Optional[str]) -> bool:
+    """callers can skip the response cache with Cache-Control: no-cache / no-store"""
+    return not cache_control or not any(
+        directive in cache_control.lower() for directive in ("no-cache", "no-store")
+    )
 
 class EmbeddingRequest(BaseModel):
     texts: List[str]
     model: Optional[str] = "Qwen/Qwen3-Embedding-0.6B"
+    # "float16": each embedding is base64 of little-endian float16 bytes
+    encoding_format: Literal["float", "float16"] = "float"
 
 class RerankRequest(BaseModel):
     query: str
@@ -71,6 +144,9 @@ async def health():
     return {"status": "healthy", "services": {
         "embedding": EMBEDDING_SERVICE_URL,
         "reranker": RERANKER_SERVICE_URL
+    }, "response_cache": {
+        "embeddings": embedding_cache.stats(),
+        "rerank": rerank_cache.stats()
     }}
 
 @app.get("/v1/models")
@@ -83,55 +159,102 @@ async def list_models():
     }
 
 @app.post("/v1/embeddings")
-async def create_embeddings(request: EmbeddingRequest):
+async def create_embeddings(
+    request: EmbeddingRequest,
+    x_request_deadline: Optional[float] = Header(None),
+    cache_control: Optional[str] = Header(None),
+):
+    body, status = await embedding_cache.get_or_compute(
+        request_key(request.model_dump()),
+        lambda: forward_embeddings(request, x_request_deadline),
+        cacheable=cache_allowed(cache_control) and len(request.texts) <= RESPONSE_CACHE_MAX_TEXTS,
+    )
+    return json_bytes_response(body, status)
+
+async def forward_embeddings(request: EmbeddingRequest, x_request_deadline: Optional[float]):
     try:
         # Forward to embedding service
-        response = await client.post(
-            f"{EMBEDDING_SERVICE_URL}/embed",
-            json={"texts": request.texts}
-        )
+        with tracer.span("POST /embed", texts=len(request.texts)):
+            response = await client.post(
+                f"{EMBEDDING_SERVICE_URL}/embed",
+                json={"texts": request.texts, "encoding_format": request.encoding_format},
+                headers={**deadline_headers(x_request_deadline), **propagation_headers()},
+            )
         response.raise_for_status()
         
-        result = response.json()
+        if request.encoding_format == "float16":
+            # binary float16 matrix; slice it per row without decoding the floats
+            rows, dim = (int(n) for n in response.headers["X-Embedding-Shape"].split(","))
+            row_bytes = dim * 2
+            embeddings = [
+                base64.b64encode(response.content[i * row_bytes:(i + 1) * row_bytes]).decode("ascii")
+                for i in range(rows)
+            ]
+        else:
+            embeddings = loads(response.content)["embeddings"]
         
         # Format response like OpenAI
-        return {
+        return dumps({
             "data": [
                 {"embedding": emb, "index": i}
-                for i, emb in enumerate(result["embeddings"])
+                for i, emb in enumerate(embeddings)
             ],
             "model": request.model,
             "usage": {
                 "prompt_tokens": sum(len(text.split()) for text in request.texts) * 2,
                 "total_tokens": sum(len(text.split()) for text in request.texts) * 2
             }
-        }
+        })
     
+    except httpx.HTTPStatusError as e:
+        # pass backpressure (429) and dropped-at-deadline (504) through
+        raise HTTPException(status_code=e.response.status_code, detail=e.response.text)
+    except httpx.TimeoutException as e:
+        raise HTTPException(status_code=504, detail=f"Model server timed out: {e}")
     except Exception as e:
         logger.error(f"Embedding error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/v1/rerank")
-async def rerank(request: RerankRequest):
+async def rerank(
+    request: RerankRequest,
+    x_request_deadline: Optional[float] = Header(None),
+    cache_control: Optional[str] = Header(None),
+):
+    body, status = await rerank_cache.get_or_compute(
+        request_key(request.model_dump()),
+        lambda: forward_rerank(request, x_request_deadline),
+        cacheable=cache_allowed(cache_control),
+    )
+    return json_bytes_response(body, status)
+
+async def forward_rerank(request: RerankRequest, x_request_deadline: Optional[float]):
     try:
         # Forward to reranker service
-        response = await client.post(
-            f"{RERANKER_SERVICE_URL}/rerank",
-            json={
-                "query": request.query,
-                "documents": request.documents,
-                "top_k": request.top_k
-            }
-        )
+        with tracer.span("POST /rerank", documents=len(request.documents)):
+            response = await client.post(
+                f"{RERANKER_SERVICE_URL}/rerank",
+                json={
+                    "query": request.query,
+                    "documents": request.documents,
+                    "top_k": request.top_k
+                },
+                headers={**deadline_headers(x_request_deadline), **propagation_headers()},
+            )
         response.raise_for_status()
         
-        result = response.json()
+        result = loads(response.content)
         
-        return {
+        return dumps({
             "results": result["results"],
             "model": request.model
-        }
+        })
     
+    except httpx.HTTPStatusError as e:
+        # pass backpressure (429) and dropped-at-deadline (504) through
+        raise HTTPException(status_code=e.response.status_code, detail=e.response.text)
+    except httpx.TimeoutException as e:
+        raise HTTPException(status_code=504, detail=f"Model server timed out: {e}")
     except Exception as e:
         logger.error(f"Reranking error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,22 @@
+"""
+FastAPI response class for the HTTP servers, kept out of serialization.py so
+the RunPod handler does not import starlette.
+"""
+
+from typing import Any
+
+from starlette.responses import Response
+
+from serialization import dumps
+
+
+class NumpyJSONResponse(Response):
+    """
+    JSON response rendered with dumps(). Return it directly from a route (rather
+    than a dict or pydantic model) to also skip FastAPI's jsonable_encoder pass.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
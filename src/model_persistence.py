@@ -69,6 +69,31 @@ def get_model_path(model_name: str) -> Path:
     # Return the expected persistent path (model will be downloaded if needed)
     return model_path
 
+def prefetch_model_weights(model_paths, chunk_size: int = 16 * 1024 * 1024) -> int:
+    """
+    Read model weight files once so they sit in the page cache before the
+    engine loads them. Meant to run in a background thread while the heavy
+    imports happen. Returns the number of bytes read.
+    """
+    total = 0
+    for model_path in model_paths:
+        model_path = Path(model_path)
+        if not model_path.is_dir():
+            continue  # hub id, infinity will download it
+        for weight_file in sorted(model_path.rglob("*")):
+            if not weight_file.name.endswith((".safetensors", ".bin")):
+                continue
+            try:
+                with open(weight_file, "rb", buffering=0) as f:
+                    if hasattr(os, "posix_fadvise"):
+                        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                    while chunk := f.read(chunk_size):
+                        total += len(chunk)
+            except OSError as e:
+                logger.warning(f"Could not prefetch {weight_file}: {e}")
+    logger.info(f"Prefetched {total / 1e6:.1f} MB of model weights")
+    return total
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
     ensure_models_on_persistent_disk()
\ No newline at end of file
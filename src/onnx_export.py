@@ -0,0 +1,305 @@
+"""
+ONNX export cache for the optimum (CPU) backend.
+Exports the Qwen3 embedding and reranker models to ONNX on the volume,
+optionally int8-quantizes them, and records a parity check against the torch
+model plus a throughput comparison next to the exported files.
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+ONNX_MARKER = "onnx_export.json"
+
+PARITY_TEXTS = [
+    "What is the capital of China?",
+    "The capital of China is Beijing.",
+    "Gravity is a force that attracts two bodies towards each other.",
+    "Explain how neural networks are trained with backpropagation.",
+]
+
+
+def _architectures(model_path: str) -> List[str]:
+    from transformers import AutoConfig
+
+    return AutoConfig.from_pretrained(model_path).architectures or []
+
+
+def is_sequence_classifier(model_path: str) -> bool:
+    return any(arch.endswith("ForSequenceClassification") for arch in _architectures(model_path))
+
+
+def is_reranker(model_path: str) -> bool:
+    """
+    Sequence classifiers are rerankers. Qwen3 rerankers and embedders both
+    ship as causal LMs; the embedders carry a sentence-transformers module
+    list (modules.json), which infinity embeds through, the rerankers do not.
+    """
+    if is_sequence_classifier(model_path):
+        return True
+    if not any(arch.endswith("ForCausalLM") for arch in _architectures(model_path)):
+        return False
+    from transformers.utils import cached_file
+
+    modules = cached_file(
+        model_path,
+        "modules.json",
+        _raise_exceptions_for_missing_entries=False,
+        _raise_exceptions_for_connection_errors=False,
+    )
+    return modules is None
+
+
+def onnx_cache_path(cache_dir: str, model_path: str, quantize: bool) -> Path:
+    suffix = "int8" if quantize else "fp32"
+    return Path(cache_dir) / f"{Path(model_path).name}-onnx-{suffix}"
+
+
+def _parity_pairs(texts: List[str]) -> List[Tuple[str, str]]:
+    """(query, document) pairs scored as infinity receives them, without a prompt template"""
+    return [(texts[0], doc) for doc in texts]
+
+
+def _tokenize_pairs(tokenizer, pairs: List[Tuple[str, str]]):
+    return tokenizer(
+        [query for query, _ in pairs],
+        [doc for _, doc in pairs],
+        padding=True,
+        truncation=True,
+        return_tensors="pt",
+    )
+
+
+def _to_sequence_classifier(model_path: str, out_dir: str):
+    """
+    Rewrites the Qwen3 reranker (a causal LM scored on the yes/no logits of the
+    last position) as a 1-label sequence classifier whose head is the
+    difference of the `yes` and `no` rows of the LM head, so
+    sigmoid(logit) == softmax([no, yes])[yes].
+    """
+    import torch
+    from transformers import (
+        AutoConfig,
+        AutoModelForCausalLM,
+        AutoModelForSequenceClassification,
+        AutoTokenizer,
+    )
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path, padding_side="left")
+    causal = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float32)
+    token_true_id = tokenizer.convert_tokens_to_ids("yes")
+    token_false_id = tokenizer.convert_tokens_to_ids("no")
+
+    config = AutoConfig.from_pretrained(model_path)
+    config.num_labels = 1
+    config.pad_token_id = tokenizer.pad_token_id
+    config.architectures = [config.architectures[0].replace("ForCausalLM", "ForSequenceClassification")]
+    classifier = AutoModelForSequenceClassification.from_config(config, torch_dtype=torch.float32)
+    classifier.model.load_state_dict(causal.model.state_dict())
+    lm_head = causal.lm_head.weight.data
+    classifier.score.weight.data = (lm_head[token_true_id] - lm_head[token_false_id]).unsqueeze(0)
+
+    classifier.save_pretrained(out_dir)
+    tokenizer.save_pretrained(out_dir)
+
+
+def export_model(model_path: str, dst: Path, quantize: bool = False):
+    """Export one model to ONNX in dst, with model_quantized.onnx when quantize is set."""
+    from optimum.onnxruntime import (
+        ORTModelForFeatureExtraction,
+        ORTModelForSequenceClassification,
+        ORTQuantizer,
+    )
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    if dst.exists():
+        shutil.rmtree(dst)  # partial export
+    dst.mkdir(parents=True)
+
+    logger.info(f"Exporting {model_path} to ONNX at {dst}")
+    if is_sequence_classifier(model_path):
+        ort_model = ORTModelForSequenceClassification.from_pretrained(model_path, export=True)
+        ort_model.save_pretrained(dst)
+        AutoTokenizer.from_pretrained(model_path).save_pretrained(dst)
+    elif is_reranker(model_path):
+        with tempfile.TemporaryDirectory() as tmp:
+            _to_sequence_classifier(model_path, tmp)
+            ort_model = ORTModelForSequenceClassification.from_pretrained(tmp, export=True)
+            ort_model.save_pretrained(dst)
+            AutoTokenizer.from_pretrained(tmp).save_pretrained(dst)
+    else:
+        ort_model = ORTModelForFeatureExtraction.from_pretrained(model_path, export=True)
+        ort_model.save_pretrained(dst)
+        AutoTokenizer.from_pretrained(model_path).save_pretrained(dst)
+
+    if quantize:
+        logger.info(f"Quantizing {dst} to int8")
+        quantizer = ORTQuantizer.from_pretrained(dst)
+        qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+        quantizer.quantize(save_dir=dst, quantization_config=qconfig)
+
+
+def _torch_outputs(model_path: str, texts: List[str]):
+    import torch
+    from transformers import (
+        AutoModel,
+        AutoModelForCausalLM,
+        AutoModelForSequenceClassification,
+        AutoTokenizer,
+    )
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path, padding_side="left")
+    if is_sequence_classifier(model_path):
+        model = AutoModelForSequenceClassification.from_pretrained(model_path, torch_dtype=torch.float32).eval()
+
+        def run(batch):
+            logits = model(**_tokenize_pairs(tokenizer, batch)).logits[:, 0]
+            return torch.sigmoid(logits).numpy()
+
+        batch = _parity_pairs(texts)
+    elif is_reranker(model_path):
+        model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float32).eval()
+        token_true_id = tokenizer.convert_tokens_to_ids("yes")
+        token_false_id = tokenizer.convert_tokens_to_ids("no")
+
+        def run(batch):
+            logits = model(**_tokenize_pairs(tokenizer, batch)).logits[:, -1, :]
+            pair = torch.stack([logits[:, token_false_id], logits[:, token_true_id]], dim=1)
+            return torch.nn.functional.softmax(pair, dim=1)[:, 1].numpy()
+
+        batch = _parity_pairs(texts)
+    else:
+        model = AutoModel.from_pretrained(model_path, torch_dtype=torch.float32).eval()
+
+        def run(batch):
+            inputs = tokenizer(batch, padding=True, return_tensors="pt")
+            hidden = model(**inputs).last_hidden_state[:, -1]
+            return torch.nn.functional.normalize(hidden, dim=-1).numpy()
+
+        batch = texts
+    return run, batch
+
+
+def _onnx_outputs(onnx_dir: Path, reranker: bool, quantized: bool, texts: List[str]):
+    import numpy as np
+    from optimum.onnxruntime import (
+        ORTModelForFeatureExtraction,
+        ORTModelForSequenceClassification,
+    )
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(onnx_dir, padding_side="left")
+    file_name = "model_quantized.onnx" if quantized else "model.onnx"
+    if reranker:
+        model = ORTModelForSequenceClassification.from_pretrained(onnx_dir, file_name=file_name)
+
+        def run(batch):
+            logits = model(**_tokenize_pairs(tokenizer, batch)).logits[:, 0].numpy()
+            return 1.0 / (1.0 + np.exp(-logits))
+
+        batch = _parity_pairs(texts)
+    else:
+        model = ORTModelForFeatureExtraction.from_pretrained(onnx_dir, file_name=file_name)
+
+        def run(batch):
+            inputs = tokenizer(batch, padding=True, return_tensors="pt")
+            hidden = model(**inputs).last_hidden_state[:, -1].numpy()
+            return hidden / np.linalg.norm(hidden, axis=-1, keepdims=True)
+
+        batch = texts
+    return run, batch
+
+
+def _throughput(run, batch, rounds: int) -> float:
+    run(batch)  # warmup
+    start = time.perf_counter()
+    for _ in range(rounds):
+        run(batch)
+    return rounds * len(batch) / (time.perf_counter() - start)
+
+
+def parity_and_throughput(
+    model_path: str, onnx_dir: Path, quantized: bool, rounds: int = 5
+) -> Dict[str, float]:
+    """
+    Compares the ONNX export against the torch model on PARITY_TEXTS.
+    Embeddings report the minimum cosine similarity, rerankers the maximum
+    absolute score difference; both report items/s for each backend.
+    """
+    import numpy as np
+    import torch
+
+    reranker = is_reranker(model_path)
+    torch_run, torch_batch = _torch_outputs(model_path, PARITY_TEXTS)
+    onnx_run, onnx_batch = _onnx_outputs(onnx_dir, reranker, quantized, PARITY_TEXTS)
+
+    with torch.no_grad():
+        reference = torch_run(torch_batch)
+        torch_items_per_s = _throughput(torch_run, torch_batch, rounds)
+    candidate = onnx_run(onnx_batch)
+    onnx_items_per_s = _throughput(onnx_run, onnx_batch, rounds)
+
+    report = dict(
+        torch_items_per_s=round(float(torch_items_per_s), 2),
+        onnx_items_per_s=round(float(onnx_items_per_s), 2),
+    )
+    if reranker:
+        report["max_abs_score_diff"] = float(np.max(np.abs(reference - candidate)))
+    else:
+        report["min_cosine_similarity"] = float(np.min(np.sum(reference * candidate, axis=-1)))
+    return report
+
+
+def parity_ok(report: Dict[str, float], threshold: float) -> bool:
+    if "min_cosine_similarity" in report:
+        return report["min_cosine_similarity"] >= threshold
+    return report["max_abs_score_diff"] <= 1.0 - threshold
+
+
+def ensure_onnx_models(
+    model_paths: List[str], cache_dir: str, quantize: bool, parity_threshold: float
+) -> List[str]:
+    """
+    Returns the ONNX directory for each model, exporting it on first use.
+    An export is reused only if its marker file exists, i.e. it completed and
+    passed the parity check.
+    """
+    onnx_paths = []
+    for model_path in model_paths:
+        dst = onnx_cache_path(cache_dir, model_path, quantize)
+        marker = dst / ONNX_MARKER
+        if marker.exists():
+            logger.info(f"Using cached ONNX export {dst}: {marker.read_text()}")
+        else:
+            export_model(model_path, dst, quantize=quantize)
+            report = parity_and_throughput(model_path, dst, quantized=quantize)
+            logger.info(f"ONNX parity and throughput for {model_path}: {report}")
+            if not parity_ok(report, parity_threshold):
+                raise ValueError(
+                    f"ONNX export of {model_path} failed the parity check "
+                    f"(threshold {parity_threshold}): {report}"
+                )
+            marker.write_text(json.dumps(dict(source=model_path, quantized=quantize, **report)))
+        onnx_paths.append(str(dst))
+    return onnx_paths
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Export models to ONNX and compare with torch")
+    parser.add_argument("models", nargs="+")
+    parser.add_argument("--cache-dir", default=os.path.join("/runpod-volume", "onnx"))
+    parser.add_argument("--quantize", action="store_true")
+    parser.add_argument("--parity-threshold", type=float, default=0.99)
+    args = parser.parse_args()
+    ensure_onnx_models(args.models, args.cache_dir, args.quantize, args.parity_threshold)
@@ -0,0 +1,124 @@
+"""
+Sequence packing: a batch of variable-length token sequences runs as one
+unpadded row. Position ids restart at every sequence, and attention stays
+inside each sequence either through flash-attention varlen kernels (which
+transformers selects from the restarting position ids) or through an explicit
+block-diagonal causal mask. Per-sequence outputs are pooled back out of the
+packed hidden states.
+
+PACKING_MODES:
+    off    - pad to the longest sequence and rely on the attention mask
+    varlen - requires attn_implementation="flash_attention_2"; no mask at all
+    mask   - any attention implementation; the (tokens x tokens) mask grows
+             quadratically, so packs are capped at max_tokens
+"""
+
+from typing import Dict, List, Optional
+
+import torch
+
+PACKING_MODES = ("off", "varlen", "mask")
+
+
+def pack_groups(lengths: List[int], max_tokens: int) -> List[List[int]]:
+    """
+    Consecutive sequence indices grouped into packs of at most max_tokens
+    tokens; a longer sequence gets a pack of its own
+    """
+    groups, current, used = [], [], 0
+    for index, length in enumerate(lengths):
+        if current and used + length > max_tokens:
+            groups.append(current)
+            current, used = [], 0
+        current.append(index)
+        used += length
+    if current:
+        groups.append(current)
+    return groups
+
+
+def block_causal_mask(lengths: List[int], dtype: torch.dtype, device) -> torch.Tensor:
+    """(1, 1, T, T) additive mask: causal within each sequence, blocked across them"""
+    seq_ids = torch.repeat_interleave(
+        torch.arange(len(lengths), device=device), torch.tensor(lengths, device=device)
+    )
+    allowed = seq_ids[:, None] == seq_ids[None, :]
+    allowed &= torch.ones_like(allowed).tril()
+    mask = torch.zeros(allowed.shape, dtype=dtype, device=device)
+    mask.masked_fill_(~allowed, torch.finfo(dtype).min)
+    return mask[None, None]
+
+
+def pack_inputs(
+    token_ids: List[List[int]], mode: str, device, dtype: torch.dtype
+) -> Dict[str, torch.Tensor]:
+    """model kwargs for the sequences packed into one row"""
+    if mode not in PACKING_MODES[1:]:
+        raise ValueError(f"Invalid packing mode '{mode}', expected one of {list(PACKING_MODES[1:])}")
+    lengths = [len(ids) for ids in token_ids]
+    inputs = {
+        "input_ids": torch.tensor([[t for ids in token_ids for t in ids]], device=device),
+        "position_ids": torch.cat([torch.arange(n) for n in lengths])[None].to(device),
+    }
+    if mode == "mask":
+        inputs["attention_mask"] = block_causal_mask(lengths, dtype, device)
+    return inputs
+
+
+def last_token_states(hidden: torch.Tensor, lengths: List[int]) -> torch.Tensor:
+    """(n, H) hidden state of each packed sequence's last token"""
+    ends = torch.tensor(lengths, device=hidden.device).cumsum(0) - 1
+    return hidden[0, ends]
+
+
+def mean_pool(hidden: torch.Tensor, lengths: List[int]) -> torch.Tensor:
+    """(n, H) mean over each packed sequence's tokens, accumulated in float32"""
+    seq_ids = torch.repeat_interleave(
+        torch.arange(len(lengths), device=hidden.device), torch.tensor(lengths, device=hidden.device)
+    )
+    sums = torch.zeros(len(lengths), hidden.shape[-1], dtype=torch.float32, device=hidden.device)
+    sums.index_add_(0, seq_ids, hidden[0].float())
+    return sums / torch.tensor(lengths, dtype=torch.float32, device=hidden.device)[:, None]
+
+
+class PaddingStats:
+    """
+    Padding efficiency (real tokens / token slots computed) per batch and in
+    total; padded batches compute n * longest slots, packed ones only the real tokens
+    """
+
+    def __init__(self):
+        self.batches = 0
+        self.tokens = 0
+        self.slots = 0
+        self.padded_slots = 0
+        self.last: Optional[dict] = None
+
+    def record(self, lengths: List[int], packed: bool) -> dict:
+        tokens = sum(lengths)
+        padded_slots = len(lengths) * max(lengths, default=0)
+        slots = tokens if packed else padded_slots
+        self.batches += 1
+        self.tokens += tokens
+        self.slots += slots
+        self.padded_slots += padded_slots
+        self.last = dict(
+            sequences=len(lengths),
+            tokens=tokens,
+            slots=slots,
+            packed=packed,
+            padding_efficiency=round(tokens / slots, 4) if slots else 1.0,
+            # what the same batch would have reached padded
+            padded_efficiency=round(tokens / padded_slots, 4) if padded_slots else 1.0,
+        )
+        return self.last
+
+    def stats(self) -> dict:
+        return dict(
+            batches=self.batches,
+            tokens=self.tokens,
+            slots=self.slots,
+            padding_efficiency=round(self.tokens / self.slots, 4) if self.slots else 1.0,
+            padded_efficiency=round(self.tokens / self.padded_slots, 4) if self.padded_slots else 1.0,
+            last_batch=self.last,
+        )
@@ -0,0 +1,116 @@
+"""
+Request priority classes for one model: interactive requests go straight to
+the engine, bulk requests are cut into slices that enter the engine queue
+while no interactive request is in flight, or once they have waited
+max_bulk_wait for that, so bulk work cannot starve.
+"""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITY_CLASSES = (INTERACTIVE, BULK)
+
+T = TypeVar("T")
+
+
+def classify_priority(
+    explicit: Optional[str], prompt_type: Optional[str], items: int, bulk_threshold: int
+) -> str:
+    """explicit class wins, then query prompts are interactive, then batch size decides"""
+    if explicit is not None:
+        if explicit not in PRIORITY_CLASSES:
+            raise ValueError(
+                f"Invalid priority '{explicit}', expected one of {list(PRIORITY_CLASSES)}"
+            )
+        return explicit
+    if prompt_type == "query":
+        return INTERACTIVE
+    return BULK if items > bulk_threshold else INTERACTIVE
+
+
+class LatencyStats:
+    """latency percentiles over the most recent `window` requests"""
+
+    def __init__(self, window: int = 1024):
+        self.samples: deque = deque(maxlen=window)
+        self.count = 0
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def summary(self) -> Dict[str, float]:
+        if not self.samples:
+            return dict(count=self.count)
+        ordered = sorted(self.samples)
+
+        def pct(p):
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 2)
+
+        return dict(
+            count=self.count,
+            mean_ms=round(sum(ordered) / len(ordered) * 1000, 2),
+            p50_ms=pct(0.50),
+            p95_ms=pct(0.95),
+            p99_ms=pct(0.99),
+        )
+
+
+class PriorityScheduler:
+    """
+    max_bulk_slices bounds the bulk slices in the engine queue at once,
+    typically one per replica so bulk work can use every replica
+    """
+
+    def __init__(self, slice_size: int, max_bulk_slices: int = 1, max_bulk_wait: float = 0.5):
+        self.slice_size = slice_size
+        self.max_bulk_wait = max_bulk_wait
+        # slices that went ahead while interactive work was in flight
+        self.aged_slices = 0
+        self.interactive_inflight = 0
+        self._interactive_idle = asyncio.Event()
+        self._interactive_idle.set()
+        self._bulk_slots = asyncio.Semaphore(max_bulk_slices)
+        self.latency = {cls: LatencyStats() for cls in PRIORITY_CLASSES}
+
+    @asynccontextmanager
+    async def interactive(self):
+        self.interactive_inflight += 1
+        self._interactive_idle.clear()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.latency[INTERACTIVE].record(time.perf_counter() - start)
+            self.interactive_inflight -= 1
+            if self.interactive_inflight == 0:
+                self._interactive_idle.set()
+
+    async def run_bulk(
+        self, items: List, fn: Callable[[List], Awaitable[T]]
+    ) -> List[T]:
+        """runs fn over consecutive slices of items, yielding to interactive work between slices"""
+        start = time.perf_counter()
+        results = []
+        try:
+            for i in range(0, len(items), self.slice_size):
+                async with self._bulk_slots:
+                    try:
+                        await asyncio.wait_for(self._interactive_idle.wait(), self.max_bulk_wait)
+                    except asyncio.TimeoutError:
+                        self.aged_slices += 1
+                    results.append(await fn(items[i : i + self.slice_size]))
+        finally:
+            self.latency[BULK].record(time.perf_counter() - start)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **{cls: stats.summary() for cls, stats in self.latency.items()},
+            "aged_bulk_slices": self.aged_slices,
+        }
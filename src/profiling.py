@@ -0,0 +1,274 @@
+"""
+Opt-in profiles of slow or flagged requests. While profiling is enabled a
+background thread samples the stacks of every thread (wall clock, so time
+spent waiting shows up too) into a short history; when a request takes longer
+than the slow threshold, or was flagged, the samples taken during it are
+folded into collapsed stacks (flamegraph.pl / speedscope format) and saved.
+Flagged requests additionally run under the torch profiler when torch is
+loaded, since that has to start before the request does. The newest
+max_profiles profiles are kept on disk, e.g. on the network volume.
+"""
+
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, List, Optional
+
+from tracing import current_span
+
+DEFAULT_PROFILE_DIR = "/runpod-volume/profiles"
+PROFILE_HEADER = "X-Profile"
+PROFILE_FILE = "profile.json"
+TORCH_TRACE_FILE = "torch_trace.json"
+
+logger = logging.getLogger(__name__)
+
+
+def _format_stack(frame) -> str:
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+class StackSampler:
+    """
+    Samples every thread's stack each `interval` seconds and keeps the last
+    `history` seconds of (timestamp ns, collapsed stack) samples
+    """
+
+    def __init__(self, interval: float = 0.02, history: float = 120.0):
+        self.interval = interval
+        self.history_ns = int(history * 1e9)
+        self.samples: deque = deque()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True, name="stack-sampler")
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            now = time.time_ns()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = f"{names.get(ident, ident)};{_format_stack(frame)}"
+                # identical stacks repeat across samples; keep one string of each
+                self.samples.append((now, sys.intern(stack)))
+            while self.samples and self.samples[0][0] < now - self.history_ns:
+                self.samples.popleft()
+
+    def collapsed(self, start_ns: int, end_ns: int) -> Dict[str, int]:
+        """sample counts per stack between start_ns and end_ns"""
+        return dict(Counter(stack for ts, stack in list(self.samples) if start_ns <= ts <= end_ns))
+
+
+class Profiler:
+    """
+    `profile(name)` wraps one request. Profiles are written off the request
+    path to store_dir/<id>/ as profile.json (metadata and collapsed stacks)
+    plus torch_trace.json (chrome trace) for flagged requests.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        store_dir: str = DEFAULT_PROFILE_DIR,
+        slow_ms: float = 1000.0,
+        max_profiles: int = 20,
+        interval: float = 0.02,
+        history: float = 120.0,
+    ):
+        self.enabled = enabled
+        self.store_dir = store_dir
+        self.slow_ms = slow_ms
+        self.max_profiles = max_profiles
+        self.sampler = StackSampler(interval, history)
+        self.captured = 0
+        # the torch profiler is process-wide, so one flagged request at a time uses it
+        self._torch_lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile-writer")
+        if enabled:
+            self.sampler.start()
+
+    def _torch_profiler(self):
+        """a torch profiler for this request, or None without torch or while one is running"""
+        torch = sys.modules.get("torch")
+        if torch is None or not self._torch_lock.acquire(blocking=False):
+            return None
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        # the profiler starts on the loop thread, but the model runs on
+        # inference/engine threads, which it only records when told to
+        try:
+            config = torch._C._profiler._ExperimentalConfig(profile_all_threads=True)
+        except (AttributeError, TypeError):
+            logger.warning("This torch cannot profile other threads; the torch trace will lack model ops")
+            config = None
+        return torch.profiler.profile(activities=activities, record_shapes=True, experimental_config=config)
+
+    @contextmanager
+    def profile(self, name: str, force: bool = False, request_id: Optional[str] = None):
+        """
+        saves a profile of the block if it ran for at least slow_ms, or
+        always with force; a no-op while profiling is disabled
+        """
+        if not self.enabled:
+            yield
+            return
+        torch_profiler = self._torch_profiler() if force else None
+        start_ns = time.time_ns()
+        try:
+            with torch_profiler if torch_profiler is not None else nullcontext():
+                yield
+        finally:
+            end_ns = time.time_ns()
+            if torch_profiler is not None:
+                self._torch_lock.release()
+            duration_ms = (end_ns - start_ns) / 1e6
+            if force or duration_ms >= self.slow_ms:
+                meta = dict(
+                    name=name,
+                    request_id=request_id,
+                    trigger="flag" if force else "slow",
+                    duration_ms=round(duration_ms, 3),
+                    start_unix=start_ns / 1e9,
+                    sample_interval_ms=self.sampler.interval * 1000,
+                )
+                self.captured += 1
+                self._writer.submit(self._save, meta, start_ns, end_ns, torch_profiler)
+
+    def _save(self, meta: Dict[str, Any], start_ns: int, end_ns: int, torch_profiler):
+        try:
+            profile_id = f"{start_ns}-{(meta['request_id'] or 'request').replace('/', '_')}"
+            path = os.path.join(self.store_dir, profile_id)
+            os.makedirs(path, exist_ok=True)
+            stacks = self.sampler.collapsed(start_ns, end_ns)
+            if torch_profiler is not None:
+                torch_profiler.export_chrome_trace(os.path.join(path, TORCH_TRACE_FILE))
+            with open(os.path.join(path, PROFILE_FILE), "w") as f:
+                json.dump(dict(id=profile_id, **meta, samples=sum(stacks.values()), stacks=stacks), f)
+            logger.info(f"Saved {meta['trigger']} profile {profile_id} ({meta['duration_ms']:.0f} ms)")
+            self._prune()
+        except Exception as e:  # noqa: BLE001  (profiling must never fail a request)
+            logger.error(f"Saving profile failed: {e}")
+
+    def _prune(self):
+        for profile_id in self._ids()[self.max_profiles:]:
+            shutil.rmtree(os.path.join(self.store_dir, profile_id), ignore_errors=True)
+
+    def _ids(self) -> List[str]:
+        """stored profile ids, newest first"""
+        if not os.path.isdir(self.store_dir):
+            return []
+        ids = [entry for entry in os.listdir(self.store_dir) if entry.split("-", 1)[0].isdigit()]
+        return sorted(ids, key=lambda entry: int(entry.split("-", 1)[0]), reverse=True)
+
+    def list(self) -> List[Dict[str, Any]]:
+        """metadata of the stored profiles, newest first"""
+        found = []
+        for profile_id in self._ids():
+            profile = self.load(profile_id)
+            if profile is not None:
+                profile.pop("stacks", None)
+                profile["torch_trace"] = self.torch_trace_path(profile_id) is not None
+                found.append(profile)
+        return found
+
+    def _path(self, profile_id: str) -> Optional[str]:
+        # ids come from callers; only plain directory names below store_dir
+        if not profile_id or os.path.basename(profile_id) != profile_id or profile_id.startswith("."):
+            return None
+        return os.path.join(self.store_dir, profile_id)
+
+    def load(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        path = self._path(profile_id)
+        if path is None or not os.path.exists(os.path.join(path, PROFILE_FILE)):
+            return None
+        try:
+            with open(os.path.join(path, PROFILE_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def torch_trace_path(self, profile_id: str) -> Optional[str]:
+        path = self._path(profile_id)
+        if path is None or not os.path.exists(os.path.join(path, TORCH_TRACE_FILE)):
+            return None
+        return os.path.join(path, TORCH_TRACE_FILE)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(enabled=self.enabled, slow_ms=self.slow_ms, captured=self.captured, store_dir=self.store_dir)
+
+
+class ProfileMiddleware:
+    """
+    ASGI middleware: every request is profiled if slow; an X-Profile: 1
+    header forces a profile (including a torch trace). Installed inside
+    TraceMiddleware, profiles carry the request id of the trace.
+    """
+
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.enabled or scope["path"].startswith("/debug/"):
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        force = headers.get(PROFILE_HEADER.lower().encode(), b"").decode("latin-1").lower() in ("1", "true")
+        span = current_span()
+        request_id = span.request_id if span is not None else None
+        with self.profiler.profile(f"{scope['method']} {scope['path']}", force, request_id):
+            await self.app(scope, receive, send)
+
+
+def install(app, profiler: Profiler):
+    """adds ProfileMiddleware and the GET /debug/profiles routes to a FastAPI app"""
+    from fastapi import HTTPException
+    from fastapi.responses import FileResponse
+
+    app.add_middleware(ProfileMiddleware, profiler=profiler)
+
+    # plain functions: FastAPI runs them in its threadpool, off the loop, as they read disk
+
+    @app.get("/debug/profiles")
+    def debug_profiles():
+        return {**profiler.stats(), "profiles": profiler.list()}
+
+    @app.get("/debug/profiles/{profile_id}")
+    def debug_profile(profile_id: str):
+        profile = profiler.load(profile_id)
+        if profile is None:
+            raise HTTPException(status_code=404, detail=f"No profile {profile_id}")
+        return profile
+
+    @app.get("/debug/profiles/{profile_id}/torch")
+    def debug_profile_torch_trace(profile_id: str):
+        path = profiler.torch_trace_path(profile_id)
+        if path is None:
+            raise HTTPException(status_code=404, detail=f"No torch trace for profile {profile_id}")
+        return FileResponse(path, media_type="application/json")
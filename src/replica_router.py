@@ -0,0 +1,74 @@
+"""
+Load-aware routing across engine replicas of one model.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+
+class ReplicaRouter:
+    """
+    Sends each request to the replica with the fewest in-flight items.
+    With max_tokens, a replica only admits work while its in-flight padded
+    tokens stay within that budget (work that is over budget on its own runs
+    alone), so the batches its engine forms cannot exceed it.
+    All bookkeeping happens on the event loop thread, so no locking is needed.
+    """
+
+    def __init__(self, engines: List[Any], devices: List[str], max_tokens: int = 0):
+        self.engines = list(engines)
+        self.devices = list(devices)
+        self.max_tokens = max_tokens
+        self.inflight = [0] * len(self.engines)
+        self.inflight_tokens = [0] * len(self.engines)
+        self.served = [0] * len(self.engines)
+        # set (and replaced) whenever tokens are released
+        self._released: Optional[asyncio.Event] = None
+
+    def __len__(self):
+        return len(self.engines)
+
+    def __iter__(self):
+        return iter(self.engines)
+
+    def _fits(self, tokens: int) -> Optional[int]:
+        """least-loaded replica with room for tokens, None if none has"""
+        fitting = [
+            index
+            for index, used in enumerate(self.inflight_tokens)
+            if not self.max_tokens or used == 0 or used + tokens <= self.max_tokens
+        ]
+        return min(fitting, key=self.inflight.__getitem__) if fitting else None
+
+    @asynccontextmanager
+    async def acquire(self, items: int = 1, tokens: int = 0):
+        """
+        yields the least-loaded replica with room for `tokens` padded tokens,
+        waiting for one if needed, counting `items` and `tokens` against it until exit
+        """
+        index = self._fits(tokens)
+        while index is None:
+            if self._released is None:
+                self._released = asyncio.Event()
+            await self._released.wait()
+            index = self._fits(tokens)
+        self.inflight[index] += items
+        self.inflight_tokens[index] += tokens
+        try:
+            yield self.engines[index]
+        finally:
+            self.inflight[index] -= items
+            self.inflight_tokens[index] -= tokens
+            self.served[index] += items
+            if tokens and self._released is not None:
+                self._released.set()
+                self._released = None
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [
+            dict(device=device, inflight=inflight, inflight_tokens=tokens, served=served)
+            for device, inflight, tokens, served in zip(
+                self.devices, self.inflight, self.inflight_tokens, self.served
+            )
+        ]
@@ -4,40 +4,114 @@ Serves Qwen3-Reranker-0.6B model via FastAPI
 """
 
 import os
-from fastapi import FastAPI, HTTPException
+import asyncio
+from fastapi import FastAPI, Header, HTTPException
 from pydantic import BaseModel
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 import torch
 from transformers import AutoModelForSequenceClassification, AutoTokenizer
+from inference_worker import InferenceWorker, QueueFullError, RequestTooLargeError
+from deadlines import DeadlineExceeded
+from shared_weights import DEFAULT_SHARED_WEIGHTS_DIR, load_shared
+from json_response import NumpyJSONResponse
+from profiling import DEFAULT_PROFILE_DIR, Profiler, install as install_profiling
+from tracing import Tracer, install as install_tracing
+from packing import PACKING_MODES, PaddingStats, last_token_states, pack_groups, pack_inputs
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+app = FastAPI(default_response_class=NumpyJSONResponse)
 
 # Model configuration
 MODEL_PATH = "/models/Qwen3-Reranker-0.6B"
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+# (query, document) pairs batched per forward pass across requests, and pairs allowed to wait
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 32))
+MAX_QUEUE_ITEMS = int(os.getenv("MAX_QUEUE_ITEMS", 1024))
+# uvicorn worker processes; with SHARED_WEIGHTS (the default for several
+# workers) CPU weights are memory-mapped once and shared by all of them
+WORKERS = int(os.getenv("WORKERS", 1))
+SHARED_WEIGHTS = os.getenv("SHARED_WEIGHTS", str(WORKERS > 1)).lower() == "true"
+SHARED_WEIGHTS_DIR = os.getenv("SHARED_WEIGHTS_DIR", DEFAULT_SHARED_WEIGHTS_DIR)
+# "varlen" (flash-attention) or "mask" (block-diagonal mask) run each batch
+# as unpadded packed rows of at most PACK_MAX_TOKENS tokens; "off" pads
+PACKING = os.getenv("PACKING", "off")
+PACK_MAX_TOKENS = int(os.getenv("PACK_MAX_TOKENS", 8192))
+# finished request spans: kept for GET /debug/traces ("buffer"), logged as
+# OTLP JSON lines ("log"), "both" or "off"
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "buffer")
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", 2048))
+# opt-in profiles of requests slower than PROFILE_SLOW_MS or sent with
+# X-Profile: 1, the newest PROFILE_MAX_COUNT kept in PROFILE_DIR
+PROFILING = os.getenv("PROFILING", "false").lower() == "true"
+PROFILE_DIR = os.getenv("PROFILE_DIR", DEFAULT_PROFILE_DIR)
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", 1000))
+PROFILE_MAX_COUNT = int(os.getenv("PROFILE_MAX_COUNT", 20))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 20))
 
 # Load model on startup
 model = None
 tokenizer = None
+worker = None
+padding_stats = PaddingStats()
+tracer = Tracer("reranker-server", TRACE_EXPORT, TRACE_BUFFER_SIZE)
+profiler = Profiler(
+    PROFILING, PROFILE_DIR, PROFILE_SLOW_MS, PROFILE_MAX_COUNT, interval=PROFILE_INTERVAL_MS / 1000
+)
+# installed first so it runs inside the trace span and profiles carry its request id
+install_profiling(app, profiler)
+install_tracing(app, tracer)
+
+def load_weights(**kwargs):
+    """
+    the model, with the shared mmap'd weights when SHARED_WEIGHTS is on (never
+    loading a private copy first), else privately loaded
+    """
+    if SHARED_WEIGHTS and device.type == "cpu":
+        return load_shared(AutoModelForSequenceClassification, MODEL_PATH, SHARED_WEIGHTS_DIR, **kwargs)
+    if SHARED_WEIGHTS:
+        # each process keeps its own device copy; host memory is released after .to()
+        logger.info(f"SHARED_WEIGHTS only applies to CPU serving, ignoring it on {device}")
+    return AutoModelForSequenceClassification.from_pretrained(MODEL_PATH, **kwargs)
 
 @app.on_event("startup")
 async def load_model():
-    global model, tokenizer
+    global model, tokenizer, worker
     logger.info(f"Loading reranker model from {MODEL_PATH}")
     
+    if PACKING not in PACKING_MODES:
+        raise ValueError(f"Invalid PACKING '{PACKING}', expected one of {list(PACKING_MODES)}")
+    # varlen packing needs flash-attention kernels
+    model_kwargs = {"attn_implementation": "flash_attention_2"} if PACKING == "varlen" else {}
+
+    if WORKERS > 1 and device.type == "cpu":
+        # split the cores between the workers instead of oversubscribing them
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // WORKERS))
+
     try:
         tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
-        model = AutoModelForSequenceClassification.from_pretrained(MODEL_PATH).to(device)
+        model = load_weights(**model_kwargs)
+        if PACKING != "off" and not hasattr(model, "score"):
+            raise ValueError(f"PACKING needs a model with a `score` head, {type(model).__name__} has none")
+        model = model.to(device)
         model.eval()
         logger.info(f"Model loaded successfully on {device}")
     except Exception as e:
         logger.error(f"Failed to load model: {e}")
         raise
 
+    worker = InferenceWorker(
+        score_pairs, max_batch_items=MAX_BATCH_SIZE, max_queue_items=MAX_QUEUE_ITEMS, tracer=tracer, name="rerank"
+    )
+    await worker.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    if worker:
+        await worker.stop()
+
 class RerankRequest(BaseModel):
     query: str
     documents: List[str]
@@ -48,31 +122,57 @@ class RerankResponse(BaseModel):
 
 @app.get("/health")
 async def health():
-    return {"status": "healthy", "model": "Qwen3-Reranker-0.6B", "device": str(device)}
+    return {
+        "status": "healthy",
+        "model": "Qwen3-Reranker-0.6B",
+        "device": str(device),
+        "queue": worker.stats() if worker else None,
+        "padding": padding_stats.stats(),
+    }
+
+def tokenize_pairs(query: str, documents: List[str]) -> List[List[int]]:
+    """token ids of each (query, document) pair, cut to 512 tokens"""
+    return tokenizer([query] * len(documents), documents, truncation=True, max_length=512)["input_ids"]
+
+def score_pairs(token_ids: List[List[int]]) -> List[float]:
+    """Runs on the inference thread with the tokenized pairs of one or more requests"""
+    lengths = [len(ids) for ids in token_ids]
+    with torch.no_grad():
+        if PACKING != "off":
+            padding_stats.record(lengths, packed=True)
+            scores = []
+            for group in pack_groups(lengths, PACK_MAX_TOKENS):
+                inputs = pack_inputs([token_ids[i] for i in group], PACKING, device, model.dtype)
+                hidden = model.base_model(**inputs).last_hidden_state
+                # the classifier reads each pair's last token, as in the padded forward
+                last = last_token_states(hidden, [lengths[i] for i in group])
+                scores.append(model.score(last)[:, 0])
+            return torch.cat(scores).tolist()
+
+        inputs = tokenizer.pad(
+            {"input_ids": token_ids},
+            padding=True,
+            return_tensors="pt"
+        ).to(device)
+        padding_stats.record(lengths, packed=False)
+        
+        outputs = model(**inputs)
+        return outputs.logits[:, 0].tolist()  # Get relevance scores
 
 @app.post("/rerank")
-async def rerank(request: RerankRequest):
+async def rerank(
+    request: RerankRequest, x_request_deadline: Optional[float] = Header(None)
+):
     if not model:
         raise HTTPException(status_code=503, detail="Model not loaded")
     
     try:
-        scores = []
-        
-        with torch.no_grad():
-            # Score each document against the query
-            for i, doc in enumerate(request.documents):
-                inputs = tokenizer(
-                    request.query,
-                    doc,
-                    return_tensors="pt",
-                    padding=True,
-                    truncation=True,
-                    max_length=512
-                ).to(device)
-                
-                outputs = model(**inputs)
-                score = outputs.logits[0].item()  # Get relevance score
-                scores.append((i, score))
+        # tokenize off the loop and alongside the running batch, then score
+        # every document against the query on the inference thread
+        with tracer.span("tokenize", pairs=len(request.documents)):
+            token_ids = await asyncio.to_thread(tokenize_pairs, request.query, request.documents)
+        pair_scores = await worker.submit(token_ids, deadline=x_request_deadline)
+        scores = list(enumerate(pair_scores))
         
         # Sort by score descending and return top_k
         scores.sort(key=lambda x: x[1], reverse=True)
@@ -80,10 +180,17 @@ async def rerank(request: RerankRequest):
         
         return RerankResponse(results=top_results)
     
+    except RequestTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Reranking error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8002)
\ No newline at end of file
+    # passed as an import string so uvicorn can start WORKERS processes
+    uvicorn.run("reranker_server:app", host="0.0.0.0", port=8002, workers=WORKERS)
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""
+Gateway response cache: LRU with TTL keyed on the normalized request body.
+Identical requests arriving while one is already being computed wait for
+that result instead of hitting the model servers again (single-flight).
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+CACHE_STATUS_HEADER = "X-Cache"
+HIT, MISS, COALESCED, BYPASS = "HIT", "MISS", "COALESCED", "BYPASS"
+
+
+def request_key(body: Dict[str, Any]) -> bytes:
+    """hash of the body with sorted keys, so field order and spacing do not matter"""
+    normalized = json.dumps(body, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+
+
+class ResponseCache:
+    """
+    max_entries bounds the number of cached responses (0 disables caching but
+    keeps coalescing); entries older than ttl_seconds are treated as misses.
+    Coalesced callers compute for themselves when the shared computation
+    fails with an error retry_on accepts, e.g. the first caller's deadline
+    passing, which says nothing about their own.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 4096,
+        ttl_seconds: float = 300.0,
+        retry_on: Optional[Callable[[BaseException], bool]] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.retry_on = retry_on
+        self._entries: "OrderedDict[bytes, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[bytes, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _lookup(self, key: bytes):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key: bytes, value: Any):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_compute(
+        self, key: bytes, compute: Callable[[], Awaitable[Any]], cacheable: bool = True
+    ) -> Tuple[Any, str]:
+        """
+        (response, cache status). Failures are never cached; they reach every
+        coalesced caller unless retry_on accepts them, then each caller runs
+        its own compute. The computation runs as its own task, so a caller
+        that disconnects does not cancel it for the others.
+        """
+        if not cacheable:
+            self.bypassed += 1
+            return await compute(), BYPASS
+
+        entry = self._lookup(key)
+        if entry is not None:
+            self.hits += 1
+            return entry[1], HIT
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(task), COALESCED
+            except Exception as e:
+                if self.retry_on is None or not self.retry_on(e):
+                    raise
+            self.retried += 1
+            return await compute(), MISS
+
+        self.misses += 1
+        task = asyncio.ensure_future(compute())
+        self._inflight[key] = task
+
+        def _done(finished: asyncio.Task):
+            self._inflight.pop(key, None)
+            if not finished.cancelled() and finished.exception() is None:
+                self._store(key, finished.result())
+
+        task.add_done_callback(_done)
+        return await asyncio.shield(task), MISS
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return dict(
+            entries=len(self._entries),
+            max_entries=self.max_entries,
+            ttl_seconds=self.ttl_seconds,
+            inflight=len(self._inflight),
+            hits=self.hits,
+            misses=self.misses,
+            coalesced=self.coalesced,
+            retried=self.retried,
+            bypassed=self.bypassed,
+            evictions=self.evictions,
+            expirations=self.expirations,
+            # requests answered without their own model server call
+            hit_rate=round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        )
@@ -0,0 +1,98 @@
+"""
+JSON serialization that writes NumPy arrays directly (orjson with
+OPT_SERIALIZE_NUMPY) instead of going through nested Python float lists;
+json_response.NumpyJSONResponse renders with it. Falls back to stdlib json
+when orjson is not installed.
+
+    python serialization.py    # microbenchmarks for 1K x 1024 vectors
+"""
+
+import json
+from typing import Any
+
+import numpy as np
+
+try:
+    import orjson
+
+    _OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+except ImportError:  # pragma: no cover - orjson ships with infinity-emb[server]
+    orjson = None
+
+
+def _default(obj: Any):
+    if isinstance(obj, np.ndarray):
+        # dtypes orjson cannot write natively (e.g. non-contiguous or float16 on old orjson)
+        if orjson is not None and obj.dtype.kind == "f":
+            return np.ascontiguousarray(obj, dtype=np.float32)
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    """compact JSON bytes; ndarrays and numpy scalars may appear anywhere in obj"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+    return json.dumps(obj, default=_default, separators=(",", ":")).encode("utf-8")
+
+
+def float_rows(matrix) -> list:
+    """
+    Rows of a float matrix as lists of Python floats, for outputs that are
+    serialized by someone else's stdlib json (RunPod). With orjson the values
+    take their shortest float32 repr, so the same float32 values are written
+    with about half the digits, e.g. 0.1 instead of 0.10000000149011612.
+    """
+    matrix = np.asarray(matrix)
+    if orjson is not None and matrix.dtype.kind == "f" and matrix.dtype.itemsize <= 4:
+        return orjson.loads(orjson.dumps(np.ascontiguousarray(matrix, dtype=np.float32), option=_OPTIONS))
+    return matrix.tolist()
+
+
+def loads(data: bytes | str) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _benchmark(n: int = 1000, dim: int = 1024, repeat: int = 5):
+    """one 1K x 1024 embedding response through each serialization path"""
+    import time
+
+    from utils import list_embeddings_to_response
+
+    vectors = np.random.rand(n, dim).astype(np.float32)
+    rows = vectors.tolist()
+
+    def timed(label, fn):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            size = len(fn())
+        print(f"{label:<48} {(time.perf_counter() - start) / repeat * 1000:9.1f} ms  {size / 2**20:6.1f} MiB")
+
+    timed("stdlib json of float lists", lambda: json.dumps({"embeddings": rows}))
+    try:
+        from pydantic import BaseModel
+
+        class EmbeddingResponse(BaseModel):
+            embeddings: list[list[float]]
+
+        timed(
+            "pydantic List[List[float]] + model_dump_json",
+            lambda: EmbeddingResponse(embeddings=rows).model_dump_json(),
+        )
+    except ImportError:
+        pass
+    timed("dumps(ndarray)", lambda: dumps({"embeddings": vectors}))
+    timed("dumps(ndarray float16)", lambda: dumps({"embeddings": vectors.astype(np.float16)}))
+    timed("float16 bytes (application/octet-stream)", lambda: vectors.astype("<f2").tobytes())
+    timed(
+        "RunPod: list_embeddings_to_response + json",
+        lambda: json.dumps(list_embeddings_to_response(vectors, "m", 0)),
+    )
+
+
+if __name__ == "__main__":
+    _benchmark()
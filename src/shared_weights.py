@@ -0,0 +1,203 @@
+"""
+Weights shared by several server processes on one host.
+
+Each uvicorn worker builds the model from its config with parameters on the
+meta device (no memory) and assigns them tensors memory-mapped from the
+safetensors files. The mappings are backed by the page cache, so N workers
+hold one physical copy of the weights instead of N private ones, also while
+they start. Checkpoints stored in another dtype are converted once into
+SHARED_WEIGHTS_DIR (tmpfs by default) and mapped from there.
+"""
+
+import fcntl
+import glob
+import hashlib
+import json
+import logging
+import os
+import struct
+from contextlib import contextmanager
+from typing import Dict, List
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARED_WEIGHTS_DIR = "/dev/shm/shared-weights"
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def _read_header(path: str):
+    with open(path, "rb") as f:
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_len))
+    header.pop("__metadata__", None)
+    return header, 8 + header_len
+
+
+def map_safetensors(path: str) -> Dict[str, torch.Tensor]:
+    """
+    Tensors of a safetensors file as read-only views of one private file
+    mapping; untouched pages stay shared with every other process mapping it
+    """
+    header, data_start = _read_header(path)
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+    data = torch.empty(0, dtype=torch.uint8).set_(storage)
+    tensors = {}
+    for name, info in header.items():
+        start, end = info["data_offsets"]
+        tensors[name] = (
+            data[data_start + start : data_start + end]
+            .view(SAFETENSORS_DTYPES[info["dtype"]])
+            .view(info["shape"])
+        )
+    return tensors
+
+
+def _in_dtype(path: str, dtype: torch.dtype, cache_dir: str) -> str:
+    """
+    path itself if its floating point tensors are already in dtype, otherwise a
+    converted copy in cache_dir, written once by whichever worker gets there first
+    """
+    header, _ = _read_header(path)
+    if all(
+        SAFETENSORS_DTYPES[info["dtype"]] == dtype
+        for info in header.values()
+        if SAFETENSORS_DTYPES[info["dtype"]].is_floating_point
+    ):
+        return path
+
+    from safetensors.torch import load_file, save_file
+
+    digest = hashlib.sha1(os.path.realpath(path).encode("utf-8")).hexdigest()[:16]
+    target = os.path.join(cache_dir, f"{digest}-{str(dtype).split('.')[-1]}.safetensors")
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(f"{target}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.exists(target):
+            logger.info(f"Converting {path} to {dtype} for sharing at {target}")
+            tensors = {
+                name: tensor.to(dtype) if tensor.is_floating_point() else tensor
+                for name, tensor in load_file(path).items()
+            }
+            save_file(tensors, f"{target}.tmp")
+            os.replace(f"{target}.tmp", target)
+    return target
+
+
+@contextmanager
+def _parameters_on_meta():
+    """
+    modules built inside keep their parameters on the meta device, each
+    freed as soon as it is registered; buffers (e.g. rotary tables, which no
+    checkpoint holds) are built for real
+    """
+    register = torch.nn.Module.register_parameter
+
+    def register_on_meta(module, name, param):
+        register(module, name, param)
+        if param is not None:
+            module._parameters[name] = torch.nn.Parameter(param.to("meta"), requires_grad=param.requires_grad)
+
+    torch.nn.Module.register_parameter = register_on_meta
+    try:
+        yield
+    finally:
+        torch.nn.Module.register_parameter = register
+
+
+def _materialize_missing(model: torch.nn.Module) -> List[str]:
+    """
+    allocates and initializes, privately, the parameters the checkpoint did not
+    provide and that are still on the meta device; returns their names
+    """
+    names = []
+    for module_name, module in model.named_modules():
+        own = dict(module.named_parameters(recurse=False))
+        missing = [name for name, param in own.items() if param.is_meta]
+        for name in missing:
+            param = own[name]
+            setattr(module, name, torch.nn.Parameter(torch.empty(param.shape, dtype=param.dtype), requires_grad=False))
+            names.append(f"{module_name}.{name}" if module_name else name)
+        if not missing:
+            continue
+        if len(missing) == len(own) and hasattr(model, "_init_weights"):
+            # a whole new module, e.g. a classification head
+            model._init_weights(module)
+        else:
+            # initializing the module would overwrite its mapped weights
+            for name in missing:
+                getattr(module, name).data.zero_()
+    return names
+
+
+def load_shared(model_cls, model_path: str, cache_dir: str = DEFAULT_SHARED_WEIGHTS_DIR, **kwargs):
+    """
+    model_cls (e.g. AutoModel) for model_path with its weights mapped from the
+    shared safetensors files and never loaded privately; kwargs go to
+    from_config (torch_dtype, attn_implementation, ...)
+    """
+    from transformers import AutoConfig
+
+    config = AutoConfig.from_pretrained(model_path)
+    with _parameters_on_meta():
+        model = model_cls.from_config(config, **kwargs)
+    share_weights(model, model_path, cache_dir)
+    return model
+
+
+def share_weights(model: torch.nn.Module, model_path: str, cache_dir: str = DEFAULT_SHARED_WEIGHTS_DIR):
+    """
+    Replaces the parameters and buffers of a CPU model (loaded, or built on
+    the meta device by load_shared) from model_path with memory-mapped
+    tensors in the model's dtype. Weights missing from the checkpoint (e.g. a
+    freshly initialized head) stay private to the process. Returns the number
+    of bytes now shared.
+    """
+    dtype = next(model.parameters()).dtype
+    paths = sorted(glob.glob(os.path.join(model_path, "*.safetensors")))
+    if not paths:
+        raise FileNotFoundError(f"No .safetensors weights to share in {model_path}")
+
+    # checkpoint keys may or may not carry the base model prefix ("model.")
+    own_keys = set(model.state_dict())
+    prefix = f"{getattr(model, 'base_model_prefix', '')}."
+    shared = {}
+    for path in paths:
+        for name, tensor in map_safetensors(_in_dtype(path, dtype, cache_dir)).items():
+            if name in own_keys:
+                shared[name] = tensor
+            elif name.startswith(prefix) and name[len(prefix) :] in own_keys:
+                shared[name[len(prefix) :]] = tensor
+            elif prefix + name in own_keys:
+                shared[prefix + name] = tensor
+
+    model.requires_grad_(False)
+    model.load_state_dict(shared, strict=False, assign=True)
+    if hasattr(model, "tie_weights"):
+        model.tie_weights()
+    _materialize_missing(model)
+    mapped = {t.untyped_storage().data_ptr() for t in shared.values()}
+    private = sorted(
+        name
+        for name, tensor in model.state_dict().items()
+        if tensor.untyped_storage().data_ptr() not in mapped
+    )
+    shared_bytes = sum(t.numel() * t.element_size() for t in shared.values())
+    logger.info(
+        f"Sharing {len(shared)} tensors ({shared_bytes / 2**20:.0f} MiB) of {model_path} "
+        f"via mmap; {len(private)} stay private{f': {private[:5]}' if private else ''}"
+    )
+    return shared_bytes
@@ -135,17 +135,8 @@ def main():
     """Main startup logic"""
     logger.info("Starting RunPod worker...")
     
-    # Ensure we have the right transformers version for Qwen3
-    try:
-        import transformers
-        logger.info(f"Transformers version: {transformers.__version__}")
-    except ImportError:
-        logger.error("Transformers not installed!")
-    
-    # Always use container models for best performance
-    # For now, only load embedding model due to reranker compatibility issues
-    os.environ["MODEL_NAMES"] = "/models/Qwen3-Embedding-0.6B"
-    logger.info("Using embedding model from container for optimal performance")
+    # MODEL_NAMES is configured by the handler module; the transformers version
+    # is logged once the engine stack has been imported in the background.
     
     # Check if volume is mounted for HF_HOME (cache for any additional models)
     volume_mounted = ensure_volume_mounted()
@@ -168,12 +159,9 @@ def main():
     
     logger.info("Starting handler...")
     
-    # Import and run the handler
+    # Import the handler once and run it; heavy imports happen lazily inside
     import handler
-    # Execute the handler's main block
-    import sys
-    sys.argv[0] = '/handler.py'  # Set the script name
-    exec(open('/handler.py').read())
+    handler.main()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,94 @@
+"""
+Startup timing report for the RunPod worker.
+Records wall time per startup stage and, optionally, a `python -X importtime`
+breakdown of the heavy imports.
+"""
+
+import os
+import subprocess
+import sys
+import time
+import logging
+from contextlib import contextmanager
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Modules whose import cost dominates cold start
+HEAVY_MODULES = ["torch", "transformers", "infinity_emb", "embedding_service"]
+
+
+class StartupReport:
+    """Collects (stage, seconds) pairs from process start to ready."""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, time.perf_counter() - start))
+
+    def as_dict(self) -> dict:
+        return dict(
+            stages={name: round(seconds, 4) for name, seconds in self.stages},
+            total=round(time.perf_counter() - self.t0, 4),
+        )
+
+    def log(self):
+        logger.info("Startup report:")
+        for name, seconds in self.stages:
+            logger.info(f"  {name:<32} {seconds * 1000:10.1f} ms")
+        logger.info(f"  {'total':<32} {(time.perf_counter() - self.t0) * 1000:10.1f} ms")
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """Parse `-X importtime` output into (module, self_us, cumulative_us) rows."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # header line
+        rows.append((parts[2].strip(), int(parts[0]), int(parts[1])))
+    return rows
+
+
+def importtime_breakdown(modules: List[str] = HEAVY_MODULES, top_n: int = 15):
+    """
+    Import `modules` in a fresh interpreter under `-X importtime` and log the
+    top_n entries by cumulative time. Runs out of process so it never perturbs
+    the timings or module state of the serving process.
+    """
+    code = "\n".join(
+        f"try:\n    import {module}\nexcept Exception:\n    pass" for module in modules
+    )
+    try:
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            timeout=600,
+        )
+    except Exception as e:
+        logger.warning(f"Import-time breakdown failed: {e}")
+        return []
+
+    rows = parse_importtime(proc.stderr)
+    top_level = {module: cumulative for module, _, cumulative in rows if module in modules}
+    logger.info("Import-time breakdown (-X importtime, cumulative):")
+    for module in modules:
+        if module in top_level:
+            logger.info(f"  {module:<40} {top_level[module] / 1000:10.1f} ms")
+    logger.info(f"Top {top_n} imports by cumulative time:")
+    for module, self_us, cumulative_us in sorted(rows, key=lambda r: r[2], reverse=True)[:top_n]:
+        logger.info(
+            f"  {module:<40} self {self_us / 1000:8.1f} ms  cumulative {cumulative_us / 1000:8.1f} ms"
+        )
+    return rows
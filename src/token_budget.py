@@ -0,0 +1,61 @@
+"""
+Token-budget batching. Inputs are sorted by token length and cut into slices
+whose padded size (items x longest item) stays within MAX_BATCH_TOKENS, so
+short inputs form large batches and long ones small batches. Optional
+per-length-bucket item limits come from probing the engine at startup.
+"""
+
+import bisect
+from typing import Dict, List, Optional
+
+
+def padded_tokens(lengths: List[int]) -> int:
+    """token slots a padded batch of these lengths occupies"""
+    return len(lengths) * max(lengths, default=0)
+
+
+def bucket_limit(length: int, limits: Optional[Dict[int, int]]) -> Optional[int]:
+    """
+    item limit of the smallest calibrated bucket that holds length; past the
+    largest bucket its limit is scaled down by length
+    """
+    if not limits:
+        return None
+    buckets = sorted(limits)
+    index = bisect.bisect_left(buckets, length)
+    if index < len(buckets):
+        return limits[buckets[index]]
+    largest = buckets[-1]
+    return max(1, limits[largest] * largest // length)
+
+
+def budget_slices(
+    lengths: List[int],
+    max_tokens: int,
+    max_items: int,
+    limits: Optional[Dict[int, int]] = None,
+) -> List[List[int]]:
+    """
+    indices of lengths grouped longest first into slices of at most
+    max_items items (and the bucket limit of their longest item) whose padded
+    size fits max_tokens (0 means no token budget); an input longer than the
+    budget gets a slice of its own
+    """
+    order = sorted(range(len(lengths)), key=lengths.__getitem__, reverse=True)
+    slices: List[List[int]] = []
+    current: List[int] = []
+    cap = max_items
+    for index in order:
+        if not current:
+            # the first (longest) item sets the padded length of the slice
+            longest = lengths[index]
+            cap = min(max_items, bucket_limit(longest, limits) or max_items)
+            if max_tokens:
+                cap = min(cap, max(1, max_tokens // max(longest, 1)))
+        current.append(index)
+        if len(current) >= cap:
+            slices.append(current)
+            current = []
+    if current:
+        slices.append(current)
+    return slices
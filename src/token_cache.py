@@ -0,0 +1,97 @@
+"""
+LRU cache of tokenizer output (text hash -> token ids) so repeated texts are
+tokenized once and their ids go straight to the model.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def merge_stats(*stats: Optional[Dict[str, float]]) -> Dict[str, float]:
+    """sums the per-call stats of encode(); tokenize_ms and tokenize_saved_ms are always present"""
+    merged: Dict[str, float] = dict(tokenize_ms=0.0, tokenize_saved_ms=0.0)
+    for call in stats:
+        for key, value in (call or {}).items():
+            merged[key] = merged.get(key, 0) + value
+    for key in ("tokenize_ms", "tokenize_saved_ms"):
+        merged[key] = round(merged[key], 3)
+    return merged
+
+
+class TokenCache:
+    """
+    Wraps one tokenizer configuration. `encode_fn(texts) -> list of id lists`
+    is only called for cache misses; the per-token cost measured on misses is
+    used to estimate the time saved by hits.
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], List[List[int]]], max_entries: int = 65536):
+        self.encode_fn = encode_fn
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, List[int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._miss_tokens = 0
+        self._miss_seconds = 0.0
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def encode(self, texts: List[str]) -> Tuple[List[List[int]], Dict[str, float]]:
+        """token ids per text, plus hit/miss counts and estimated ms saved for this call"""
+        keys = [self._key(text) for text in texts]
+        ids: List[List[int]] = [None] * len(texts)  # type: ignore
+        missing: Dict[bytes, List[int]] = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                cached = self._entries.get(key)
+                if cached is not None:
+                    self._entries.move_to_end(key)
+                    ids[i] = cached
+                else:
+                    missing.setdefault(key, []).append(i)
+
+        hit_tokens = sum(len(i) for i in ids if i is not None)
+        spent = 0.0
+        if missing:
+            miss_texts = [texts[positions[0]] for positions in missing.values()]
+            start = time.perf_counter()
+            encoded = self.encode_fn(miss_texts)
+            spent = time.perf_counter() - start
+            with self._lock:
+                for (key, positions), token_ids in zip(missing.items(), encoded):
+                    for i in positions:
+                        ids[i] = token_ids
+                    self._entries[key] = token_ids
+                    self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                self._miss_tokens += sum(len(t) for t in encoded)
+                self._miss_seconds += spent
+
+        n_misses = len(missing)
+        with self._lock:
+            self.hits += len(texts) - n_misses
+            self.misses += n_misses
+            seconds_per_token = self._miss_seconds / self._miss_tokens if self._miss_tokens else 0.0
+        return ids, dict(
+            cache_hits=len(texts) - n_misses,
+            cache_misses=n_misses,
+            tokenize_ms=round(spent * 1000, 3),
+            tokenize_saved_ms=round(hit_tokens * seconds_per_token * 1000, 3),
+        )
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return dict(
+                entries=len(self._entries),
+                hits=self.hits,
+                misses=self.misses,
+                hit_rate=round(self.hits / total, 4) if total else 0.0,
+            )
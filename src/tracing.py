@@ -0,0 +1,248 @@
+"""
+Lightweight request tracing across the gateway, the model servers and RunPod
+jobs. Each hop continues the caller's W3C `traceparent` (and X-Request-ID),
+spans time the stages of a request, and finished spans are kept in an
+in-memory ring buffer (served by /debug/traces) and/or logged as one
+OpenTelemetry (OTLP JSON) span per line. A span costs two clock reads and a
+deque append; no OpenTelemetry SDK is needed.
+"""
+
+import json
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+TRACEPARENT_HEADER = "traceparent"
+REQUEST_ID_HEADER = "X-Request-ID"
+# buffer: ring buffer only, log: JSON log lines only
+TRACE_EXPORTS = ("buffer", "log", "both", "off")
+# never traced by TraceMiddleware, nor is anything below /debug/
+UNTRACED_PATHS = ("/health",)
+
+logger = logging.getLogger(__name__)
+
+_current: ContextVar[Optional["Span"]] = ContextVar("trace_span", default=None)
+
+
+def _new_id(n_bytes: int) -> str:
+    return os.urandom(n_bytes).hex()
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str]]:
+    """(trace id, parent span id) of a W3C traceparent, None if it is malformed"""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2]
+
+
+def _otel_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # OTLP JSON writes 64-bit integers as strings
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Span:
+    __slots__ = (
+        "trace_id", "span_id", "parent_id", "request_id", "name", "start_ns", "end_ns", "attributes", "error"
+    )
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str] = None,
+        request_id: Optional[str] = None,
+        start_ns: Optional[int] = None,
+        attributes: Optional[Dict[str, Any]] = None,
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        # the caller's X-Request-ID, or the trace id when there is none
+        self.request_id = request_id or trace_id
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes or {}
+        self.error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def child(self, name: str, start_ns: Optional[int] = None, **attributes) -> "Span":
+        return Span(name, self.trace_id, self.span_id, self.request_id, start_ns, attributes)
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def headers(self) -> Dict[str, str]:
+        """headers that continue this trace on the next hop"""
+        return {TRACEPARENT_HEADER: self.traceparent(), REQUEST_ID_HEADER: self.request_id}
+
+    def to_otel(self, service: str) -> Dict[str, Any]:
+        attributes = {"service.name": service, "request.id": self.request_id, **self.attributes}
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [{"key": key, "value": _otel_value(value)} for key, value in attributes.items()],
+            # STATUS_CODE_OK / STATUS_CODE_ERROR
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def propagation_headers() -> Dict[str, str]:
+    """headers for an outgoing call made inside the current span, empty outside one"""
+    span = _current.get()
+    return span.headers() if span is not None else {}
+
+
+class Tracer:
+    """Creates spans for one service and exports the finished ones"""
+
+    def __init__(self, service: str, export: str = "buffer", buffer_size: int = 2048):
+        if export not in TRACE_EXPORTS:
+            raise ValueError(f"Invalid trace export '{export}', expected one of {list(TRACE_EXPORTS)}")
+        self.service = service
+        self.enabled = export != "off"
+        self.log_spans = export in ("log", "both")
+        self.buffer: Optional[deque] = deque(maxlen=buffer_size) if export in ("buffer", "both") else None
+
+    def start(
+        self,
+        name: str,
+        traceparent: Optional[str] = None,
+        request_id: Optional[str] = None,
+        parent: Optional[Span] = None,
+        **attributes,
+    ) -> Span:
+        """
+        a span under parent, else under the current span, else continuing
+        traceparent, else a new trace
+        """
+        parent = parent or _current.get()
+        if parent is not None:
+            return parent.child(name, **attributes)
+        remote = parse_traceparent(traceparent)
+        if remote is not None:
+            return Span(name, remote[0], remote[1], request_id, attributes=attributes)
+        return Span(name, _new_id(16), None, request_id, attributes=attributes)
+
+    def finish(self, span: Span, end_ns: Optional[int] = None):
+        span.end_ns = end_ns or time.time_ns()
+        if self.buffer is not None:
+            self.buffer.append(span)
+        if self.log_spans:
+            logger.info(json.dumps(span.to_otel(self.service), separators=(",", ":")))
+
+    @contextmanager
+    def span(
+        self,
+        name: str,
+        traceparent: Optional[str] = None,
+        request_id: Optional[str] = None,
+        **attributes,
+    ):
+        """times the block as a span that is current inside it"""
+        if not self.enabled:
+            yield None
+            return
+        span = self.start(name, traceparent, request_id, **attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            self.finish(span)
+
+    def record(self, name: str, parent: Optional[Span], start_ns: int, end_ns: int, **attributes):
+        """a span measured elsewhere (e.g. on the inference thread) under parent"""
+        if self.enabled and parent is not None:
+            self.finish(parent.child(name, start_ns, **attributes), end_ns)
+
+    def spans(
+        self, trace_id: Optional[str] = None, request_id: Optional[str] = None, limit: int = 200
+    ) -> List[Dict[str, Any]]:
+        """most recent buffered spans first, optionally of one trace or request"""
+        if self.buffer is None:
+            return []
+        found = []
+        for span in reversed(self.buffer):
+            if trace_id and span.trace_id != trace_id:
+                continue
+            if request_id and span.request_id != request_id:
+                continue
+            found.append(span.to_otel(self.service))
+            if len(found) >= limit:
+                break
+        return found
+
+
+class TraceMiddleware:
+    """
+    ASGI middleware: one server span per HTTP request, continuing the
+    caller's traceparent; the response carries the traceparent and
+    X-Request-ID of that span
+    """
+
+    def __init__(self, app, tracer: Tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.tracer.enabled or scope["path"] in UNTRACED_PATHS or scope["path"].startswith("/debug/"):
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        traceparent = headers.get(TRACEPARENT_HEADER.encode(), b"").decode("latin-1")
+        request_id = headers.get(REQUEST_ID_HEADER.lower().encode(), b"").decode("latin-1")
+        with self.tracer.span(f"{scope['method']} {scope['path']}", traceparent, request_id or None) as span:
+
+            async def send_traced(message):
+                if message["type"] == "http.response.start":
+                    span.set(**{"http.status_code": message["status"]})
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (key.lower().encode(), value.encode("latin-1")) for key, value in span.headers().items()
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_traced)
+
+
+def install(app, tracer: Tracer):
+    """adds TraceMiddleware and the GET /debug/traces route to a FastAPI app"""
+    app.add_middleware(TraceMiddleware, tracer=tracer)
+
+    @app.get("/debug/traces")
+    async def debug_traces(trace_id: Optional[str] = None, request_id: Optional[str] = None, limit: int = 200):
+        return {"service": tracer.service, "spans": tracer.spans(trace_id, request_id, limit)}
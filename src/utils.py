@@ -1,29 +1,18 @@
 from http import HTTPStatus
-from typing import Annotated, Any, Dict, List, Literal, Optional, Union
-from typing import Any, Dict, Iterable, List, Optional, Union
-from uuid import uuid4
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+import base64
 import time
 import numpy as np
 import numpy.typing as npt
-from pydantic import BaseModel, Field, conlist
+from serialization import float_rows
 
-EmbeddingReturnType = npt.NDArray[Union[np.float32, np.float32]]
-try:
-    from pydantic import StringConstraints
-
-    INPUT_STRING = StringConstraints(max_length=8192 * 15, strip_whitespace=True)
-    ITEMS_LIMIT = {
-        "min_length": 1,
-        "max_length": 8192,
-    }
-except ImportError:
-    from pydantic import constr
-
-    INPUT_STRING = constr(max_length=8192 * 15, strip_whitespace=True)  # type: ignore
-    ITEMS_LIMIT = {
-        "min_items": 1,
-        "max_items": 8192,
-    }
+EmbeddingReturnType = npt.NDArray[Union[np.float16, np.float32]]
+# "float": JSON numbers, "base64": little-endian float32 bytes (OpenAI),
+# "float16": little-endian float16 bytes, half the size of base64
+ENCODING_FORMATS = ("float", "base64", "float16")
+# responses are plain dicts handed straight to RunPod; inputs are checked
+# up front by validation.validate_job_input
+MODEL_CREATED = int(time.time())
 
 
 async def process_embedding_request(job_input, engines):
@@ -31,7 +20,7 @@ async def process_embedding_request(job_input, engines):
     model_name = openai_input.get("model")
     engine = engines.get(model_name)
     if not engine:
-        return create_error_response(f"Model '{model_name}' not found").model_dump()
+        return create_error_response(f"Model '{model_name}' not found")
 
     embedding_input = openai_input.get("input")
     if isinstance(embedding_input, str):
@@ -39,10 +28,9 @@ async def process_embedding_request(job_input, engines):
     try:
         async with engine:
             embeddings, usage = await engine.embed(embedding_input)
-        result = list_embeddings_to_response(embeddings, model_name, usage)
-        return OpenAIEmbeddingResult(**result).model_dump()
+        return list_embeddings_to_response(embeddings, model_name, usage)
     except Exception as e:
-        return create_error_response(str(e)).model_dump()
+        return create_error_response(str(e))
 
 
 def process_model_info_request(job_input, engines):
@@ -50,93 +38,106 @@ def process_model_info_request(job_input, engines):
     model_name = openai_input.get("model")
     engine_args = engines.get(model_name)
     if not engine_args:
-        return create_error_response(f"Model '{model_name}' not found").model_dump()
-    return OpenAIModelInfo(
-        data=ModelInfo(
-            id=engine_args.model_name_or_path,
-            stats=dict(batch_size=engine_args.batch_size),
-            backend=engine_args.engine,
-        )
-    ).model_dump()
-
-
-class ErrorResponse(BaseModel):
-    object: str = "error"
-    message: str
-    type: str
-    param: Optional[str] = None
-    code: int
+        return create_error_response(f"Model '{model_name}' not found")
+    return model_list(
+        [
+            model_info(
+                engine_args.model_name_or_path,
+                stats=dict(batch_size=engine_args.batch_size),
+                backend=engine_args.engine,
+            )
+        ]
+    )
 
 
 def create_error_response(
     message: str,
     err_type: str = "BadRequestError",
     status_code: HTTPStatus = HTTPStatus.BAD_REQUEST,
-) -> ErrorResponse:
-    return ErrorResponse(message=message, type=err_type, code=status_code.value)
-
-
-class OpenAIEmbeddingInput(BaseModel):
-    input: Union[  # type: ignore
-        conlist(  # type: ignore
-            Annotated[str, INPUT_STRING],
-            **ITEMS_LIMIT,
-        ),
-        Annotated[str, INPUT_STRING],
-    ]
-    model: Optional[str] = None
-    user: Optional[str] = None
-
-
-class _EmbeddingObject(BaseModel):
-    object: Literal["embedding"] = "embedding"
-    embedding: List[float]
-    index: int
+) -> Dict[str, Any]:
+    return dict(
+        object="error", message=message, type=err_type, param=None, code=status_code.value
+    )
 
 
-class _Usage(BaseModel):
-    prompt_tokens: int
-    total_tokens: int
+def model_info(model_id: str, stats: Dict[str, Any], backend: str = "") -> Dict[str, Any]:
+    return dict(
+        id=model_id,
+        stats=stats,
+        object="model",
+        owned_by="infinity",
+        created=MODEL_CREATED,
+        backend=backend,
+    )
 
 
-class ModelInfo(BaseModel):
-    id: str
-    stats: Dict[str, Any]
-    object: Literal["model"] = "model"
-    owned_by: Literal["infinity"] = "infinity"
-    created: int = int(time.time())  # no default factory
-    backend: str = ""
+def model_list(models: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return dict(data=models, object="list")
 
 
-class OpenAIModelInfo(BaseModel):
-    data: List[ModelInfo] = Field(default_factory=list)
-    object: str = "list"
+def dedupe(items: List[str]) -> Tuple[List[str], List[int]]:
+    """
+    Returns the unique items in first-seen order and, for every original
+    position, the index of its unique item, so `[unique[i] for i in inverse]`
+    restores the input.
+    """
+    positions: Dict[str, int] = {}
+    inverse = [positions.setdefault(item, len(positions)) for item in items]
+    return list(positions), inverse
 
 
-class OpenAIEmbeddingResult(BaseModel):
-    object: str = "list"
-    data: List[_EmbeddingObject]
-    model: str
-    usage: _Usage
+def _usage(usage: int, total_inputs: Optional[int], unique_inputs: Optional[int]):
+    out = dict(prompt_tokens=usage, total_tokens=usage)
+    if total_inputs:
+        out.update(
+            unique_inputs=unique_inputs,
+            dedup_ratio=round(1 - unique_inputs / total_inputs, 4),
+        )
+    return out
+
+
+def encode_embedding(emb: EmbeddingReturnType, encoding_format: str = "float"):
+    """
+    Encodes one vector for the response. Vectors stay in their compute dtype
+    until here, so float16 output from an fp16 engine is never upcast.
+    """
+    if encoding_format == "float":
+        return emb.tolist()
+    if encoding_format == "base64":
+        return base64.b64encode(np.asarray(emb, dtype="<f4").tobytes()).decode("ascii")
+    if encoding_format == "float16":
+        return base64.b64encode(np.asarray(emb, dtype="<f2").tobytes()).decode("ascii")
+    raise ValueError(
+        f"Invalid encoding_format '{encoding_format}', expected one of {list(ENCODING_FORMATS)}"
+    )
 
 
 def list_embeddings_to_response(
     embeddings: Union[EmbeddingReturnType, Iterable[EmbeddingReturnType]],
     model: str,
     usage: int,
+    total_inputs: Optional[int] = None,
+    unique_inputs: Optional[int] = None,
+    chunks: Optional[List[int]] = None,
+    encoding_format: str = "float",
 ) -> Dict[str, Any]:
+    if encoding_format == "float" and len(embeddings):
+        # the whole matrix in one conversion instead of one tolist() per row
+        encoded = float_rows(embeddings)
+    else:
+        encoded = [encode_embedding(emb, encoding_format) for emb in embeddings]
+    data = [
+        dict(object="embedding", embedding=emb, index=count)
+        for count, emb in enumerate(encoded)
+    ]
+    if chunks is not None:
+        for item, n_chunks in zip(data, chunks):
+            item["chunks"] = n_chunks
     return dict(
         model=model,
         object="list",
-        data=[
-            dict(
-                object="embedding",
-                embedding=emb.tolist(),
-                index=count,
-            )
-            for count, emb in enumerate(embeddings)
-        ],
-        usage=dict(prompt_tokens=usage, total_tokens=usage),
+        data=data,
+        usage=_usage(usage, total_inputs, unique_inputs),
     )
 
 
@@ -145,6 +146,8 @@ def to_rerank_response(
     model=str,
     usage=int,
     documents: Optional[List[str]] = None,
+    total_inputs: Optional[int] = None,
+    unique_inputs: Optional[int] = None,
 ) -> Dict[str, Any]:
     if documents is None:
         return dict(
@@ -153,7 +156,7 @@ def to_rerank_response(
                 dict(relevance_score=score, index=count)
                 for count, score in enumerate(scores)
             ],
-            usage=dict(prompt_tokens=usage, total_tokens=usage),
+            usage=_usage(usage, total_inputs, unique_inputs),
         )
     else:
         return dict(
@@ -162,5 +165,5 @@ def to_rerank_response(
                 dict(relevance_score=score, index=count, document=doc)
                 for count, (score, doc) in enumerate(zip(scores, documents))
             ],
-            usage=dict(prompt_tokens=usage, total_tokens=usage),
+            usage=_usage(usage, total_inputs, unique_inputs),
         )
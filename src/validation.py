@@ -0,0 +1,186 @@
+"""
+One pass over the raw RunPod job dict that rejects malformed payloads before
+they reach an engine: field types, item counts and string lengths. Lists of
+texts are checked with map/max at C speed instead of validating every string
+as a model field.
+
+    python validation.py    # per-request overhead at 1, 100 and 8192 items
+"""
+
+from typing import Any, Dict, Optional, Tuple
+
+from chunking import POOLING_METHODS
+from priority_scheduler import PRIORITY_CLASSES
+from utils import ENCODING_FORMATS
+
+# same limits the OpenAI embedding input model used to declare
+MAX_INPUT_ITEMS = 8192
+MAX_INPUT_LENGTH = 8192 * 15
+
+_NUMBER = (int, float)
+
+# actions of an "admin" job
+ADMIN_ACTIONS = ("status", "drain", "reload")
+
+
+class ValidationError(ValueError):
+    """the job payload is malformed; the message names the offending field"""
+
+
+def _check_texts(name: str, value: Any, allow_str: bool = True):
+    if isinstance(value, str):
+        if not allow_str:
+            raise ValidationError(f"{name} must be a list of strings")
+        if len(value) > MAX_INPUT_LENGTH:
+            raise ValidationError(f"{name} is longer than {MAX_INPUT_LENGTH} characters")
+        return
+    if not isinstance(value, list):
+        raise ValidationError(f"{name} must be a {'string or ' if allow_str else ''}list of strings")
+    if not 1 <= len(value) <= MAX_INPUT_ITEMS:
+        raise ValidationError(f"{name} must have between 1 and {MAX_INPUT_ITEMS} items, got {len(value)}")
+    if set(map(type, value)) != {str}:
+        index = next(i for i, item in enumerate(value) if not isinstance(item, str))
+        raise ValidationError(f"{name}[{index}] must be a string")
+    if max(map(len, value)) > MAX_INPUT_LENGTH:
+        index = next(i for i, item in enumerate(value) if len(item) > MAX_INPUT_LENGTH)
+        raise ValidationError(f"{name}[{index}] is longer than {MAX_INPUT_LENGTH} characters")
+
+
+def _check_type(payload: Dict[str, Any], name: str, types: Tuple[type, ...], required: bool = False):
+    value = payload.get(name)
+    if value is None:
+        if required:
+            raise ValidationError(f"Missing required field: {name}")
+        return
+    # bool is an int subclass but never a valid number here
+    if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+        expected = " or ".join(t.__name__ for t in types)
+        raise ValidationError(f"{name} must be of type {expected}")
+
+
+def _check_choice(payload: Dict[str, Any], name: str, choices):
+    value = payload.get(name)
+    if value is not None and value not in choices:
+        raise ValidationError(f"Invalid {name} '{value}', expected one of {list(choices)}")
+
+
+def _check_embedding_options(payload: Dict[str, Any]):
+    _check_type(payload, "instruction", (str,))
+    _check_type(payload, "prompt_type", (str,))
+    _check_choice(payload, "priority", PRIORITY_CLASSES)
+    _check_choice(payload, "chunk_pooling", POOLING_METHODS)
+    _check_type(payload, "chunk_window", (int,))
+    _check_type(payload, "chunk_overlap", (int,))
+    if payload.get("chunk_window") is not None and payload["chunk_window"] < 1:
+        raise ValidationError("chunk_window must be positive")
+    if payload.get("chunk_overlap") is not None and payload["chunk_overlap"] < 0:
+        raise ValidationError("chunk_overlap must not be negative")
+
+
+def _check_deadline(payload: Dict[str, Any]):
+    _check_type(payload, "deadline", _NUMBER)
+    _check_type(payload, "timeout_ms", _NUMBER)
+
+
+def validate_openai_input(route: Any, openai_input: Any):
+    if not isinstance(route, str):
+        raise ValidationError("openai_route must be a string")
+    if openai_input is not None and not isinstance(openai_input, dict):
+        # the handler reads the deadline from it whatever the route
+        raise ValidationError("openai_input must be an object")
+    _check_deadline(openai_input or {})
+    if route != "/v1/embeddings":
+        # /v1/models takes no input, unknown routes are rejected by the handler
+        return
+    if not isinstance(openai_input, dict) or not openai_input:
+        raise ValidationError("Missing input")
+    _check_type(openai_input, "model", (str,), required=True)
+    if openai_input.get("input") is None:
+        raise ValidationError("Missing required field: input")
+    _check_texts("input", openai_input["input"])
+    _check_choice(openai_input, "encoding_format", ENCODING_FORMATS)
+    _check_choice(openai_input, "priority", PRIORITY_CLASSES)
+    _check_type(openai_input, "extra_body", (dict,))
+    _check_embedding_options(openai_input.get("extra_body") or {})
+
+
+def validate_job_input(job_input: Any):
+    """raises ValidationError for the first problem found in a job's input"""
+    if not isinstance(job_input, dict):
+        raise ValidationError("input must be an object")
+    _check_type(job_input, "traceparent", (str,))
+    _check_type(job_input, "request_id", (str,))
+    _check_type(job_input, "profile", (bool,))
+    # the handler takes the earliest deadline of the job and its openai_input
+    _check_deadline(job_input)
+    if job_input.get("openai_route"):
+        validate_openai_input(job_input["openai_route"], job_input.get("openai_input"))
+        return
+    if job_input.get("admin"):
+        admin = job_input["admin"]
+        if not isinstance(admin, dict):
+            raise ValidationError("admin must be an object")
+        _check_type(admin, "action", (str,), required=True)
+        _check_choice(admin, "action", ADMIN_ACTIONS)
+        _check_type(admin, "model", (str,), required=admin["action"] == "reload")
+        _check_type(admin, "model_path", (str,))
+        _check_type(admin, "drain", (bool,))
+        _check_type(admin, "timeout", _NUMBER)
+        return
+    if job_input.get("bulk_embed"):
+        bulk = job_input["bulk_embed"]
+        if not isinstance(bulk, dict):
+            raise ValidationError("bulk_embed must be an object")
+        for name in ("input_path", "output_dir", "model"):
+            _check_type(bulk, name, (str,), required=True)
+        for name in ("batch_size", "max_inflight"):
+            _check_type(bulk, name, (int,))
+        return
+    if job_input.get("query"):
+        _check_type(job_input, "query", (str,))
+        _check_texts("query", job_input["query"])
+        if job_input.get("docs") is None:
+            raise ValidationError("Missing required field: docs")
+        _check_texts("docs", job_input["docs"], allow_str=False)
+        _check_type(job_input, "model", (str,), required=True)
+        _check_type(job_input, "return_docs", (bool,))
+        _check_choice(job_input, "priority", PRIORITY_CLASSES)
+        return
+    if job_input.get("input"):
+        _check_texts("input", job_input["input"])
+        _check_type(job_input, "model", (str,), required=True)
+        _check_choice(job_input, "encoding_format", ENCODING_FORMATS)
+        _check_embedding_options(job_input)
+        return
+    raise ValidationError("Invalid input: expected openai_route, admin, bulk_embed, query or input")
+
+
+def _benchmark(sizes=(1, 100, 8192), dim: int = 1024, repeat: Optional[int] = None):
+    """per-request validation and response building time"""
+    import time
+
+    import numpy as np
+
+    from utils import list_embeddings_to_response
+
+    for size in sizes:
+        job = {
+            "openai_route": "/v1/embeddings",
+            "openai_input": {"model": "m", "input": ["lorem ipsum dolor sit amet " * 8] * size},
+        }
+        vectors = np.random.rand(size, dim).astype(np.float32)
+        runs = repeat or max(3, 20000 // size)
+        start = time.perf_counter()
+        for _ in range(runs):
+            validate_job_input(job)
+        validate_us = (time.perf_counter() - start) / runs * 1e6
+        runs = max(3, runs // 10)
+        start = time.perf_counter()
+        for _ in range(runs):
+            list_embeddings_to_response(vectors, "m", size * 10)
+        respond_us = (time.perf_counter() - start) / runs * 1e6
+        print(f"{size:>5} items: validate {validate_us:10.1f} us  build response {respond_us:12.1f} us")
+
+
+if __name__ == "__main__":
+    _benchmark()
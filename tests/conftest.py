@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the worker runs from src/ with its modules importable by bare name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
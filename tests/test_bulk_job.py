@@ -0,0 +1,79 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from bulk_job import read_batches, run_bulk_job
+
+
+def _read(path, input_format):
+    return list(read_batches(str(path), input_format, "text", "id", batch_size=2))
+
+
+def test_jsonl_row_without_text_names_row_and_id(tmp_path):
+    path = tmp_path / "corpus.jsonl"
+    path.write_text("\n".join(json.dumps(r) for r in [{"id": "a", "text": "x"}, {"id": "b", "text": None}]))
+    with pytest.raises(ValueError, match=r"Row 1 \(id 'b'\)"):
+        _read(path, "jsonl")
+
+
+@pytest.mark.parametrize("line", ["[1, 2]", "7", '"text"'])
+def test_jsonl_row_that_is_not_an_object_names_row(tmp_path, line):
+    path = tmp_path / "corpus.jsonl"
+    path.write_text(json.dumps({"id": "a", "text": "x"}) + "\n" + line)
+    with pytest.raises(ValueError, match="Row 1 of .* not an object"):
+        _read(path, "jsonl")
+
+
+def test_jsonl_row_that_is_not_json_names_row(tmp_path):
+    path = tmp_path / "corpus.jsonl"
+    path.write_text(json.dumps({"id": "a", "text": "x"}) + "\n{oops")
+    with pytest.raises(ValueError, match="Row 1 of .* not valid JSON"):
+        _read(path, "jsonl")
+
+
+class CountingService:
+    """embeds slowly and records how many batches were in flight at once"""
+
+    def __init__(self, root):
+        self.config = SimpleNamespace(bulk_job_root=str(root), bulk_job_batch_size=2, bulk_job_inflight=2)
+        self.inflight = 0
+        self.peak = 0
+
+    def get_router(self, model):
+        return None
+
+    async def embed_array(self, texts, model, instruction, prompt_type):
+        self.inflight += 1
+        self.peak = max(self.peak, self.inflight)
+        await asyncio.sleep(0.01)
+        self.inflight -= 1
+        return np.ones((len(texts), 3), dtype=np.float32), len(texts)
+
+
+def test_max_inflight_bounds_batches_ahead_of_the_writer(tmp_path):
+    path = tmp_path / "corpus.jsonl"
+    path.write_text("\n".join(json.dumps({"id": i, "text": f"t{i}"}) for i in range(20)))
+    service = CountingService(tmp_path)
+    summary = asyncio.run(run_bulk_job(service, str(path), str(tmp_path / "out"), "m", batch_size=2, max_inflight=2))
+    assert summary["embedded_rows"] == 20
+    assert service.peak == 2
+
+
+def test_parquet_row_without_text_names_row_and_id(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = tmp_path / "corpus.parquet"
+    pq.write_table(pa.table({"id": ["a", "b", "c"], "text": ["x", "y", None]}), path)
+    with pytest.raises(ValueError, match=r"Row 2 \(id 'c'\)"):
+        _read(path, "parquet")
+
+
+def test_parquet_without_pyarrow_is_rejected_clearly(tmp_path, monkeypatch):
+    import sys
+
+    monkeypatch.setitem(sys.modules, "pyarrow.parquet", None)
+    with pytest.raises(ValueError, match="needs pyarrow"):
+        _read(tmp_path / "corpus.parquet", "parquet")
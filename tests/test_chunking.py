@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from chunking import chunk_token_ids, pool_windows, split_windows
+
+
+def test_split_windows_overlap_and_cover_the_input():
+    assert split_windows(list(range(10)), window=4, overlap=1) == [[0, 1, 2, 3], [3, 4, 5, 6], [6, 7, 8, 9]]
+    assert split_windows([1, 2], window=4, overlap=1) == [[1, 2]]
+    with pytest.raises(ValueError, match="overlap"):
+        split_windows([1, 2], window=2, overlap=2)
+
+
+def test_chunk_token_ids_records_owner_and_count_per_input():
+    windows, owners, counts = chunk_token_ids([list(range(6)), [9]], window=4, overlap=0)
+    assert windows == [[0, 1, 2, 3], [4, 5], [9]]
+    assert owners == [0, 0, 1]
+    assert counts == [2, 1]
+
+
+def test_pool_windows_normalizes_per_input():
+    vectors = np.array([[1, 0], [0, 1], [3, 4]], dtype=np.float32)
+    pooled = pool_windows(vectors, [0, 0, 1], 2)
+    np.testing.assert_allclose(pooled, [[2**-0.5, 2**-0.5], [0.6, 0.8]], rtol=1e-6)
+
+
+def test_weighted_pooling_favours_longer_windows_and_keeps_half_precision():
+    vectors = np.array([[1, 0], [0, 1]], dtype=np.float16)
+    pooled = pool_windows(vectors, [0, 0], 1, method="weighted", weights=[3, 1])
+    assert pooled.dtype == np.float16
+    assert pooled[0, 0] > pooled[0, 1]
+    with pytest.raises(ValueError, match="Invalid chunk pooling"):
+        pool_windows(vectors, [0, 0], 1, method="max")
@@ -0,0 +1,25 @@
+import time
+
+import pytest
+
+from deadlines import DeadlineExceeded, check_deadline, earliest, expired, resolve_deadline
+
+
+def test_resolve_deadline_takes_the_earlier_of_deadline_and_timeout():
+    now = time.time()
+    assert resolve_deadline() is None
+    assert resolve_deadline(deadline=now + 100) == now + 100
+    assert resolve_deadline(deadline=now + 100, timeout_ms=1000) == pytest.approx(now + 1, abs=0.5)
+    assert resolve_deadline(deadline=now + 1, timeout_ms=100_000) == now + 1
+
+
+def test_earliest_ignores_unset_deadlines():
+    assert earliest(None, None) is None
+    assert earliest(None, 5.0, 3.0) == 3.0
+
+
+def test_expired_deadlines_raise():
+    assert not expired(None)
+    check_deadline(time.time() + 60)
+    with pytest.raises(DeadlineExceeded):
+        check_deadline(time.time() - 1)
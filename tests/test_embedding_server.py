@@ -0,0 +1,17 @@
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("httpx")
+embedding_server = pytest.importorskip("embedding_server")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+def test_text_without_spans_is_rejected(monkeypatch):
+    # the route checks the spans before any inference runs
+    monkeypatch.setattr(embedding_server, "model", object())
+    client = TestClient(embedding_server.app)
+    response = client.post("/embed_spans", json={"texts": ["a b", "c d"], "spans": [[[0, 1]], []]})
+    assert response.status_code == 422
+    assert response.json()["detail"] == "Text 1 has no spans"
@@ -0,0 +1,142 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+pytest.importorskip("dotenv")
+embedding_service = pytest.importorskip("embedding_service")
+
+
+class FakeEngine:
+    """stands in for AsyncEmbeddingEngine; tracks which engines are running"""
+
+    running = set()
+    capabilities = {"embed"}
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+
+    # items per batch that fit on a device, by device id
+    capacity = {}
+
+    @classmethod
+    def from_args(cls, engine_args):
+        engine = cls(engine_args["model_name_or_path"])
+        engine.device_id = engine_args.get("device_id")
+        return engine
+
+    async def astart(self):
+        # yield so overlapping reloads interleave
+        await asyncio.sleep(0.01)
+        FakeEngine.running.add(self)
+
+    async def astop(self):
+        await asyncio.sleep(0.01)
+        FakeEngine.running.discard(self)
+
+    async def embed(self, texts):
+        if len(texts) > FakeEngine.capacity.get(self.device_id, len(texts)):
+            raise MemoryError("batch does not fit")
+        FakeEngine.embedded.extend(texts)
+        return [np.ones(4, dtype=np.float32) for _ in texts], len(texts)
+
+
+class WordTokenizer:
+    """one token per whitespace-separated word"""
+
+    def __init__(self):
+        self.vocab = {}
+
+    def __call__(self, texts, add_special_tokens=False):
+        return {"input_ids": [[self.vocab.setdefault(w, len(self.vocab)) for w in t.split()] for t in texts]}
+
+    def batch_decode(self, windows):
+        words = {i: w for w, i in self.vocab.items()}
+        return [" ".join(words[i] for i in window) for window in windows]
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setenv("MODEL_NAMES", "m1")
+    monkeypatch.setenv("REPLICAS", "2")
+    monkeypatch.setattr(embedding_service, "AsyncEmbeddingEngine", FakeEngine)
+    monkeypatch.setattr(embedding_service, "EngineArgs", dict)
+    FakeEngine.running = set()
+    FakeEngine.embedded = []
+    FakeEngine.capacity = {}
+    return embedding_service.EmbeddingService()
+
+
+def test_overlapping_reloads_leave_only_the_final_engines(service):
+    async def run():
+        await service.start()
+        await asyncio.gather(
+            service.reload_model("m1", "/a", timeout=1),
+            service.reload_model("m1", "/b", timeout=1),
+        )
+
+    asyncio.run(run())
+    final = service.routers["m1"]
+    assert FakeEngine.running == set(final)
+    assert len(FakeEngine.running) == 2
+    assert {engine.model_path for engine in FakeEngine.running} == {service.model_paths["m1"]}
+
+
+def test_onnx_reload_starts_from_the_source_model(monkeypatch):
+    import onnx_export
+
+    exported = []
+
+    def ensure_onnx_models(model_paths, **kwargs):
+        exported.extend(model_paths)
+        return [f"{path}-onnx" for path in model_paths]
+
+    monkeypatch.setenv("MODEL_NAMES", "m1")
+    monkeypatch.setenv("BACKEND", "optimum")
+    monkeypatch.setattr(onnx_export, "ensure_onnx_models", ensure_onnx_models)
+    monkeypatch.setattr(embedding_service, "AsyncEmbeddingEngine", FakeEngine)
+    monkeypatch.setattr(embedding_service, "EngineArgs", dict)
+    FakeEngine.running = set()
+    service = embedding_service.EmbeddingService()
+
+    async def run():
+        await service.start()
+        await service.reload_model("m1", timeout=1)
+        await service.reload_model("m1", timeout=1)
+
+    asyncio.run(run())
+    assert exported == ["m1", "m1", "m1"]
+    assert service.model_paths["m1"] == "m1"
+    assert service.engine_paths["m1"] == "m1-onnx"
+    assert {engine.model_path for engine in FakeEngine.running} == {"m1-onnx"}
+
+
+def test_chunk_windows_leave_room_for_the_instruction_prefix(service):
+    service._tokenizers["m1"] = WordTokenizer()
+    text = " ".join(f"w{i}" for i in range(50))
+    response = asyncio.run(
+        service.route_openai_get_embeddings(
+            text, "m1", prompt_type="query", chunk_pooling="mean", chunk_window=20, chunk_overlap=2
+        )
+    )
+    assert response["data"][0]["chunks"] > 1
+    assert all(text.startswith("Instruct: ") for text in FakeEngine.embedded)
+    # prefix and window together fit the window size
+    assert max(len(text.split()) for text in FakeEngine.embedded) == 20
+    assert "tokenize_saved_ms" in response["usage"]
+
+
+def test_calibration_keeps_the_batches_that_fit_on_every_device(monkeypatch):
+    monkeypatch.setenv("MODEL_NAMES", "m1")
+    monkeypatch.setenv("REPLICAS", "2")
+    monkeypatch.setenv("DEVICES", "cuda:0,cuda:1")
+    monkeypatch.setenv("WARMUP_LENGTHS", "16,128")
+    monkeypatch.setattr(embedding_service, "AsyncEmbeddingEngine", FakeEngine)
+    monkeypatch.setattr(embedding_service, "EngineArgs", dict)
+    FakeEngine.running = set()
+    # the second device has room for far fewer items than the first
+    FakeEngine.capacity = {"0": 32, "1": 5}
+    service = embedding_service.EmbeddingService()
+
+    limits = asyncio.run(service.calibrate_batches())
+    assert limits == {"m1": {16: 4, 128: 4}}
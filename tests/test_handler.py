@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("runpod")
+pytest.importorskip("dotenv")
+handler = pytest.importorskip("handler")
+
+
+class FakeService:
+    class config:
+        drain_timeout = 1.0
+        model_reload_root = "/runpod-volume"
+
+    def __init__(self):
+        self.stopped = False
+
+    async def stop(self, timeout=None):
+        self.stopped = True
+
+
+@pytest.fixture(autouse=True)
+def reset_drain_state(monkeypatch):
+    monkeypatch.setattr(handler, "_draining", False)
+    monkeypatch.setattr(handler, "_inflight_jobs", 0)
+
+
+def test_idle_drain_stops_the_engines_and_refreshes_the_worker():
+    service = FakeService()
+    result = asyncio.run(handler.admin_job(service, "drain"))
+    assert result["idle"] and result["refresh_worker"]
+    assert service.stopped
+
+
+def test_drain_that_times_out_takes_jobs_again(monkeypatch):
+    monkeypatch.setattr(handler, "_inflight_jobs", 1)
+    service = FakeService()
+    result = asyncio.run(handler.admin_job(service, "drain", timeout=0.1))
+    assert not result["idle"] and "refresh_worker" not in result
+    assert not service.stopped
+    assert handler._draining is False
+
+
+def test_job_deadline_is_the_earliest_of_the_job_and_its_openai_input():
+    job = {"openai_route": "/v1/embeddings", "deadline": 100.0, "openai_input": {"deadline": 200.0}}
+    assert handler.job_deadline(job) == 100.0
+    job["openai_input"]["deadline"] = 50.0
+    assert handler.job_deadline(job) == 50.0
+    assert handler.job_deadline({"openai_route": "/v1/models"}) is None
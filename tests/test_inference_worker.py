@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+import pytest
+
+from deadlines import DeadlineExceeded
+from inference_worker import InferenceWorker, QueueFullError, RequestTooLargeError
+
+
+def _worker(**kwargs):
+    return InferenceWorker(lambda items: [item * 2 for item in items], **kwargs)
+
+
+def test_requests_are_batched_and_split_back():
+    async def run():
+        worker = _worker(max_batch_items=4)
+        await worker.start()
+        try:
+            return await asyncio.gather(worker.submit([1, 2]), worker.submit([3]))
+        finally:
+            await worker.stop()
+
+    assert asyncio.run(run()) == [[2, 4], [6]]
+
+
+def test_full_queue_is_backpressure_but_an_oversized_request_is_not():
+    async def run():
+        worker = _worker(max_queue_items=4)
+        await worker.start()
+        try:
+            with pytest.raises(RequestTooLargeError):
+                await worker.submit(list(range(5)))
+            first = asyncio.ensure_future(worker.submit([1, 2, 3]))
+            await asyncio.sleep(0)
+            with pytest.raises(QueueFullError):
+                await worker.submit([4, 5])
+            assert await first == [2, 4, 6]
+            # room again once the queued work ran
+            assert await worker.submit([4, 5]) == [8, 10]
+        finally:
+            await worker.stop()
+
+    asyncio.run(run())
+
+
+def test_work_past_its_deadline_is_dropped_before_it_runs():
+    async def run():
+        worker = _worker()
+        await worker.start()
+        try:
+            with pytest.raises(DeadlineExceeded):
+                await worker.submit([1], deadline=time.time() - 1)
+            return worker.stats()
+        finally:
+            await worker.stop()
+
+    stats = asyncio.run(run())
+    assert (stats["dropped_requests"], stats["dropped_items"], stats["pending_items"]) == (1, 1, 0)
@@ -0,0 +1,55 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from packing import PaddingStats, block_causal_mask, last_token_states, mean_pool, pack_groups, pack_inputs
+
+
+def test_pack_groups_caps_tokens_and_isolates_long_sequences():
+    assert pack_groups([3, 4, 2, 10, 1], max_tokens=8) == [[0, 1], [2], [3], [4]]
+
+
+def test_block_causal_mask_is_causal_within_and_blocked_across_sequences():
+    mask = block_causal_mask([2, 3], torch.float32, "cpu")[0, 0]
+    allowed = mask == 0
+    expected = torch.tensor(
+        [
+            [1, 0, 0, 0, 0],
+            [1, 1, 0, 0, 0],
+            [0, 0, 1, 0, 0],
+            [0, 0, 1, 1, 0],
+            [0, 0, 1, 1, 1],
+        ],
+        dtype=torch.bool,
+    )
+    assert torch.equal(allowed, expected)
+    assert mask[0, 1] == torch.finfo(torch.float32).min
+
+
+def test_pack_inputs_restarts_positions_per_sequence():
+    inputs = pack_inputs([[5, 6], [7, 8, 9]], "varlen", "cpu", torch.float32)
+    assert inputs["input_ids"].tolist() == [[5, 6, 7, 8, 9]]
+    assert inputs["position_ids"].tolist() == [[0, 1, 0, 1, 2]]
+    assert "attention_mask" not in inputs
+    assert pack_inputs([[5], [6]], "mask", "cpu", torch.float32)["attention_mask"].shape == (1, 1, 2, 2)
+    with pytest.raises(ValueError, match="Invalid packing mode"):
+        pack_inputs([[5]], "off", "cpu", torch.float32)
+
+
+def test_pooling_matches_each_sequence_on_its_own():
+    lengths = [2, 3, 1]
+    hidden = torch.randn(1, sum(lengths), 4, dtype=torch.float16)
+    parts = hidden[0].split(lengths)
+    pooled = mean_pool(hidden, lengths)
+    assert pooled.dtype == torch.float32
+    for row, part in zip(pooled, parts):
+        assert torch.allclose(row, part.float().mean(0), atol=1e-3)
+    assert torch.equal(last_token_states(hidden, lengths), torch.stack([part[-1] for part in parts]))
+
+
+def test_padding_stats_compare_packed_with_padded_slots():
+    stats = PaddingStats()
+    assert stats.record([2, 4], packed=False)["padding_efficiency"] == 0.75
+    last = stats.record([2, 4], packed=True)
+    assert (last["padding_efficiency"], last["padded_efficiency"]) == (1.0, 0.75)
+    assert stats.stats()["slots"] == 8 + 6
@@ -0,0 +1,63 @@
+import asyncio
+
+from priority_scheduler import PriorityScheduler
+
+
+def test_bulk_slices_run_on_every_replica_and_yield_to_interactive():
+    async def run():
+        scheduler = PriorityScheduler(slice_size=1, max_bulk_slices=2)
+        running, peak, order = 0, 0, []
+
+        async def slice_fn(items):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            order.append("bulk")
+            return items
+
+        async def interactive():
+            async with scheduler.interactive():
+                await asyncio.sleep(0.05)
+                order.append("interactive")
+
+        interactive_task = asyncio.create_task(interactive())
+        await asyncio.sleep(0)
+        await asyncio.gather(
+            scheduler.run_bulk([1, 2, 3], slice_fn),
+            scheduler.run_bulk([4, 5, 6], slice_fn),
+        )
+        await interactive_task
+        return peak, order
+
+    peak, order = asyncio.run(run())
+    assert peak == 2
+    assert order[0] == "interactive"
+
+
+def test_bulk_work_progresses_under_steady_interactive_load():
+    async def run():
+        scheduler = PriorityScheduler(slice_size=1, max_bulk_wait=0.01)
+        stop = asyncio.Event()
+
+        async def interactive_load():
+            # interactive work in flight the whole time
+            async with scheduler.interactive():
+                await stop.wait()
+
+        async def slice_fn(items):
+            return items
+
+        load = asyncio.create_task(interactive_load())
+        await asyncio.sleep(0)
+        try:
+            results = await asyncio.wait_for(scheduler.run_bulk([1, 2, 3], slice_fn), 1)
+        finally:
+            stop.set()
+            await load
+        return results, scheduler.stats()
+
+    results, stats = asyncio.run(run())
+    assert results == [[1], [2], [3]]
+    assert stats["aged_bulk_slices"] == 3
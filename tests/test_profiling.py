@@ -0,0 +1,37 @@
+import json
+import threading
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from profiling import Profiler  # noqa: E402
+
+
+def test_flagged_profile_records_model_ops_of_other_threads(tmp_path):
+    try:
+        torch._C._profiler._ExperimentalConfig(profile_all_threads=True)
+    except (AttributeError, TypeError):
+        pytest.skip("torch cannot profile other threads")
+    profiler = Profiler(enabled=True, store_dir=str(tmp_path), slow_ms=60_000)
+    model = torch.nn.Linear(16, 4)
+
+    def forward():
+        with torch.no_grad():
+            model(torch.randn(8, 16))
+
+    try:
+        with profiler.profile("POST /embeddings", force=True, request_id="req"):
+            # like the inference worker: the forward pass runs off the request's thread
+            thread = threading.Thread(target=forward)
+            thread.start()
+            thread.join()
+        profiler._writer.shutdown(wait=True)
+    finally:
+        profiler.sampler.stop()
+
+    (profile,) = profiler.list()
+    assert profile["torch_trace"]
+    with open(profiler.torch_trace_path(profile["id"])) as f:
+        names = {event.get("name") for event in json.load(f)["traceEvents"]}
+    assert names & {"aten::linear", "aten::addmm"}
@@ -0,0 +1,125 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from token_cache import TokenCache
+
+RERANKER_SRC = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "worker-qwen3-reranker", "src"
+)
+
+
+@pytest.fixture(scope="module")
+def reranker():
+    # the worker has its own config module, which must not shadow src/config.py
+    saved = sys.modules.pop("config", None)
+    sys.path.insert(0, RERANKER_SRC)
+    try:
+        return importlib.import_module("reranker_service")
+    finally:
+        sys.path.remove(RERANKER_SRC)
+        sys.modules.pop("config", None)
+        if saved is not None:
+            sys.modules["config"] = saved
+
+
+class WordTokenizer:
+    """one id per whitespace-separated word"""
+
+    def __init__(self):
+        self.vocab = {}
+
+    def __call__(self, texts):
+        return [[self.vocab.setdefault(word, len(self.vocab) + 10) for word in text.split()] for text in texts]
+
+
+def make_service(reranker, max_length=12, window_overlap=1):
+    """a service with a word tokenizer and no model; heads are 5 words"""
+    service = reranker.Qwen3RerankerService.__new__(reranker.Qwen3RerankerService)
+    service.config = reranker.RerankerConfig()
+    service.config.max_length = max_length
+    service.config.window_overlap = window_overlap
+    service.token_cache = TokenCache(WordTokenizer())
+    service.prefix_tokens, service.suffix_tokens = [1], [2]
+    return service
+
+
+DOC = " ".join(f"d{i}" for i in range(8))
+
+
+def test_document_truncation_keeps_the_whole_query(reranker):
+    service = make_service(reranker)
+    usage = {}
+    (sequence,), owners = service.tokenize_pairs("q", [DOC], "i", truncation="document", usage=usage)
+    head, doc = service.token_cache.encode([service.format_head("i", "q"), f" {DOC}"])[0]
+    # 12 tokens minus prefix and suffix leave 5 for the document
+    assert sequence == head + doc[:5]
+    assert owners == [0]
+    assert (usage["truncated_documents"], usage["scored_sequences"]) == (1, 1)
+
+
+def test_head_tail_truncation_keeps_both_ends(reranker):
+    service = make_service(reranker)
+    (sequence,), _ = service.tokenize_pairs("q", [DOC], "i", truncation="head_tail")
+    doc = service.token_cache.encode([f" {DOC}"])[0][0]
+    assert sequence[5:] == doc[:3] + doc[-2:]
+
+
+def test_max_tokens_per_doc_tightens_the_budget(reranker):
+    service = make_service(reranker, max_length=100)
+    sequences, _ = service.tokenize_pairs("q", [DOC, "short"], "i", truncation="document", max_tokens_per_doc=3)
+    assert [len(s) for s in sequences] == [5 + 3, 5 + 1]
+
+
+def test_split_documents_scores_overlapping_windows(reranker):
+    service = make_service(reranker)
+    usage = {}
+    sequences, owners = service.tokenize_pairs("q", ["short", DOC], "i", split_documents=True, usage=usage)
+    doc = service.token_cache.encode([f" {DOC}"])[0][0]
+    assert owners == [0, 1, 1]
+    assert [s[5:] for s in sequences[1:]] == [doc[0:5], doc[4:9]]
+    assert (usage["truncated_documents"], usage["scored_sequences"]) == (0, 3)
+
+
+def test_query_that_fills_the_budget_is_rejected(reranker):
+    service = make_service(reranker, max_length=7)
+    with pytest.raises(ValueError, match="leaving none for documents"):
+        service.tokenize_pairs("q", [DOC], "i", truncation="document")
+    with pytest.raises(ValueError, match="Invalid truncation"):
+        service.tokenize_pairs("q", [DOC], "i", truncation="tail")
+
+
+def test_yes_no_head_matches_full_logits(reranker):
+    import torch
+    from transformers import Qwen3Config, Qwen3ForCausalLM
+
+    torch.manual_seed(0)
+    config = Qwen3Config(
+        vocab_size=64,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        head_dim=8,
+        tie_word_embeddings=False,
+    )
+    service = make_service(reranker)
+    service.model = Qwen3ForCausalLM(config).eval()
+    service.token_false_id, service.token_true_id = 3, 4
+    service.yes_no_weight = service.model.get_output_embeddings().weight[[3, 4]].detach().clone()
+    service.yes_no_bias = None
+    service.score_head = "yes_no"
+    # the second row is left-padded, as pad_inputs does
+    inputs = {
+        "input_ids": torch.tensor([[5, 6, 7, 8, 9, 10], [0, 0, 11, 12, 13, 14]]),
+        "attention_mask": torch.tensor([[1, 1, 1, 1, 1, 1], [0, 0, 1, 1, 1, 1]]),
+    }
+    yes_no = service.score_batch(inputs, head="yes_no")
+    full = service.score_batch(inputs, head="full")
+    assert torch.allclose(yes_no, full, atol=1e-5)
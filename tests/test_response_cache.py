@@ -0,0 +1,57 @@
+import asyncio
+
+from response_cache import COALESCED, MISS, ResponseCache
+
+
+class Timeout(Exception):
+    pass
+
+
+def _run_pair(cache, leader, follower):
+    async def run():
+        first = asyncio.ensure_future(cache.get_or_compute(b"k", leader))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_or_compute(b"k", follower))
+        return await asyncio.gather(first, second, return_exceptions=True)
+
+    return asyncio.run(run())
+
+
+async def _expired():
+    await asyncio.sleep(0.01)
+    raise Timeout()
+
+
+async def _answer():
+    return "response"
+
+
+def test_follower_retries_under_its_own_deadline_after_a_timeout():
+    cache = ResponseCache(retry_on=lambda error: isinstance(error, Timeout))
+    first, second = _run_pair(cache, _expired, _answer)
+    assert isinstance(first, Timeout)
+    assert second == ("response", MISS)
+    assert cache.stats()["retried"] == 1
+
+
+def test_other_failures_reach_every_coalesced_caller():
+    cache = ResponseCache(retry_on=lambda error: isinstance(error, Timeout))
+
+    async def broken():
+        await asyncio.sleep(0.01)
+        raise ValueError("bad request")
+
+    first, second = _run_pair(cache, broken, _answer)
+    assert isinstance(first, ValueError) and isinstance(second, ValueError)
+
+
+def test_followers_share_a_successful_result():
+    cache = ResponseCache()
+
+    async def slow():
+        await asyncio.sleep(0.01)
+        return "response"
+
+    first, second = _run_pair(cache, slow, _answer)
+    assert first == ("response", MISS)
+    assert second == ("response", COALESCED)
@@ -0,0 +1,20 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from serialization import dumps, float_rows, loads
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+
+def test_dumps_writes_arrays_and_numpy_scalars():
+    data = loads(dumps({"embeddings": np.array([[0.5, 1.0]], dtype=np.float32), "n": np.int64(2)}))
+    assert data == {"embeddings": [[0.5, 1.0]], "n": 2}
+    assert float_rows(np.array([[0.5]], dtype=np.float32)) == [[0.5]]
+
+
+def test_handler_helpers_do_not_import_starlette():
+    code = "import sys, utils, validation; sys.exit('starlette' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code], cwd=SRC).returncode == 0
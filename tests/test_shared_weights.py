@@ -0,0 +1,27 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from shared_weights import load_shared  # noqa: E402
+
+
+def test_load_shared_maps_the_checkpoint_and_initializes_only_the_new_head(tmp_path):
+    config = transformers.BertConfig(
+        vocab_size=64, hidden_size=16, num_hidden_layers=1, num_attention_heads=2, intermediate_size=32, num_labels=1
+    )
+    base = transformers.BertModel(config).eval()
+    base.save_pretrained(tmp_path / "model", safe_serialization=True)
+
+    model = load_shared(
+        transformers.AutoModelForSequenceClassification, str(tmp_path / "model"), str(tmp_path / "shared")
+    )
+
+    assert not any(param.is_meta for param in model.parameters())
+    for name, tensor in base.state_dict().items():
+        assert torch.equal(model.bert.state_dict()[name], tensor), name
+    # the head is not in the checkpoint: allocated in this process and initialized
+    assert model.classifier.weight.abs().sum() > 0
+    with torch.no_grad():
+        logits = model(input_ids=torch.tensor([[1, 2, 3]])).logits
+    assert logits.shape == (1, 1) and torch.isfinite(logits).all()
@@ -0,0 +1,32 @@
+from token_budget import bucket_limit, budget_slices, padded_tokens
+
+
+def test_padded_tokens_counts_every_item_at_the_longest_length():
+    assert padded_tokens([3, 10, 4]) == 30
+    assert padded_tokens([]) == 0
+
+
+def test_slices_are_cut_longest_first_within_the_token_budget():
+    lengths = [10, 100, 20, 100, 10]
+    slices = budget_slices(lengths, max_tokens=200, max_items=8)
+    assert slices == [[1, 3], [2, 0, 4]]
+    assert all(padded_tokens([lengths[i] for i in s]) <= 200 for s in slices)
+    assert sorted(i for s in slices for i in s) == list(range(len(lengths)))
+
+
+def test_an_input_longer_than_the_budget_gets_a_slice_of_its_own():
+    assert budget_slices([500, 10, 10], max_tokens=100, max_items=8) == [[0], [1, 2]]
+
+
+def test_no_budget_batches_by_items_alone():
+    assert budget_slices([5] * 5, max_tokens=0, max_items=2) == [[0, 1], [2, 3], [4]]
+
+
+def test_calibrated_bucket_limits_cap_the_slices():
+    limits = {16: 8, 128: 2}
+    assert bucket_limit(10, limits) == 8
+    assert bucket_limit(100, limits) == 2
+    # past the largest bucket the limit shrinks with the length
+    assert bucket_limit(256, limits) == 1
+    assert bucket_limit(10, None) is None
+    assert budget_slices([100, 100, 100], max_tokens=0, max_items=8, limits=limits) == [[0, 1], [2]]
@@ -0,0 +1,39 @@
+from token_cache import TokenCache, merge_stats
+
+
+def test_repeated_texts_are_tokenized_once():
+    calls = []
+
+    def encode(texts):
+        calls.append(list(texts))
+        return [[len(word) for word in text.split()] for text in texts]
+
+    cache = TokenCache(encode, max_entries=2)
+    ids, stats = cache.encode(["a bb", "ccc", "a bb"])
+    assert ids == [[1, 2], [3], [1, 2]]
+    assert calls == [["a bb", "ccc"]]
+    assert (stats["cache_hits"], stats["cache_misses"]) == (1, 2)
+
+    ids, stats = cache.encode(["ccc"])
+    assert ids == [[3]] and len(calls) == 1
+    assert stats["cache_hits"] == 1 and stats["tokenize_ms"] == 0
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = TokenCache(lambda texts: [[len(text)] for text in texts], max_entries=2)
+    cache.encode(["a", "bb"])
+    cache.encode(["a"])
+    cache.encode(["ccc"])
+    assert cache.stats()["entries"] == 2
+    _, stats = cache.encode(["a", "bb"])
+    # "bb" was the least recently used entry
+    assert stats["cache_misses"] == 1
+
+
+def test_merge_stats_always_reports_tokenize_times():
+    assert merge_stats(None) == dict(tokenize_ms=0.0, tokenize_saved_ms=0.0)
+    merged = merge_stats(
+        dict(cache_hits=1, cache_misses=0, tokenize_ms=0.0, tokenize_saved_ms=0.25),
+        dict(tokenize_ms=1.5),
+    )
+    assert merged == dict(tokenize_ms=1.5, tokenize_saved_ms=0.25, cache_hits=1, cache_misses=0)
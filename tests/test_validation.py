@@ -0,0 +1,26 @@
+import pytest
+
+from validation import ValidationError, validate_job_input, validate_openai_input
+
+
+@pytest.mark.parametrize("route", ["/v1/models", "/debug/traces", "/v1/embeddings"])
+def test_openai_input_must_be_an_object_on_every_route(route):
+    with pytest.raises(ValidationError, match="openai_input must be an object"):
+        validate_openai_input(route, "x")
+
+
+def test_models_route_needs_no_input():
+    validate_openai_input("/v1/models", None)
+    validate_openai_input("/v1/models", {})
+
+
+def test_job_with_non_object_openai_input_is_rejected():
+    with pytest.raises(ValidationError):
+        validate_job_input({"openai_route": "/v1/models", "openai_input": "x"})
+
+
+def test_top_level_deadline_is_checked_for_openai_routes():
+    with pytest.raises(ValidationError):
+        validate_job_input({"openai_route": "/v1/models", "deadline": "soon"})
+    with pytest.raises(ValidationError):
+        validate_job_input({"openai_route": "/v1/models", "openai_input": {"timeout_ms": "1s"}})
@@ -6,6 +6,12 @@ class RerankerConfig:
         # Model configuration
         self.model_name = os.environ.get("MODEL_NAME", "Qwen/Qwen3-Reranker-0.6B")
         self.max_length = int(os.environ.get("MAX_LENGTH", "8192"))
+        # documents scored per forward pass; deadlines are checked between batches
+        self.batch_size = int(os.environ.get("BATCH_SIZE", "32"))
+        # tokenized instruction/query heads and documents kept in the LRU token cache
+        self.token_cache_size = int(os.environ.get("TOKEN_CACHE_SIZE", "65536"))
+        # tokens shared by neighbouring windows when long documents are split
+        self.window_overlap = int(os.environ.get("DOC_WINDOW_OVERLAP", "64"))
         self.device = os.environ.get("DEVICE", "cuda" if self._check_cuda() else "cpu")
         
         # RunPod configuration
@@ -14,6 +20,17 @@ class RerankerConfig:
         # Performance settings
         self.use_flash_attention = os.environ.get("USE_FLASH_ATTENTION", "false").lower() == "true"
         self.torch_dtype = os.environ.get("TORCH_DTYPE", "float16")
+        # "yes_no" projects only the last hidden state onto the yes/no LM head
+        # rows, "full" computes full-vocabulary logits at every position
+        self.score_head = os.environ.get("SCORE_HEAD", "yes_no")
+        # at startup, compare the yes/no head with full logits and fall back
+        # to "full" if scores differ by more than the tolerance
+        self.score_parity_check = os.environ.get("SCORE_PARITY_CHECK", "true").lower() == "true"
+        self.score_parity_tolerance = float(os.environ.get("SCORE_PARITY_TOLERANCE", "1e-3"))
+        # "varlen" (needs USE_FLASH_ATTENTION) or "mask" score unpadded packs of
+        # at most PACK_MAX_TOKENS tokens instead of padded micro-batches
+        self.packing = os.environ.get("PACKING", "off")
+        self.pack_max_tokens = int(os.environ.get("PACK_MAX_TOKENS", "16384"))
         
     def _check_cuda(self) -> bool:
         try:
@@ -2,7 +2,8 @@ import runpod
 import asyncio
 import logging
 import os
-from typing import Any, Dict
+import time
+from typing import Any, Dict, Optional
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -18,7 +19,7 @@ else:
     logger.info("Model will be downloaded from HuggingFace")
 
 # Import after setting environment
-from reranker_service import Qwen3RerankerService
+from reranker_service import DeadlineExceeded, Qwen3RerankerService
 
 # Initialize service
 try:
@@ -33,6 +34,28 @@ except Exception as e:
     sys.exit(1)
 
 
+def resolve_deadline(params: Dict[str, Any]) -> Optional[float]:
+    """Absolute unix deadline from `deadline` and/or `timeout_ms` (relative to now)"""
+    candidates = []
+    if params.get("deadline") is not None:
+        candidates.append(float(params["deadline"]))
+    if params.get("timeout_ms") is not None:
+        candidates.append(time.time() + float(params["timeout_ms"]) / 1000)
+    return min(candidates) if candidates else None
+
+
+def truncation_options(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Per-request document truncation settings, defaults left to the service"""
+    options = {}
+    if params.get("max_tokens_per_doc") is not None:
+        options["max_tokens_per_doc"] = int(params["max_tokens_per_doc"])
+    if params.get("truncation") is not None:
+        options["truncation"] = params["truncation"]
+    if params.get("split_documents") is not None:
+        options["split_documents"] = bool(params["split_documents"])
+    return options
+
+
 def handler(job: Dict[str, Any]) -> Dict[str, Any]:
     """Handle RunPod job requests"""
     try:
@@ -66,9 +89,12 @@ def handler(job: Dict[str, Any]) -> Dict[str, Any]:
                 # Extract parameters
                 query = rerank_input["query"]
                 documents = rerank_input["documents"]
-                instruction = rerank_input.get("extra_body", {}).get("instruction")
+                extra_body = rerank_input.get("extra_body", {})
+                instruction = extra_body.get("instruction")
                 return_documents = rerank_input.get("return_documents", True)
                 top_k = rerank_input.get("top_k")
+                deadline = resolve_deadline(rerank_input)
+                truncation_params = truncation_options({**extra_body, **rerank_input})
                 
                 # Perform reranking
                 result = reranker_service.rerank(
@@ -76,7 +102,9 @@ def handler(job: Dict[str, Any]) -> Dict[str, Any]:
                     documents=documents,
                     instruction=instruction,
                     return_documents=return_documents,
-                    top_k=top_k
+                    top_k=top_k,
+                    deadline=deadline,
+                    **truncation_params
                 )
                 
                 return result
@@ -89,7 +117,11 @@ def handler(job: Dict[str, Any]) -> Dict[str, Any]:
                         "id": "Qwen3-Reranker-0.6B",
                         "object": "model",
                         "created": 1754341335,
-                        "owned_by": "qwen"
+                        "owned_by": "qwen",
+                        "stats": {
+                            "dropped": reranker_service.dropped,
+                            "padding": reranker_service.padding_stats.stats()
+                        }
                     }]
                 }
             else:
@@ -108,6 +140,8 @@ def handler(job: Dict[str, Any]) -> Dict[str, Any]:
             instruction = job_input.get("instruction")
             return_documents = job_input.get("return_documents", job_input.get("return_docs", True))
             top_k = job_input.get("top_k")
+            deadline = resolve_deadline(job_input)
+            truncation_params = truncation_options(job_input)
             
             # Validate
             if not query:
@@ -121,11 +155,28 @@ def handler(job: Dict[str, Any]) -> Dict[str, Any]:
                 documents=documents,
                 instruction=instruction,
                 return_documents=return_documents,
-                top_k=top_k
+                top_k=top_k,
+                deadline=deadline,
+                **truncation_params
             )
             
             return result
             
+    except DeadlineExceeded as e:
+        logger.warning(f"Dropped expired request: {e}")
+        return {
+            "error": {
+                "message": str(e),
+                "type": "timeout_error"
+            }
+        }
+    except ValueError as e:
+        return {
+            "error": {
+                "message": str(e),
+                "type": "invalid_request_error"
+            }
+        }
     except Exception as e:
         logger.error(f"Error processing request: {e}", exc_info=True)
         return {
@@ -1,15 +1,51 @@
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional, Tuple
 import logging
+import time
 from config import RerankerConfig
+from token_cache import TokenCache
+from packing import PACKING_MODES, PaddingStats, last_token_states, pack_groups, pack_inputs
 
 logger = logging.getLogger(__name__)
 
+# how a document that does not fit the token budget is cut:
+#   head      - the formatted pair is cut from the end (may reach into the query)
+#   document  - only the document is cut, keeping its beginning
+#   head_tail - only the document is cut, keeping its beginning and its end
+TRUNCATION_POLICIES = ("head", "document", "head_tail")
+SCORE_HEADS = ("yes_no", "full")
+
+# scored with both heads by check_score_parity
+PARITY_QUERY = "What is the capital of China?"
+PARITY_DOCUMENTS = [
+    "The capital of China is Beijing.",
+    "Gravity is a force that attracts two bodies towards each other.",
+    "Shanghai is the largest city in China by population.",
+]
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised instead of scoring documents whose caller has stopped waiting"""
+
+
+def dedupe(items: List[str]) -> Tuple[List[str], List[int]]:
+    """Unique items in first-seen order plus, per original position, its unique index"""
+    positions: Dict[str, int] = {}
+    inverse = [positions.setdefault(item, len(positions)) for item in items]
+    return list(positions), inverse
+
 
 class Qwen3RerankerService:
     def __init__(self):
         self.config = RerankerConfig()
+        # work dropped because its deadline passed
+        self.dropped = {"expired_requests": 0, "dropped_documents": 0}
+        # real tokens / token slots computed per micro-batch
+        self.padding_stats = PaddingStats()
+        # pads the next micro-batch while the current one runs on the device
+        self._prep = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank-prep")
         self._load_model()
         
     def _load_model(self):
@@ -29,6 +65,12 @@ class Qwen3RerankerService:
             "local_files_only": True if self.config.model_name.startswith("/") else False
         }
         
+        if self.config.packing not in PACKING_MODES:
+            raise ValueError(f"Invalid PACKING '{self.config.packing}', expected one of {list(PACKING_MODES)}")
+        if self.config.packing == "varlen" and not self.config.use_flash_attention:
+            raise ValueError("PACKING=varlen needs USE_FLASH_ATTENTION=true")
+        self.packing = self.config.packing
+        
         if self.config.use_flash_attention:
             model_kwargs["attn_implementation"] = "flash_attention_2"
             
@@ -52,28 +94,131 @@ class Qwen3RerankerService:
         self.prefix_tokens = self.tokenizer.encode(self.prefix, add_special_tokens=False)
         self.suffix_tokens = self.tokenizer.encode(self.suffix, add_special_tokens=False)
         
+        # Instruction/query heads and documents repeat across requests, so they
+        # are tokenized separately, cached, and joined as token ids per pair
+        self.token_cache = TokenCache(
+            lambda texts: self.tokenizer(
+                texts,
+                padding=False,
+                add_special_tokens=False,
+                return_attention_mask=False
+            )['input_ids'],
+            max_entries=self.config.token_cache_size
+        )
+        
+        # Yes/no rows of the LM head: scores only need these two logits at the
+        # last position, not the full vocabulary at every position
+        if self.config.score_head not in SCORE_HEADS:
+            raise ValueError(f"Invalid SCORE_HEAD '{self.config.score_head}', expected one of {list(SCORE_HEADS)}")
+        self.score_head = self.config.score_head
+        lm_head = self.model.get_output_embeddings()
+        yes_no_rows = [self.token_false_id, self.token_true_id]
+        self.yes_no_weight = lm_head.weight[yes_no_rows].detach().clone()
+        self.yes_no_bias = (
+            lm_head.bias[yes_no_rows].detach().clone() if getattr(lm_head, "bias", None) is not None else None
+        )
+        
         logger.info("Model loaded successfully")
         
-    def format_instruction(self, instruction: Optional[str], query: str, doc: str) -> str:
-        """Format the input according to Qwen3 reranker requirements"""
+        if self.score_head == "yes_no" and self.config.score_parity_check:
+            diff = self.check_score_parity()
+            if diff > self.config.score_parity_tolerance:
+                logger.error(
+                    f"Yes/no head scores differ from full logits by {diff:.2e} "
+                    f"(> {self.config.score_parity_tolerance:.0e}), using full logits"
+                )
+                self.score_head = "full"
+            else:
+                logger.info(f"Yes/no head matches full logits (max score difference {diff:.2e})")
+        
+    def format_head(self, instruction: Optional[str], query: str) -> str:
+        """Instruction and query part of a pair, up to the document"""
         if instruction is None:
             instruction = 'Given a web search query, retrieve relevant passages that answer the query'
-        output = f"<Instruct>: {instruction}\n<Query>: {query}\n<Document>: {doc}"
-        return output
+        return f"<Instruct>: {instruction}\n<Query>: {query}\n<Document>:"
+    
+    def format_instruction(self, instruction: Optional[str], query: str, doc: str) -> str:
+        """Format the input according to Qwen3 reranker requirements"""
+        return f"{self.format_head(instruction, query)} {doc}"
     
-    def process_inputs(self, pairs: List[str]) -> Dict[str, torch.Tensor]:
-        """Tokenize and prepare inputs for the model"""
-        inputs = self.tokenizer(
-            pairs, 
-            padding=False, 
-            truncation='longest_first',
-            return_attention_mask=False, 
-            max_length=self.config.max_length - len(self.prefix_tokens) - len(self.suffix_tokens)
+    def tokenize_pairs(
+        self,
+        query: str,
+        documents: List[str],
+        instruction: Optional[str] = None,
+        truncation: str = "head",
+        max_tokens_per_doc: Optional[int] = None,
+        split_documents: bool = False,
+        usage: Optional[Dict] = None
+    ) -> Tuple[List[List[int]], List[int]]:
+        """
+        Token ids of each (instruction, query, document) pair, without the
+        prefix/suffix, and the document index each sequence scores.
+        Documents are cut to `max_tokens_per_doc` and to what is left of
+        MAX_LENGTH after the query, following `truncation`; with
+        `split_documents` they are split into overlapping windows instead,
+        each scored as its own sequence.
+        Cache hits and tokenization time spent/saved are added to `usage`.
+        """
+        if truncation not in TRUNCATION_POLICIES:
+            raise ValueError(f"Invalid truncation '{truncation}', expected one of {list(TRUNCATION_POLICIES)}")
+        if max_tokens_per_doc is not None and max_tokens_per_doc < 1:
+            raise ValueError("max_tokens_per_doc must be a positive integer")
+        
+        # the document keeps its leading space so the ids match tokenizing the whole pair
+        token_ids, stats = self.token_cache.encode(
+            [self.format_head(instruction, query)] + [f" {doc}" for doc in documents]
         )
+        if usage is not None:
+            for key, value in stats.items():
+                usage[key] = usage.get(key, 0) + value
+        head, doc_ids = token_ids[0], token_ids[1:]
         
+        budget = self.config.max_length - len(self.prefix_tokens) - len(self.suffix_tokens)
+        doc_budget = budget - len(head)
+        if max_tokens_per_doc is not None:
+            doc_budget = min(doc_budget, max_tokens_per_doc)
+        if doc_budget < 1 and (truncation != "head" or split_documents):
+            raise ValueError(
+                f"Instruction and query take {len(head)} of {budget} tokens, leaving none for documents"
+            )
+        overlap = min(self.config.window_overlap, doc_budget // 2)
+        
+        sequences, owners = [], []
+        truncated = 0
+        for index, ids in enumerate(doc_ids):
+            if len(ids) <= doc_budget:
+                windows = [ids]
+            elif split_documents:
+                windows = [
+                    ids[start:start + doc_budget]
+                    for start in range(0, len(ids) - overlap, doc_budget - overlap)
+                ]
+            elif truncation == "head_tail":
+                tail = doc_budget // 2
+                windows = [ids[:doc_budget - tail] + (ids[-tail:] if tail else [])]
+            else:
+                windows = [ids[:max(doc_budget, 0)]]
+            if len(windows) == 1 and len(windows[0]) < len(ids):
+                truncated += 1
+            for window in windows:
+                sequences.append((head + window)[:budget])
+                owners.append(index)
+        
+        if usage is not None:
+            usage["truncated_documents"] = usage.get("truncated_documents", 0) + truncated
+            usage["scored_sequences"] = usage.get("scored_sequences", 0) + len(sequences)
+        return sequences, owners
+    
+    def pad_inputs(self, token_ids: List[List[int]]) -> Dict[str, torch.Tensor]:
+        """
+        Add the prefix/suffix to tokenized pairs and pad them on the host,
+        in pinned memory when the model is on the GPU so the copy can be async
+        """
         # Add prefix and suffix tokens
-        for i, ele in enumerate(inputs['input_ids']):
-            inputs['input_ids'][i] = self.prefix_tokens + ele + self.suffix_tokens
+        inputs = {
+            'input_ids': [self.prefix_tokens + ele + self.suffix_tokens for ele in token_ids]
+        }
             
         # Pad inputs
         inputs = self.tokenizer.pad(
@@ -83,22 +228,73 @@ class Qwen3RerankerService:
             max_length=self.config.max_length
         )
         
-        # Move to device
-        for key in inputs:
-            inputs[key] = inputs[key].to(self.model.device)
-            
+        if self.model.device.type == "cuda":
+            return {key: value.pin_memory() for key, value in inputs.items()}
+        return dict(inputs)
+    
+    def pack_batch(self, token_ids: List[List[int]]) -> Dict[str, torch.Tensor]:
+        """
+        Add the prefix/suffix to tokenized pairs and pack them into one
+        unpadded row on the host (pinned on the GPU, like pad_inputs)
+        """
+        sequences = [self.prefix_tokens + ele + self.suffix_tokens for ele in token_ids]
+        inputs = pack_inputs(sequences, self.packing, "cpu", self.model.dtype)
+        if self.model.device.type == "cuda":
+            return {key: value.pin_memory() for key, value in inputs.items()}
         return inputs
     
+    def to_device(self, inputs: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        """Non-blocking copy of padded inputs; ordered before the forward pass on the same stream"""
+        return {
+            key: value.to(self.model.device, non_blocking=True)
+            for key, value in inputs.items()
+        }
+    
+    def process_inputs(self, token_ids: List[List[int]]) -> Dict[str, torch.Tensor]:
+        """Add the prefix/suffix to tokenized pairs, pad and move them to the device"""
+        return self.to_device(self.pad_inputs(token_ids))
+    
+    def score_last_states(self, hidden: torch.Tensor, head: Optional[str] = None) -> torch.Tensor:
+        """Yes-probabilities from the final hidden state at each sequence's last token"""
+        if (head or self.score_head) == "yes_no":
+            batch_scores = torch.nn.functional.linear(hidden, self.yes_no_weight, self.yes_no_bias)
+        else:
+            batch_scores = self.model.get_output_embeddings()(hidden)
+            batch_scores = batch_scores[:, [self.token_false_id, self.token_true_id]]
+        batch_scores = torch.nn.functional.log_softmax(batch_scores.float(), dim=1)
+        return batch_scores[:, 1].exp()
+    
     @torch.no_grad()
-    def compute_scores(self, inputs: Dict[str, torch.Tensor]) -> List[float]:
-        """Compute reranking scores"""
+    def score_packed(self, inputs: Dict[str, torch.Tensor], lengths: List[int]) -> torch.Tensor:
+        """Yes-probabilities of a packed row, left on the device (no host sync)"""
+        hidden = self.model.base_model(**inputs).last_hidden_state
+        return self.score_last_states(last_token_states(hidden, lengths))
+    
+    @torch.no_grad()
+    def score_batch(self, inputs: Dict[str, torch.Tensor], head: Optional[str] = None) -> torch.Tensor:
+        """Yes-probabilities of a batch, left on the device (no host sync)"""
+        if (head or self.score_head) == "yes_no":
+            # final hidden state at the last position (inputs are left-padded)
+            hidden = self.model.base_model(**inputs).last_hidden_state[:, -1, :]
+            return self.score_last_states(hidden, head="yes_no")
         batch_scores = self.model(**inputs).logits[:, -1, :]
         true_vector = batch_scores[:, self.token_true_id]
         false_vector = batch_scores[:, self.token_false_id]
         batch_scores = torch.stack([false_vector, true_vector], dim=1)
-        batch_scores = torch.nn.functional.log_softmax(batch_scores, dim=1)
-        scores = batch_scores[:, 1].exp().tolist()
-        return scores
+        batch_scores = torch.nn.functional.log_softmax(batch_scores.float(), dim=1)
+        return batch_scores[:, 1].exp()
+    
+    def check_score_parity(self, query: str = PARITY_QUERY, documents: Optional[List[str]] = None) -> float:
+        """Max absolute difference between yes/no head and full-logit scores"""
+        sequences, _ = self.tokenize_pairs(query, documents or PARITY_DOCUMENTS)
+        inputs = self.process_inputs(sequences)
+        yes_no = self.score_batch(inputs, head="yes_no")
+        full = self.score_batch(inputs, head="full")
+        return (yes_no - full).abs().max().item()
+    
+    def compute_scores(self, inputs: Dict[str, torch.Tensor]) -> List[float]:
+        """Compute reranking scores"""
+        return self.score_batch(inputs).tolist()
     
     def rerank(
         self, 
@@ -106,7 +302,11 @@ class Qwen3RerankerService:
         documents: List[str], 
         instruction: Optional[str] = None,
         return_documents: bool = False,
-        top_k: Optional[int] = None
+        top_k: Optional[int] = None,
+        deadline: Optional[float] = None,
+        max_tokens_per_doc: Optional[int] = None,
+        truncation: str = "head",
+        split_documents: bool = False
     ) -> Dict:
         """
         Rerank documents based on the query
@@ -117,19 +317,73 @@ class Qwen3RerankerService:
             instruction: Optional custom instruction
             return_documents: Whether to return the documents with scores
             top_k: Return only top k results
+            deadline: Optional unix timestamp; remaining micro-batches are
+                dropped and DeadlineExceeded raised once it has passed
+            max_tokens_per_doc: Optional cap on the tokens kept per document
+            truncation: One of TRUNCATION_POLICIES
+            split_documents: Score long documents as overlapping windows and
+                keep each document's best window score
             
         Returns:
             Dictionary with scores and optionally reranked documents
         """
-        # Format inputs
-        pairs = [
-            self.format_instruction(instruction, query, doc) 
-            for doc in documents
-        ]
+        # Score each distinct document once
+        unique_documents, inverse = dedupe(documents)
+        
+        # Tokenize and truncate (or window) the pairs
+        tokenization = {}
+        sequences, owners = self.tokenize_pairs(
+            query,
+            unique_documents,
+            instruction=instruction,
+            truncation=truncation,
+            max_tokens_per_doc=max_tokens_per_doc,
+            split_documents=split_documents,
+            usage=tokenization
+        )
+        
+        # Score in micro-batches of batch_size sequences, or with packing in
+        # unpadded packs of up to pack_max_tokens tokens. Batch N+1 is padded
+        # (packed) on the prep thread while batch N runs; copies are
+        # non-blocking and scores stay on the device until a single host
+        # transfer at the end
+        affixes = len(self.prefix_tokens) + len(self.suffix_tokens)
+        lengths = [len(ids) + affixes for ids in sequences]
+        packed = self.packing != "off"
+        if packed:
+            batches = [(group[0], group[-1] + 1) for group in pack_groups(lengths, self.config.pack_max_tokens)]
+        else:
+            batch_size = self.config.batch_size
+            batches = [(start, start + batch_size) for start in range(0, len(sequences), batch_size)]
+        prepare = self.pack_batch if packed else self.pad_inputs
+        device_scores = []
+        tokens = slots = 0
+        pending = self._prep.submit(prepare, sequences[slice(*batches[0])]) if batches else None
+        for i, (start, end) in enumerate(batches):
+            if deadline is not None and time.time() >= deadline:
+                self.dropped["expired_requests"] += 1
+                self.dropped["dropped_documents"] += len(unique_documents) - owners[start]
+                raise DeadlineExceeded(
+                    f"Deadline passed after scoring {owners[start]}/{len(unique_documents)} documents"
+                )
+            host_inputs = pending.result()
+            if i + 1 < len(batches):
+                pending = self._prep.submit(prepare, sequences[slice(*batches[i + 1])])
+            inputs = self.to_device(host_inputs)
+            if packed:
+                device_scores.append(self.score_packed(inputs, lengths[start:end]))
+            else:
+                device_scores.append(self.score_batch(inputs))
+            batch_stats = self.padding_stats.record(lengths[start:end], packed)
+            tokens += batch_stats["tokens"]
+            slots += batch_stats["slots"]
+        sequence_scores = torch.cat(device_scores).tolist() if device_scores else []
         
-        # Process and score
-        inputs = self.process_inputs(pairs)
-        scores = self.compute_scores(inputs)
+        # windows of one document keep the best score
+        unique_scores = [float("-inf")] * len(unique_documents)
+        for owner, score in zip(owners, sequence_scores):
+            unique_scores[owner] = max(unique_scores[owner], score)
+        scores = [unique_scores[i] for i in inverse]
         
         # Create results
         results = []
@@ -152,5 +406,11 @@ class Qwen3RerankerService:
         return {
             "results": results,
             "model": self.config.model_name,
-            "query": query
+            "query": query,
+            "usage": {
+                "unique_documents": len(unique_documents),
+                "dedup_ratio": round(1 - len(unique_documents) / len(documents), 4),
+                "padding_efficiency": round(tokens / slots, 4) if slots else 1.0,
+                **{key: round(value, 3) for key, value in tokenization.items()},
+            }
         }
\ No newline at end of file
@@ -1,6 +1,8 @@
 import json
 import sys
 sys.path.append('src')
+# token_cache and packing are shared with the embedding worker
+sys.path.append('../src')
 
 # Import the handler
 from handler import handler
@@ -30,4 +32,12 @@ print("-" * 50)
 result = handler(test_job)
 
 # Print results
-print(json.dumps(result, indent=2))
\ No newline at end of file
+print(json.dumps(result, indent=2))
+
+# Yes/no head vs full-vocabulary logits on the same inputs
+from handler import reranker_service
+parity_diff = reranker_service.check_score_parity(
+    test_job["input"]["query"], test_job["input"]["documents"]
+)
+print(f"Yes/no head max score difference vs full logits: {parity_diff:.2e}")
+assert parity_diff <= reranker_service.config.score_parity_tolerance, "yes/no head parity failed"